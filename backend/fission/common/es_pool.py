@@ -0,0 +1,94 @@
+"""
+Shared Elasticsearch client for the Fission functions.
+
+The client is created lazily on first use and kept at module level, so warm invocations
+of the same pod reuse its keep-alive connections (and TLS sessions) instead of opening new
+ones on every call. A client is kept per URL + credentials.
+
+The credentials are read from the ES_USERNAME and ES_PASSWORD keys of the `shared-data`
+ConfigMap, and only re-read when the files change: the clients built with the old ones are
+closed and a new one is created.
+"""
+
+import logging
+import os
+import threading
+from typing import Dict, Optional, Tuple
+from elasticsearch8 import Elasticsearch
+from flask import current_app, has_app_context
+
+CONFIG_MAP = "shared-data"
+ES_URL = "https://elasticsearch-master.elastic.svc.cluster.local:9200"
+CONNECTIONS_PER_NODE = 10
+
+_clients: Dict[Tuple[str, str, str], Elasticsearch] = {}
+_auth: Optional[Tuple[str, str]] = None
+_auth_mtime: Optional[float] = None
+_lock = threading.Lock()
+
+
+def logger() -> logging.Logger:
+    """
+    Flask app logger inside an invocation, module logger otherwise
+    """
+    return current_app.logger if has_app_context() else logging.getLogger(__name__)
+
+
+def config(k: str) -> str:
+    """
+    Reads configuration from config map file
+    """
+    with open(f'/configs/default/{CONFIG_MAP}/{k}', 'r') as f:
+        return f.read()
+
+
+def config_mtime(*keys: str) -> float:
+    """
+    Latest modification time of the given keys in the config map
+    """
+    return max(os.path.getmtime(f'/configs/default/{CONFIG_MAP}/{k}') for k in keys)
+
+
+def get_es() -> Elasticsearch:
+    """
+    Returns the Elasticsearch client shared by warm invocations of the pod
+    :return: Elasticsearch
+    """
+    global _auth, _auth_mtime
+
+    with _lock:
+        mtime = config_mtime('ES_USERNAME', 'ES_PASSWORD')
+        if mtime != _auth_mtime:
+            _auth = (config('ES_USERNAME'), config('ES_PASSWORD'))
+            _auth_mtime = mtime
+
+        key = (ES_URL, *_auth)
+        es = _clients.get(key)
+        if es is None:
+            # credentials changed, drop the clients built with the old ones
+            for old in _clients.values():
+                old.close()
+            _clients.clear()
+
+            es = _clients[key] = Elasticsearch(
+                ES_URL,
+                verify_certs=False,
+                ssl_show_warn=False,
+                basic_auth=_auth,
+                connections_per_node=CONNECTIONS_PER_NODE
+            )
+            logger().info(f"Created Elasticsearch client for {ES_URL}")
+        return es
+
+
+def reset():
+    """
+    Close and forget every client, the next get_es call reads the credentials and creates a new one
+    """
+    global _auth, _auth_mtime
+
+    with _lock:
+        for es in _clients.values():
+            es.close()
+        _clients.clear()
+        _auth = _auth_mtime = None
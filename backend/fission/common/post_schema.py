@@ -0,0 +1,172 @@
+"""
+Unified post schema of the harvesters, and the serialiser of the pipeline.
+
+Every harvester converts its posts into Post records, classes with __slots__ that hold the
+fields of the schema without building the nested dicts. The dicts are only created by
+as_dict() when a record is serialised. All the posts of a batch share one fetchedAt, taken
+once per batch by fetched_at().
+
+    {"platform", "version", "fetchedAt", "sentiment", "sentimentLabel", "keywords",
+     "data": {"id", "createdAt", "content", "language", "sensitive", "favouritesCount",
+              "repliesCount", "tags", "url",
+              "account": {"id", "username", "createdAt", "followersCount/linkKarma",
+                          "followingCount/commentKarma"}}}
+
+Dates are ISO 8601 in UTC ending in Z. The dates of a Mastodon status are already in that
+form and are kept as they come.
+
+dumps() and loads() are the serialiser of the harvesters, enqueue, post-processor and addes:
+orjson if it is installed, the json module otherwise. Both write compact UTF-8 bytes and
+dumps() serialises Post records directly.
+"""
+
+import json
+from datetime import datetime, timezone
+from typing import Any, List, Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+VERSION = 1.1
+
+
+class Account:
+    """
+    Author of a post
+    """
+    __slots__ = ("id", "username", "created_at", "followers", "following")
+
+    def __init__(self, id: Optional[str], username: Optional[str], created_at: Optional[str] = None,
+                 followers: Optional[int] = 0, following: Optional[int] = 0):
+        self.id = id
+        self.username = username
+        self.created_at = created_at
+        # follower and following counts on Mastodon, link and comment karma on Reddit
+        self.followers = followers
+        self.following = following
+
+    def as_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "username": self.username,
+            "createdAt": self.created_at,
+            "followersCount/linkKarma": self.followers,
+            "followingCount/commentKarma": self.following,
+        }
+
+
+class Post:
+    """
+    A post in the unified schema, before sentiment and keywords are added by post-processor
+    """
+    __slots__ = ("platform", "fetched_at", "id", "created_at", "content", "language", "sensitive",
+                 "favourites", "replies", "tags", "url", "account")
+
+    def __init__(self, platform: str, fetched_at: str, id: str, created_at: Optional[str], content: str,
+                 language: Optional[str], sensitive: bool, favourites: int, replies: int, tags: List[str],
+                 url: Optional[str], account: Account):
+        self.platform = platform
+        self.fetched_at = fetched_at
+        self.id = id
+        self.created_at = created_at
+        self.content = content
+        self.language = language
+        self.sensitive = sensitive
+        self.favourites = favourites
+        self.replies = replies
+        self.tags = tags
+        self.url = url
+        self.account = account
+
+    def as_dict(self) -> dict:
+        return {
+            "platform": self.platform,
+            "version": VERSION,
+            "fetchedAt": self.fetched_at,
+            "sentiment": None,
+            "sentimentLabel": None,
+            "keywords": [],
+            "data": {
+                "id": self.id,
+                "createdAt": self.created_at,
+                "content": self.content,
+                "language": self.language,
+                "sensitive": self.sensitive,
+                "favouritesCount": self.favourites,
+                "repliesCount": self.replies,
+                "tags": self.tags,
+                "url": self.url,
+                "account": self.account.as_dict(),
+            },
+        }
+
+
+def fetched_at() -> str:
+    """
+    fetchedAt of a batch, taken once for all its posts
+    """
+    return datetime.now(timezone.utc).isoformat(timespec="seconds").replace("+00:00", "Z")
+
+
+def from_timestamp(ts: Optional[float]) -> Optional[str]:
+    """
+    ISO date of an epoch in seconds, None if it is missing
+    """
+    if not ts:
+        return None
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat(timespec="seconds").replace("+00:00", "Z")
+
+
+def from_mastodon(status: dict, fetched: str) -> Post:
+    """
+    Post of a Mastodon status, as returned in JSON by the timelines and the streaming API
+    :param status: status of the API
+    :param fetched: fetchedAt of the batch
+    """
+    account = status["account"]
+    return Post(
+        platform="Mastodon",
+        fetched_at=fetched,
+        id=status.get("id"),
+        created_at=status.get("created_at"),
+        content=status.get("content"),
+        language=status.get("language"),
+        sensitive=status.get("sensitive", False),
+        favourites=status.get("favourites_count", 0),
+        replies=status.get("replies_count", 0),
+        tags=[t["name"] for t in status.get("tags", [])],
+        url=status.get("url"),
+        account=Account(
+            id=account.get("id"),
+            username=account.get("username"),
+            created_at=account.get("created_at"),
+            followers=account.get("followers_count", 0),
+            following=account.get("following_count", 0),
+        ),
+    )
+
+
+def _default(obj: Any) -> Any:
+    if isinstance(obj, (Post, Account)):
+        return obj.as_dict()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(obj: Any) -> bytes:
+    """
+    Compact UTF-8 JSON of a record, a document or a list of them
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default)
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads(data: Any) -> Any:
+    """
+    Parse JSON bytes or text, raises ValueError if it is not valid
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
@@ -0,0 +1,215 @@
+"""
+Shared queue publisher for the harvesters.
+
+The harvesters send the formatted posts of a tick to the enqueue route. publish() serialises
+every post once by post_schema.dumps and sends them as JSON arrays of up to PUBLISH_BATCH_SIZE
+posts, which enqueue pushes with one LPUSH each, so a page costs one router call instead of
+one per post. When there is more than one batch they are sent concurrently from a bounded pool
+of worker threads.
+
+The HTTP session is created lazily on first use and kept at module level, so warm
+invocations of the same pod reuse their keep-alive connections to the router. A request
+that fails with a connection error, a timeout, a 429 or a 5xx status is retried with
+exponential backoff and full jitter. A batch refused with another status (a 413 for a body
+too large, any other 4xx) is sent again one post at a time, so only the posts refused on
+their own are lost.
+
+Settings are read from the optional `queue-config` ConfigMap, any missing key falls back
+to the default below:
+- PUBLISH_BATCH_SIZE: posts per request
+- PUBLISH_CONCURRENCY: requests in flight at the same time
+- PUBLISH_TIMEOUT: seconds per request
+- PUBLISH_RETRIES: extra attempts per request
+- PUBLISH_BACKOFF: seconds, base of the backoff between attempts
+
+publish() returns the metrics of the tick (posts sent and failed, requests, retries, posts
+sent one by one, latency percentiles and wall time) and writes them to the logs.
+"""
+
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Any, List, Optional
+import requests
+from requests.adapters import HTTPAdapter
+from flask import current_app, has_app_context
+import post_schema
+
+CONFIG_MAP = "queue-config"
+DEFAULTS = {
+    "PUBLISH_BATCH_SIZE": 500,
+    "PUBLISH_CONCURRENCY": 8,
+    "PUBLISH_TIMEOUT": 5.0,
+    "PUBLISH_RETRIES": 2,
+    "PUBLISH_BACKOFF": 0.2,
+}
+RETRY_STATUS = (429, 500, 502, 503, 504)
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+_session: Optional[requests.Session] = None
+_session_size = 0
+_lock = threading.Lock()
+
+
+def logger() -> logging.Logger:
+    """
+    Flask app logger inside an invocation, module logger otherwise
+    """
+    return current_app.logger if has_app_context() else logging.getLogger(__name__)
+
+
+def config(k: str, default: Any) -> Any:
+    """
+    Reads configuration from config map file, returns default if the key is not set
+    The value is converted to the type of the default
+    """
+    try:
+        with open(f'/configs/default/{CONFIG_MAP}/{k}', 'r') as f:
+            return type(default)(f.read().strip())
+    except (OSError, ValueError):
+        return default
+
+
+def settings() -> Dict[str, Any]:
+    """
+    Current publisher settings from the config map
+    """
+    return {k: config(k, v) for k, v in DEFAULTS.items()}
+
+
+def get_session(pool_size: int) -> requests.Session:
+    """
+    Shared keep-alive session, rebuilt when a larger connection pool is needed
+    :param pool_size: connections kept per host
+    """
+    global _session, _session_size
+    with _lock:
+        if _session is None or _session_size < pool_size:
+            if _session is not None:
+                _session.close()
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session, _session_size = session, pool_size
+        return _session
+
+
+def backoff(attempt: int, base: float) -> float:
+    """
+    Full jitter: a random delay up to base * 2^attempt, so retries of a burst spread out
+    """
+    return random.uniform(0, base * (2 ** attempt))
+
+
+def send(session: requests.Session, endpoint: str, body: bytes, s: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Send one serialised body, retrying transient failures
+    :return: ok, attempts, latency of the last attempt, the last error and whether it was transient
+    """
+    error, transient, latency, attempts = None, False, 0.0, 0
+    for attempt in range(max(0, s["PUBLISH_RETRIES"]) + 1):
+        if attempt:
+            time.sleep(backoff(attempt - 1, s["PUBLISH_BACKOFF"]))
+        attempts = attempt + 1
+        start = time.perf_counter()
+        try:
+            resp = session.post(endpoint, data=body, headers=JSON_HEADERS, timeout=s["PUBLISH_TIMEOUT"])
+            latency = time.perf_counter() - start
+            if resp.status_code < 400:
+                return {"ok": True, "attempts": attempts, "latency": latency, "error": None, "transient": False}
+            error = f"HTTP {resp.status_code}"
+            transient = resp.status_code in RETRY_STATUS
+            if not transient:
+                break
+        except (requests.ConnectionError, requests.Timeout) as e:
+            latency = time.perf_counter() - start
+            error, transient = str(e), True
+        except Exception as e:
+            latency = time.perf_counter() - start
+            error, transient = str(e), False
+            break
+    return {"ok": False, "attempts": attempts, "latency": latency, "error": error, "transient": transient}
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def send_all(send_one: Callable[[bytes], Dict[str, Any]], bodies: List[bytes], workers: int) -> List[Dict[str, Any]]:
+    """
+    Send the bodies with at most workers requests in flight
+    """
+    workers = max(1, min(workers, len(bodies)))
+    if workers == 1:
+        return [send_one(body) for body in bodies]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(send_one, bodies))
+
+
+def publish(endpoint: str, posts: List[Any], concurrency: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Send the posts of one tick to the queue endpoint, as JSON arrays of PUBLISH_BATCH_SIZE posts
+    :param endpoint: enqueue route of the topic
+    :param posts: post_schema.Post records or formatted posts
+    :param concurrency: requests in flight at the same time, PUBLISH_CONCURRENCY by default
+    :return: metrics of the tick
+    """
+    s = settings()
+    if concurrency is not None:
+        s["PUBLISH_CONCURRENCY"] = concurrency
+    workers = max(1, s["PUBLISH_CONCURRENCY"])
+    size = max(1, s["PUBLISH_BATCH_SIZE"])
+    session = get_session(workers)
+    # serialised once, a retry or a post sent on its own reuses the same bytes
+    bodies = [post_schema.dumps(post) for post in posts]
+    batches = [bodies[i:i + size] for i in range(0, len(bodies), size)]
+
+    def send_one(body: bytes) -> Dict[str, Any]:
+        return send(session, endpoint, body, s)
+
+    start = time.perf_counter()
+    results = send_all(send_one, [b"[" + b",".join(batch) + b"]" for batch in batches], workers)
+    sent, errors, refused = 0, [], []
+    for batch, result in zip(batches, results):
+        if result["ok"]:
+            sent += len(batch)
+        elif result["transient"]:
+            # the router is down or overloaded, sending the posts one by one would not help
+            errors += [result["error"]] * len(batch)
+        else:
+            refused += batch
+    if refused:
+        logger().warning(f"Batch refused by {endpoint}, sending its {len(refused)} posts one by one")
+        singles = send_all(send_one, refused, workers)
+        results += singles
+        sent += sum(r["ok"] for r in singles)
+        errors += [r["error"] for r in singles if not r["ok"]]
+    wall = time.perf_counter() - start
+
+    latencies = [r["latency"] * 1000 for r in results]
+    metrics = {
+        "sent": sent,
+        "failed": len(errors),
+        "requests": len(results),
+        "retries": sum(r["attempts"] - 1 for r in results),
+        "singles": len(refused),
+        "p50Ms": round(percentile(latencies, 50), 1),
+        "p95Ms": round(percentile(latencies, 95), 1),
+        "maxMs": round(max(latencies, default=0.0), 1),
+        "wallMs": round(wall * 1000, 1),
+    }
+
+    for error in sorted(set(errors))[:3]:
+        logger().error(f"Error pushing to queue: {error}")
+    logger().info(
+        f"Published {metrics['sent']}/{len(posts)} posts to {endpoint} in {metrics['requests']} requests: "
+        f"failed={metrics['failed']} retries={metrics['retries']} singles={metrics['singles']} "
+        f"p50={metrics['p50Ms']}ms p95={metrics['p95Ms']}ms max={metrics['maxMs']}ms wall={metrics['wallMs']}ms"
+    )
+    return metrics
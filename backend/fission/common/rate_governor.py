@@ -0,0 +1,250 @@
+"""
+Shared rate limit governor of the harvesters.
+
+Every pod of every harvester using the same account draws from one token bucket per platform
+and credential, kept in Redis (ratelimit:<platform>:<credential hash>). acquire() takes a token
+before an API call and sleeps until the bucket has refilled if it is empty, so the pods spread
+their calls over the window instead of bursting into 429s. observe() feeds the rate limit
+headers of every response back into the bucket:
+- X-RateLimit-Limit / RateLimit-Limit resize the bucket, refilled over the window of the platform
+- X-RateLimit-Remaining / RateLimit-Remaining cap the tokens left
+- a 429, or no requests remaining, blocks the bucket until X-RateLimit-Reset / RateLimit-Reset
+  (an ISO date, an epoch or seconds from now) or Retry-After
+
+The bucket is updated atomically by Lua scripts, with the clock of the pods (kept in sync by NTP).
+GovernedSession is a requests.Session that does both around every request, for the clients
+that make their own calls: praw through its requestor session in the Reddit harvesters, and
+the session of the Mastodon timeline harvester (also used by the backfill of its streams).
+The Mastodon tag and Bluesky harvesters call acquire() and observe() around the requests of
+their own sessions, so they can keep a reserve and give up when the wait does not fit.
+
+If Redis is unavailable acquire() lets the call through, as the harvesters did before.
+
+Settings are read from the optional `ratelimit-config` ConfigMap, any missing key falls back
+to the default below:
+- GOVERNOR_MAX_WAIT: seconds a GovernedSession request waits for a token
+
+Counters for acquired tokens, waits, seconds waited, 429s and timeouts are kept in `stats`.
+"""
+
+import hashlib
+import logging
+import math
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Mapping, Optional
+import redis
+import requests
+import redis_pool
+from flask import current_app, has_app_context
+
+CONFIG_MAP = "ratelimit-config"
+DEFAULTS = {
+    "GOVERNOR_MAX_WAIT": 30.0,
+}
+# requests per window (seconds) of each platform, until the response headers give the limit
+LIMITS = {
+    "mastodon": (300, 300),
+    "bluesky": (3000, 300),
+    "reddit": (1000, 600),
+}
+KEY_PREFIX = "ratelimit"
+
+# refill the bucket, then take cost tokens if more than the reserve would be left
+# returns the seconds to wait before trying again, 0 if the tokens were taken
+ACQUIRE_SCRIPT = """
+local b = redis.call('HMGET', KEYS[1], 'tokens', 'ts', 'capacity', 'rate', 'blocked')
+local now = tonumber(ARGV[1])
+local capacity = tonumber(b[3] or ARGV[2])
+local rate = tonumber(b[4] or ARGV[3])
+local tokens = tonumber(b[1] or capacity)
+local ts = tonumber(b[2] or now)
+local blocked = tonumber(b[5] or 0)
+local cost = tonumber(ARGV[4])
+local reserve = tonumber(ARGV[5])
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if blocked > now then
+    wait = blocked - now
+elseif tokens - cost < reserve then
+    wait = (cost + reserve - tokens) / rate
+else
+    tokens = tokens - cost
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now, 'capacity', capacity, 'rate', rate)
+redis.call('EXPIRE', KEYS[1], ARGV[6])
+return tostring(wait)
+"""
+# align the bucket with the limit, the remaining requests and the reset time of a response
+OBSERVE_SCRIPT = """
+local b = redis.call('HMGET', KEYS[1], 'tokens', 'ts', 'capacity', 'rate')
+local now = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2]) or tonumber(b[3] or ARGV[3])
+local rate = tonumber(ARGV[2]) and capacity / tonumber(ARGV[4]) or tonumber(b[4] or ARGV[5])
+local tokens = tonumber(b[1] or capacity)
+local ts = tonumber(b[2] or now)
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local remaining = tonumber(ARGV[6])
+if remaining then tokens = math.min(tokens, remaining) end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now, 'capacity', capacity, 'rate', rate)
+local blocked = tonumber(ARGV[7])
+if blocked then redis.call('HSET', KEYS[1], 'blocked', blocked) end
+redis.call('EXPIRE', KEYS[1], ARGV[8])
+return 1
+"""
+
+stats: Dict[str, Any] = {"acquired": 0, "waits": 0, "waited": 0.0, "throttled": 0, "timeouts": 0}
+_lock = threading.Lock()
+
+
+def logger() -> logging.Logger:
+    """
+    Flask app logger inside an invocation, module logger otherwise
+    """
+    return current_app.logger if has_app_context() else logging.getLogger(__name__)
+
+
+def config(k: str, default: Any) -> Any:
+    """
+    Reads configuration from config map file, returns default if the key is not set
+    The value is converted to the type of the default
+    """
+    try:
+        with open(f'/configs/default/{CONFIG_MAP}/{k}', 'r') as f:
+            return type(default)(f.read().strip())
+    except (OSError, ValueError):
+        return default
+
+
+def count(k: str, n: float = 1):
+    with _lock:
+        stats[k] += n
+
+
+def bucket_key(platform: str, credential: str) -> str:
+    """
+    Redis key of the bucket, the credential is hashed so no token ends up in a key name
+    """
+    digest = hashlib.sha256(credential.strip().encode()).hexdigest()[:16]
+    return f"{KEY_PREFIX}:{platform}:{digest}"
+
+
+def acquire(platform: str, credential: str, cost: int = 1, reserve: int = 0,
+            max_wait: Optional[float] = None) -> bool:
+    """
+    Take cost tokens from the bucket of the platform and credential, sleeping until they are available
+    :param reserve: tokens that must be left in the bucket after this call, for the other harvesters
+    :param max_wait: seconds this call may sleep in total, None for GOVERNOR_MAX_WAIT
+    :return: False if the tokens were not available within max_wait
+    """
+    capacity, window = LIMITS.get(platform, (60, 60))
+    if max_wait is None:
+        max_wait = config("GOVERNOR_MAX_WAIT", DEFAULTS["GOVERNOR_MAX_WAIT"])
+    key = bucket_key(platform, credential)
+    waited = 0.0
+
+    while True:
+        try:
+            r = redis_pool.get_redis(decode_responses=True)
+            wait = float(r.eval(ACQUIRE_SCRIPT, 1, key, time.time(), capacity, capacity / window,
+                                cost, reserve, window * 2))
+        except redis.RedisError as e:
+            logger().warning(f"Rate governor unavailable, {platform} call not governed: {e}")
+            return True
+        if wait <= 0:
+            count("acquired")
+            if waited:
+                count("waits")
+                count("waited", waited)
+            return True
+        if waited + wait > max_wait:
+            count("timeouts")
+            logger().warning(f"No {platform} request available within {max_wait:.1f}s, next in {wait:.1f}s")
+            return False
+        time.sleep(wait)
+        waited += wait
+
+
+def reset_time(value: str, now: float) -> Optional[float]:
+    """
+    Epoch of a reset header: an ISO date (Mastodon), an epoch (Bluesky) or seconds from now (Reddit)
+    """
+    try:
+        number = float(value)
+        return number if number > 1e9 else now + number
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+
+
+def header(headers: Mapping[str, str], name: str) -> Optional[str]:
+    """
+    X-RateLimit-<name> or RateLimit-<name>, the header names are case insensitive
+    """
+    return headers.get(f"X-RateLimit-{name}") or headers.get(f"RateLimit-{name}")
+
+
+def observe(platform: str, credential: str, headers: Mapping[str, str], status: int = 200):
+    """
+    Feed the rate limit headers of a response into the bucket of the platform and credential
+    :param headers: case insensitive headers of the response (requests.Response.headers)
+    """
+    capacity, window = LIMITS.get(platform, (60, 60))
+    now = time.time()
+    limit, remaining, reset = header(headers, "Limit"), header(headers, "Remaining"), header(headers, "Reset")
+    if limit is None and remaining is not None and header(headers, "Used") is not None:
+        # Reddit sends the used and remaining requests of the window
+        limit = str(float(remaining) + float(header(headers, "Used")))
+
+    blocked = None
+    if status == 429 or (remaining is not None and float(remaining) < 1):
+        if status == 429:
+            count("throttled")
+        retry_after = headers.get("Retry-After")
+        blocked = reset_time(retry_after, now) if retry_after else None
+        if blocked is None and reset is not None:
+            blocked = reset_time(reset, now)
+        if blocked is None:
+            blocked = now + window / 10
+        remaining = "0"
+    if limit is None and remaining is None and blocked is None:
+        return
+
+    try:
+        r = redis_pool.get_redis(decode_responses=True)
+        r.eval(OBSERVE_SCRIPT, 1, bucket_key(platform, credential), now, limit or "", capacity, window,
+               capacity / window, remaining or "", blocked or "", window * 2)
+    except redis.RedisError as e:
+        logger().warning(f"Rate governor unavailable, {platform} limits not recorded: {e}")
+
+
+class GovernedSession(requests.Session):
+    """
+    requests.Session that acquires a token before every request and observes the rate limit
+    headers of every response, for the API clients that make their own calls
+    """
+
+    def __init__(self, platform: str, credential: str):
+        super().__init__()
+        self.platform = platform
+        self.credential = credential
+
+    def request(self, method, url, *args, **kwargs):
+        # the call still goes out after GOVERNOR_MAX_WAIT, the client handles the 429 itself
+        acquire(self.platform, self.credential)
+        resp = super().request(method, url, *args, **kwargs)
+        observe(self.platform, self.credential, resp.headers, resp.status_code)
+        return resp
+
+
+def summary() -> str:
+    """
+    Counters of this pod for the logs
+    """
+    with _lock:
+        return (f"{stats['acquired']} acquired, {stats['waits']} waited {stats['waited']:.1f}s, "
+                f"{stats['throttled']} throttled, {stats['timeouts']} timed out")
@@ -0,0 +1,188 @@
+"""
+Shared author metadata of the Reddit harvesters.
+
+Reading `created_utc` from the lazy PRAW Redditor of a post or a comment fetches
+/user/<name>/about, one extra Reddit request per post and per comment, mostly for the same
+prolific users. lookup() resolves all the authors of a page at once instead:
+1. from an in-process LRU, kept by warm pods between invocations
+2. from the `reddit:authors` Redis hash shared by all pods, a field per author fullname
+3. the rest with /api/user_data_by_account_ids, up to 100 authors per request
+
+Authors Reddit does not return (suspended or deleted accounts) are cached as unavailable, so
+they are not looked up again before the TTL.
+
+Settings are read from the optional entries of the `reddit-config2` ConfigMap, any missing key
+falls back to the default below:
+- AUTHOR_CACHE_SIZE: authors kept in the LRU of a pod
+- AUTHOR_TTL: seconds an author is kept in the LRU and in Redis
+
+Counters for LRU hits, Redis hits and user data requests are kept in `stats` and written to the logs.
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional
+import redis
+import redis_pool
+import post_schema
+from flask import current_app, has_app_context
+from prawcore.exceptions import PrawcoreException
+
+CONFIG_MAP = "reddit-config2"
+DEFAULTS = {
+    "AUTHOR_CACHE_SIZE": 4096,
+    "AUTHOR_TTL": 86400,
+}
+REDIS_KEY = "reddit:authors"
+
+stats: Dict[str, int] = {"lru": 0, "redis": 0, "fetched": 0, "requests": 0}
+
+_lru: "OrderedDict[str, dict]" = OrderedDict()
+_lock = threading.Lock()
+
+
+def logger() -> logging.Logger:
+    """
+    Flask app logger inside an invocation, module logger otherwise
+    """
+    return current_app.logger if has_app_context() else logging.getLogger(__name__)
+
+
+def config(k: str, default: Any) -> Any:
+    """
+    Reads configuration from config map file, returns default if the key is not set
+    The value is converted to the type of the default
+    """
+    try:
+        with open(f'/configs/default/{CONFIG_MAP}/{k}', 'r') as f:
+            return type(default)(f.read().strip())
+    except (OSError, ValueError):
+        return default
+
+
+def settings() -> Dict[str, Any]:
+    """
+    Current cache settings from the config map
+    """
+    return {k: config(k, v) for k, v in DEFAULTS.items()}
+
+
+def author_fullname(item) -> Optional[str]:
+    """
+    Fullname (t2_...) of the author of a post or comment, as returned in the listing
+    Read from the attributes already loaded, getattr would fetch the whole item again
+    """
+    return vars(item).get("author_fullname")
+
+
+def remember(fullname: str, info: dict, size: int):
+    with _lock:
+        _lru[fullname] = info
+        _lru.move_to_end(fullname)
+        while len(_lru) > size:
+            _lru.popitem(last=False)
+
+
+def fetch(reddit, fullnames: list) -> Dict[str, dict]:
+    """
+    Author data of /api/user_data_by_account_ids, the accounts Reddit did not return are unavailable
+    """
+    now = time.time()
+    found = {fullname: {"available": False, "cachedAt": now} for fullname in fullnames}
+    stats["requests"] += (len(fullnames) + 99) // 100
+    for user in reddit.redditors.partial_redditors(fullnames):
+        found[user.fullname] = {
+            "available": True,
+            "cachedAt": now,
+            "name": user.name,
+            "createdUtc": getattr(user, "created_utc", None),
+            "linkKarma": getattr(user, "link_karma", 0),
+            "commentKarma": getattr(user, "comment_karma", 0),
+        }
+    stats["fetched"] += len(fullnames)
+    return found
+
+
+def lookup(reddit, fullnames: Iterable[Optional[str]]) -> Dict[str, dict]:
+    """
+    Author data of every fullname, from the LRU, Redis, then a batched Reddit request
+    A failed Reddit request leaves its authors out of the result
+    :param reddit: praw.Reddit client
+    :param fullnames: author fullnames of a page, None for deleted authors
+    :return: fullname -> {"available", "name", "createdUtc", "linkKarma", "commentKarma"}
+    """
+    s = settings()
+    expired = time.time() - s["AUTHOR_TTL"]
+    wanted = list(dict.fromkeys(f for f in fullnames if f))
+    authors = {}
+
+    with _lock:
+        for fullname in wanted:
+            info = _lru.get(fullname)
+            if info and info["cachedAt"] > expired:
+                authors[fullname] = info
+                _lru.move_to_end(fullname)
+    stats["lru"] += len(authors)
+    missing = [f for f in wanted if f not in authors]
+
+    r = None
+    if missing:
+        try:
+            r = redis_pool.get_redis(decode_responses=True)
+            for fullname, value in zip(missing, r.hmget(REDIS_KEY, missing)):
+                info = json.loads(value) if value else None
+                if info and info["cachedAt"] > expired:
+                    authors[fullname] = info
+                    remember(fullname, info, s["AUTHOR_CACHE_SIZE"])
+                    stats["redis"] += 1
+        except redis.RedisError as e:
+            logger().warning(f"Author cache unavailable: {e}")
+            r = None
+        missing = [f for f in missing if f not in authors]
+
+    if missing:
+        try:
+            found = fetch(reddit, missing)
+        except PrawcoreException as e:
+            logger().warning(f"Failed to fetch {len(missing)} authors: {e}")
+            found = {}
+        for fullname, info in found.items():
+            remember(fullname, info, s["AUTHOR_CACHE_SIZE"])
+        authors.update(found)
+        if r is not None and found:
+            try:
+                pipe = r.pipeline()
+                pipe.hset(REDIS_KEY, mapping={k: json.dumps(v) for k, v in found.items()})
+                pipe.expire(REDIS_KEY, s["AUTHOR_TTL"])
+                pipe.execute()
+            except redis.RedisError as e:
+                logger().warning(f"Failed to cache {len(found)} authors: {e}")
+
+    logger().info(f"Author cache: {stats}")
+    return authors
+
+
+def account_data(item, authors: Dict[str, dict]) -> post_schema.Account:
+    """
+    Account of the author of a post or comment in the target format
+    :param item: praw Submission or Comment
+    :param authors: result of lookup() for the page
+    """
+    if item.author is None:
+        return post_schema.Account(id=None, username="[Deleted]", followers=None, following=None)
+
+    info = authors.get(author_fullname(item))
+    if not info or not info["available"]:
+        return post_schema.Account(id=None, username="[Unavailable]")
+
+    author_username = item.author.name or "[Unknown]"
+    return post_schema.Account(
+        id=f"t2_{author_username}",
+        username=author_username,
+        created_at=post_schema.from_timestamp(info.get("createdUtc")),
+        followers=info.get("linkKarma", 0),
+        following=info.get("commentKarma", 0),
+    )
@@ -0,0 +1,140 @@
+"""
+Shared Redis connection pool for the Fission functions.
+
+The pool is created lazily on first use and kept at module level, so warm invocations
+of the same pod reuse their TCP connections instead of reconnecting on every timer tick
+or queued message. redis-py pings a connection that has been idle for longer than the
+health check interval before its next command, and reconnects it if the ping fails.
+
+Settings are read from the optional `redis-config` ConfigMap, any missing key falls back
+to the default below:
+- REDIS_HOST, REDIS_PORT
+- REDIS_SOCKET_TIMEOUT, REDIS_CONNECT_TIMEOUT: seconds
+- REDIS_MAX_CONNECTIONS: connections per pool
+- REDIS_HEALTH_CHECK_INTERVAL: seconds a connection may stay idle before it is pinged
+
+Counters are kept in `stats` and written to the logs every REPORT_EVERY borrows:
+- hits: a command got a pooled connection that was already connected
+- misses: a new connection was opened
+- reconnects: a pooled connection was opened again after it was dropped (health check,
+  connection error or leftover data)
+"""
+
+import logging
+import threading
+from typing import Dict, Any
+import redis
+from flask import current_app, has_app_context
+
+CONFIG_MAP = "redis-config"
+DEFAULTS = {
+    "REDIS_HOST": "redis-headless.redis.svc.cluster.local",
+    "REDIS_PORT": 6379,
+    "REDIS_SOCKET_TIMEOUT": 10.0,
+    "REDIS_CONNECT_TIMEOUT": 5.0,
+    "REDIS_MAX_CONNECTIONS": 16,
+    "REDIS_HEALTH_CHECK_INTERVAL": 30,
+}
+
+REPORT_EVERY = 100
+
+stats: Dict[str, int] = {"hits": 0, "misses": 0, "reconnects": 0}
+
+_pools: Dict[bool, redis.ConnectionPool] = {}
+_borrows = 0
+_lock = threading.Lock()
+_stats_lock = threading.Lock()
+
+
+def logger() -> logging.Logger:
+    """
+    Flask app logger inside an invocation, module logger otherwise
+    """
+    return current_app.logger if has_app_context() else logging.getLogger(__name__)
+
+
+def config(k: str, default: Any) -> Any:
+    """
+    Reads configuration from config map file, returns default if the key is not set
+    The value is converted to the type of the default
+    """
+    try:
+        with open(f'/configs/default/{CONFIG_MAP}/{k}', 'r') as f:
+            return type(default)(f.read().strip())
+    except (OSError, ValueError):
+        return default
+
+
+def count(k: str):
+    with _stats_lock:
+        stats[k] += 1
+
+
+class CountingConnection(redis.Connection):
+    """
+    Connection that counts in stats whether the pool handed it out connected, or had to open it
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._opened = False
+
+    def connect(self):
+        if self._sock:
+            count("hits")
+        else:
+            count("reconnects" if self._opened else "misses")
+            self._opened = True
+        super().connect()
+
+
+def settings() -> Dict[str, Any]:
+    """
+    Current pool settings from the config map
+    """
+    return {k: config(k, v) for k, v in DEFAULTS.items()}
+
+
+def _create_pool(decode_responses: bool) -> redis.ConnectionPool:
+    s = settings()
+    return redis.ConnectionPool(
+        host=s["REDIS_HOST"],
+        port=s["REDIS_PORT"],
+        socket_timeout=s["REDIS_SOCKET_TIMEOUT"],
+        socket_connect_timeout=s["REDIS_CONNECT_TIMEOUT"],
+        max_connections=s["REDIS_MAX_CONNECTIONS"],
+        health_check_interval=s["REDIS_HEALTH_CHECK_INTERVAL"],
+        decode_responses=decode_responses,
+        connection_class=CountingConnection,
+    )
+
+
+def get_redis(decode_responses: bool = False) -> redis.Redis:
+    """
+    Borrow a Redis client backed by the shared pool
+    :param decode_responses: return str instead of bytes, one pool is kept per value
+    :return: redis.Redis
+    """
+    global _borrows
+    with _lock:
+        pool = _pools.get(decode_responses)
+        if pool is None:
+            pool = _pools[decode_responses] = _create_pool(decode_responses)
+            logger().debug(f"Created Redis pool, decode_responses={decode_responses}")
+        _borrows += 1
+        report = _borrows % REPORT_EVERY == 1
+
+    if report:
+        logger().info(f"Redis connections: hits={stats['hits']} misses={stats['misses']} "
+                      f"reconnects={stats['reconnects']}")
+    return redis.Redis(connection_pool=pool)
+
+
+def reset():
+    """
+    Close and forget every pool, the next get_redis call creates a new one
+    """
+    with _lock:
+        for pool in _pools.values():
+            pool.disconnect()
+        _pools.clear()
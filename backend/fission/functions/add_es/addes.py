@@ -3,15 +3,27 @@ Mainly used to send data to ElasticSearch from Redis List
 Only data that is structured correctly will end up being sent to ElasticSearch.
 """
 
+import json
+import time
 from typing import Dict, Any, List
 from datetime import datetime
 from urllib.parse import urlparse
-from elasticsearch8 import Elasticsearch
-from elasticsearch8.exceptions import ConflictError
+from elasticsearch8 import Elasticsearch, helpers
 from flask import request, current_app
+import es_pool
+import post_schema
 
 CONFIG_MAP = "shared-data"
-ES_URL = "https://elasticsearch-master.elastic.svc.cluster.local:9200"
+ES_INDEX = "socialplatform"
+
+# bulk settings, each one can be overridden by the key of the same name in the config map
+BULK_DEFAULTS = {
+    "ES_BULK_CHUNK_SIZE": 500,
+    "ES_BULK_MAX_BYTES": 10 * 1024 * 1024,
+    "ES_BULK_MAX_RETRIES": 3,
+}
+BULK_INITIAL_BACKOFF = 1
+BULK_MAX_BACKOFF = 30
 
 
 def config(k: str) -> str:
@@ -22,6 +34,16 @@ def config(k: str) -> str:
         return f.read()
 
 
+def config_int(k: str, default: int) -> int:
+    """
+    Reads an optional integer from config map file, returns default if the key is not set
+    """
+    try:
+        return int(config(k).strip())
+    except (OSError, ValueError):
+        return default
+
+
 def is_iso_datetime(time: str) -> bool:
     """
     Check is a legal ISO 8601 datetime string
@@ -167,43 +189,94 @@ def legal_record(record: Dict[str, Any]) -> bool:
     return True
 
 
-def main() -> str:
+def to_action(record: Dict[str, Any]) -> Dict[str, Any]:
     """
-    get data from redis list, check the data structure and send to elasticsearch
+    Build the bulk create action of a valid record
+    ID is a combination of the platform name and post ID,
+    create only succeeds if the data with this ID does not exist yet
+    :param record: Dict[str, Any]
+    :return: bulk action
     """
-    es_auth = (config('ES_USERNAME'), config('ES_PASSWORD'))
+    return {
+        "_op_type": "create",
+        "_index": ES_INDEX,
+        "_id": f"{record['platform'].lower()}_{record['data']['id']}",
+        "_source": record,
+    }
 
-    es = Elasticsearch(
-        ES_URL,
-        verify_certs=False,
-        ssl_show_warn=False,
-        basic_auth=es_auth
-    )
+
+def bulk_index(es: Elasticsearch, actions: List[Dict[str, Any]]) -> Dict[str, int]:
+    """
+    Write the actions through the _bulk API
+    409 conflicts are counted as duplicates, items rejected with 429 or 5xx are retried
+    with exponential backoff, any other rejection is a failure
+    :param es: Elasticsearch client
+    :param actions: bulk create actions
+    :return: counts of created, duplicate, failed and retried items
+    """
+    chunk_size = config_int("ES_BULK_CHUNK_SIZE", BULK_DEFAULTS["ES_BULK_CHUNK_SIZE"])
+    max_bytes = config_int("ES_BULK_MAX_BYTES", BULK_DEFAULTS["ES_BULK_MAX_BYTES"])
+    max_retries = config_int("ES_BULK_MAX_RETRIES", BULK_DEFAULTS["ES_BULK_MAX_RETRIES"])
+
+    counts = {"created": 0, "duplicates": 0, "failed": 0, "retried": 0}
+    pending = actions
+
+    for attempt in range(max_retries + 1):
+        if attempt:
+            time.sleep(min(BULK_MAX_BACKOFF, BULK_INITIAL_BACKOFF * 2 ** (attempt - 1)))
+            counts["retried"] += len(pending)
+
+        by_id = {action["_id"]: action for action in pending}
+        retry = []
+        for ok, item in helpers.streaming_bulk(
+                es,
+                pending,
+                chunk_size=chunk_size,
+                max_chunk_bytes=max_bytes,
+                raise_on_error=False,
+                raise_on_exception=False,
+        ):
+            result = item["create"]
+            status = result.get("status")
+            if ok:
+                counts["created"] += 1
+            elif status == 409:
+                counts["duplicates"] += 1
+            elif isinstance(status, int) and (status == 429 or status >= 500):
+                retry.append(by_id[result["_id"]])
+            else:
+                counts["failed"] += 1
+                current_app.logger.error(f"{result['_id']} rejected by ES: {result.get('error')}")
+
+        pending = retry
+        if not pending:
+            break
+
+    if pending:
+        counts["failed"] += len(pending)
+        current_app.logger.error(f"{len(pending)} records still rejected after {max_retries} retries")
+
+    return counts
+
+
+def main() -> str:
+    """
+    get data from redis list, check the data structure and send to elasticsearch in bulk
+    """
+    es = es_pool.get_es()
 
     # get data
-    payload = request.get_json(force=True)
+    payload = post_schema.loads(request.get_data())
     records: List[Dict[str, Any]] = payload if isinstance(payload, list) else [payload]
     current_app.logger.info(f"Got {len(records)} record from queue")
 
     # check each data structure, only validated data send to ES
-    for record in records:
-        if not legal_record(record):
-            continue
-
-        post_id = record["data"]["id"]
-        platform = record["platform"].lower()
-
-        # ID is a combination of the platform name and post ID
-        # only if the data with this ID does not exist, otherwise skips it
-        try:
-            es.index(
-                index="socialplatform",
-                id=f"{platform}_{post_id}",
-                body=record,
-                op_type='create'
-            )
-            current_app.logger.info(f"{platform}_{post_id} sent to ES successfully")
-        except ConflictError as e:
-            current_app.logger.error(f"An error happened while send to ES: {e}")
-
-    return "OK"
+    actions = [to_action(record) for record in records if legal_record(record)]
+    counts = bulk_index(es, actions) if actions else {"created": 0, "duplicates": 0, "failed": 0, "retried": 0}
+    counts["invalid"] = len(records) - len(actions)
+
+    current_app.logger.info(
+        f"Sent to ES: {counts['created']} created, {counts['duplicates']} duplicates skipped, "
+        f"{counts['failed']} failed, {counts['invalid']} invalid, {counts['retried']} retried"
+    )
+    return json.dumps(counts)
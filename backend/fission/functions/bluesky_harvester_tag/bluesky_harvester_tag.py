@@ -6,26 +6,82 @@ search terms stored in Redis. It authenticates with Bluesky credentials, retriev
 search terms, converts them to a standardized format, and forwards them to a processing queue.
 
 Key components:
-- Authentication with Bluesky API using stored credentials
+- Authentication with Bluesky API using stored credentials, the session is shared by all pods
+  through Redis and refreshed before it expires, so createSession is only called when the
+  refresh token is gone
 - Redis-based search term queue management (rotating terms after use)
 - Post retrieval using Bluesky search API
 - Data transformation from Bluesky format to standardized internal format
 - Forwarding of formatted posts to a processing queue via HTTP
+- Cursor paging within a time budget: pages of a term are fetched until the HARVEST_BUDGET
+  seconds of the invocation are used up, MAX_PAGES pages, or no request above RATELIMIT_RESERVE
+  is left in the rate limit bucket of the account shared by all harvesters (rate_governor)
+  within the budget, with the state of the term saved in Redis after every page
+
+Each term has a Redis hash (bluesky:state:<term>) with the newest indexedAt harvested:
+- a forward pass pages from the latest posts back to that watermark and only sends the newer
+  posts, a pass cut short by the budget is resumed from its cursor by the next invocation, and
+  only sends the posts older than the ones it already read, as the posts indexed meanwhile shift
+  the results the cursor points at
+- with BACKFILL=1 the budget left after the forward pass walks a second cursor back from the
+  first watermark to BACKFILL_END_DATE, once per term
 """
 
+import base64
+import json
 import requests
-from datetime import datetime, timezone
+import time
+import uuid
+from typing import Any, Dict, Optional
 import redis
+import redis_pool
+import queue_publisher
+import rate_governor
+import post_schema
 from flask import current_app
 
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:
+    Fernet = None
+
 # Configuration constants
 CONFIG_MAP = "bluesky-config"
 REDIS_TAGS_LIST = "bluesky:tags"
 LIMIT = 40  # Number of posts to fetch per request
+API_BASE = "https://bsky.social/xrpc"
+
+# Paging state of each search term, a hash with the fields:
+# newest: indexedAt of the newest post harvested by a complete forward pass
+# cursor, pass_newest, pass_oldest: cursor, newest and oldest post read by the forward pass in progress
+# backfill_from: oldest post sent, the backfill sends the posts older than it
+# backfill_cursor, backfill_done: progress of the backfill
+STATE_PREFIX = "bluesky:state"
+
+# Paging of an invocation, every key can be overridden in the config map
+DEFAULTS = {
+    "HARVEST_BUDGET": 20.0,  # seconds of paging per invocation, 0 fetches one page
+    "MAX_PAGES": 25,
+    "RATELIMIT_RESERVE": 100,  # requests left in the Bluesky rate limit window
+    "BACKFILL": 0,  # 1 also walks back to BACKFILL_END_DATE with the budget left
+    "BACKFILL_END_DATE": "2023-01-01",
+}
 
-# Redis and Queue configuration
-REDIS_HOST = "redis-headless.redis.svc.cluster.local"
-REDIS_PORT = 6379
+# Session of each account, a hash with the access and refresh JWTs and their expiry times,
+# encrypted with SESSION_ENCRYPTION_KEY (a Fernet key in the config map) when it is set
+SESSION_PREFIX = "bluesky:session"
+SESSION_SKEW = 60  # seconds before its exp claim a token is no longer used
+SESSION_LOCK_TTL = 15  # seconds, one pod refreshes or logs in while the others wait
+SESSION_WAIT = 5.0  # seconds a pod waits for the session of another pod
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end
+return 0
+"""
+
+# Session sources of this pod, written to the logs
+session_stats: Dict[str, int] = {"cached": 0, "refreshed": 0, "created": 0}
+
+# Queue configuration, Redis settings come from redis_pool
 QUEUE_ENDPOINT = "http://router.fission.svc.cluster.local/enqueue/bluesky"
 
 
@@ -37,19 +93,91 @@ def config(k: str) -> str:
         return f.read()
 
 
-def load_session():
+def setting(k: str, default: Any) -> Any:
     """
-    Initialize a Bluesky session by authenticating with the provided credentials.
-    Returns the access JWT token if successful, None otherwise.
+    Optional config map value converted to the type of the default
     """
-    username = config('BSKY_USERNAME')
-    password = config('BSKY_APP_PASSWORD')
+    try:
+        return type(default)(config(k).strip())
+    except (OSError, ValueError):
+        return default
 
-    if not username or not password:
-        current_app.logger.error("Error: Missing configuration BSKY_USERNAME or BSKY_APP_PASSWORD.")
+
+def token_expiry(token: str) -> float:
+    """
+    Expiry time of a JWT from its exp claim, the signature is left to Bluesky
+    Returns 0 if the token cannot be read, so it is never reused
+    """
+    try:
+        payload = token.split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        return float(claims["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return 0.0
+
+
+def session_cipher():
+    """
+    Fernet cipher of the cached session, None to cache it in clear
+    Raises RuntimeError if a key is configured but cryptography is not installed
+    """
+    try:
+        key = config('SESSION_ENCRYPTION_KEY').strip()
+    except OSError:
+        return None
+    if not key:
+        return None
+    if Fernet is None:
+        raise RuntimeError("SESSION_ENCRYPTION_KEY needs cryptography in requirements.txt")
+    return Fernet(key.encode())
+
+
+def read_session(r, key: str, cipher) -> Optional[dict]:
+    """
+    Cached session of the account, None if there is none or it cannot be decrypted
+    """
+    cached = r.hgetall(key)
+    if not cached.get("refresh"):
+        return None
+    session = {"access_exp": float(cached.get("access_exp", 0)), "refresh_exp": float(cached.get("refresh_exp", 0))}
+    try:
+        for field in ("access", "refresh"):
+            value = cached.get(field, "")
+            session[field] = cipher.decrypt(value.encode()).decode() if cipher else value
+    except InvalidToken:
+        current_app.logger.warning("Cached Bluesky session cannot be decrypted, logging in again")
         return None
+    return session
+
+
+def write_session(r, key: str, cipher, res: dict) -> dict:
+    """
+    Cache the tokens of a createSession or refreshSession response until the refresh token expires
+    """
+    session = {
+        "access": res["accessJwt"],
+        "refresh": res["refreshJwt"],
+        "access_exp": token_expiry(res["accessJwt"]),
+        "refresh_exp": token_expiry(res["refreshJwt"]),
+    }
+    stored = dict(session)
+    if cipher:
+        stored["access"] = cipher.encrypt(session["access"].encode()).decode()
+        stored["refresh"] = cipher.encrypt(session["refresh"].encode()).decode()
+    ttl = int(session["refresh_exp"] - time.time())
+    if ttl > SESSION_SKEW:
+        pipe = r.pipeline()
+        pipe.hset(key, mapping=stored)
+        pipe.expire(key, ttl)
+        pipe.execute()
+    return session
 
-    url = "https://bsky.social/xrpc/com.atproto.server.createSession"
+
+def create_session(username: str, password: str) -> Optional[dict]:
+    """
+    Log in with the app password, the response holds the access and refresh JWTs
+    """
+    url = f"{API_BASE}/com.atproto.server.createSession"
     payload = {"identifier": username, "password": password}
 
     try:
@@ -58,56 +186,289 @@ def load_session():
             current_app.logger.error(f"Error: HTTP status code {res.status_code}")
             current_app.logger.error(f"Response content: {res.text}")
             return None
-        return res.json()["accessJwt"]
+        session_stats["created"] += 1
+        return res.json()
     except Exception as e:
         current_app.logger.error(f"Error during login: {e}")
         return None
 
 
-def convert_bluesky_post_to_target_format(post, search_term: str) -> dict:
+def refresh_session(refresh_jwt: str) -> Optional[dict]:
+    """
+    New access and refresh JWTs for a refresh token, None if Bluesky refuses it
+    """
+    url = f"{API_BASE}/com.atproto.server.refreshSession"
+
+    try:
+        res = requests.post(url, headers={"Authorization": f"Bearer {refresh_jwt}"})
+        if res.status_code != 200:
+            current_app.logger.warning(f"Session refresh refused with HTTP status code {res.status_code}")
+            return None
+        session_stats["refreshed"] += 1
+        return res.json()
+    except Exception as e:
+        current_app.logger.error(f"Error during session refresh: {e}")
+        return None
+
+
+def renew_session(r, key: str, cipher, username: str, password: str) -> Optional[dict]:
+    """
+    Refresh the cached session, or log in if there is no refresh token left
+    Only the pod holding the lock of the account renews it, the others wait for its session
+    """
+    lock = f"{key}:lock"
+    owner = uuid.uuid4().hex
+    locked = r.set(lock, owner, nx=True, ex=SESSION_LOCK_TTL)
+    try:
+        deadline = time.monotonic() + SESSION_WAIT
+        while not locked and time.monotonic() < deadline:
+            time.sleep(0.2)
+            session = read_session(r, key, cipher)
+            if session and session["access_exp"] - SESSION_SKEW > time.time():
+                session_stats["cached"] += 1
+                return session
+            locked = r.set(lock, owner, nx=True, ex=SESSION_LOCK_TTL)
+
+        # the session may have been renewed while this pod was taking the lock
+        session = read_session(r, key, cipher)
+        now = time.time()
+        if session and session["access_exp"] - SESSION_SKEW > now:
+            session_stats["cached"] += 1
+            return session
+
+        res = None
+        if session and session["refresh_exp"] - SESSION_SKEW > now:
+            res = refresh_session(session["refresh"])
+        if res is None:
+            res = create_session(username, password)
+        return write_session(r, key, cipher, res) if res else None
+    finally:
+        if locked:
+            r.eval(RELEASE_SCRIPT, 1, lock, owner)
+
+
+def load_session():
+    """
+    Initialize a Bluesky session by authenticating with the provided credentials.
+    The session cached in Redis is reused until its access token expires, then refreshed, and
+    createSession is only called when there is no valid refresh token.
+    Returns the access JWT token if successful, None otherwise.
+    """
+    username = config('BSKY_USERNAME')
+    password = config('BSKY_APP_PASSWORD')
+
+    if not username or not password:
+        current_app.logger.error("Error: Missing configuration BSKY_USERNAME or BSKY_APP_PASSWORD.")
+        return None
+
+    try:
+        cipher = session_cipher()
+    except RuntimeError as e:
+        current_app.logger.error(f"Error: {e}, the session is not cached")
+        res = create_session(username, password)
+        return res["accessJwt"] if res else None
+
+    key = f"{SESSION_PREFIX}:{username.strip()}"
+    try:
+        r = redis_pool.get_redis(decode_responses=True)
+        session = read_session(r, key, cipher)
+        if session and session["access_exp"] - SESSION_SKEW > time.time():
+            session_stats["cached"] += 1
+        else:
+            session = renew_session(r, key, cipher, username, password)
+    except redis.RedisError as e:
+        # without Redis every invocation logs in, as before the cache
+        current_app.logger.error(f"Error reading the cached session: {e}")
+        res = create_session(username, password)
+        session = {"access": res["accessJwt"]} if res else None
+
+    current_app.logger.info(f"Bluesky sessions: {session_stats}")
+    return session["access"] if session else None
+
+
+def expire_session():
+    """
+    Mark the cached access token as expired, after Bluesky refused it
+    """
+    try:
+        r = redis_pool.get_redis(decode_responses=True)
+        key = f"{SESSION_PREFIX}:{config('BSKY_USERNAME').strip()}"
+        if r.exists(key):
+            r.hset(key, "access_exp", 0)
+    except (OSError, redis.RedisError) as e:
+        current_app.logger.error(f"Error expiring the cached session: {e}")
+
+
+def convert_bluesky_post_to_target_format(post, search_term: str, fetched: str) -> post_schema.Post:
     """
     Convert a Bluesky post to the standardized target format.
     
     Args:
         post (dict): The original Bluesky post data
         search_term (str): The search term used to find this post
+        fetched (str): fetchedAt of the page, from post_schema.fetched_at
         
     Returns:
-        dict: Post data in the standardized format
+        post_schema.Post: Post data in the standardized format
     """
     record = post.get("record", {})
-    created_at = record.get("createdAt", "")
-    content = record.get("text", "")
-    uri = post.get("uri", "")
-
-    fetched_at = datetime.now(timezone.utc).isoformat(timespec="seconds") + "Z"
-
-    doc = {
-        "platform": "Bluesky",
-        "version": 1.1,
-        "fetchedAt": fetched_at,
-        "sentiment": None,
-        "sentimentLabel": None,
-        "keywords": [],
-        "data": {
-            "id": uri.split("/")[-1],
-            "createdAt": created_at,
-            "content": content,
-            "sensitive": False,
-            "favouritesCount": post.get("likeCount", 0),
-            "repliesCount": post.get("replyCount", 0),
-            "tags": [search_term],
-            "url": f"https://bsky.app/profile/{post.get('author', {}).get('handle', '')}/post/{uri.split('/')[-1]}",
-            "account": {
-                "id": post.get("author", {}).get("did", ""),
-                "username": post.get("author", {}).get("handle", ""),
-                "createdAt": "1970-01-01T00:00:00Z",
-                "followersCount/linkKarma": 0,
-                "followingCount/commentKarma": 0
-            }
-        }
+    author = post.get("author", {})
+    rkey = post.get("uri", "").split("/")[-1]
+    # languages declared by the author, english first if it is one of them
+    langs = record.get("langs") or []
+    language = next((lang for lang in langs if lang.startswith("en")), langs[0] if langs else None)
+
+    return post_schema.Post(
+        platform="Bluesky",
+        fetched_at=fetched,
+        id=rkey,
+        created_at=record.get("createdAt", ""),
+        content=record.get("text", ""),
+        language=language,
+        sensitive=False,
+        favourites=post.get("likeCount", 0),
+        replies=post.get("replyCount", 0),
+        tags=[search_term],
+        url=f"https://bsky.app/profile/{author.get('handle', '')}/post/{rkey}",
+        account=post_schema.Account(
+            id=author.get("did", ""),
+            username=author.get("handle", ""),
+            created_at="1970-01-01T00:00:00Z",
+        ),
+    )
+
+
+def page_allowed(clock: dict, s: dict) -> bool:
+    """
+    Whether one more page fits in the invocation: the first page always runs, a later one only
+    if the slowest page so far would still finish within the budget, and either only once a
+    request is available in the shared rate limit bucket
+    """
+    now = time.monotonic()
+    if clock["page_start"] is not None:
+        clock["slowest"] = max(clock["slowest"], now - clock["page_start"])
+        clock["page_start"] = None
+    if clock["pages"] >= s["MAX_PAGES"]:
+        return False
+    if clock["pages"] > 0 and now + clock["slowest"] > clock["deadline"]:
+        return False
+    # wait for a request of the shared bucket only as long as the page would still fit in the budget
+    if not rate_governor.acquire("bluesky", clock["account"], reserve=s["RATELIMIT_RESERVE"],
+                                 max_wait=max(0.0, clock["deadline"] - now - clock["slowest"])):
+        current_app.logger.warning("Rate limit reserve reached")
+        return False
+    return True
+
+
+def search(clock: dict, headers: dict, search_term: str, cursor: Optional[str]) -> dict:
+    """
+    One page of the latest posts matching the term, from the cursor
+    """
+    clock["page_start"] = time.monotonic()
+    clock["pages"] += 1
+    params = {
+        "q": search_term,
+        "sort": "latest",
+        "limit": LIMIT
     }
-    return doc
+    if cursor:
+        params["cursor"] = cursor
+
+    res = requests.get(f"{API_BASE}/app.bsky.feed.searchPosts", headers=headers, params=params)
+    rate_governor.observe("bluesky", clock["account"], res.headers, res.status_code)
+    if res.status_code in (400, 401) and res.json().get("error") in ("ExpiredToken", "InvalidToken"):
+        # revoked or expired early, the next invocation refreshes the session
+        expire_session()
+    res.raise_for_status()
+    return res.json()
+
+
+def forward_pass(r, clock: dict, s: dict, headers: dict, search_term: str) -> int:
+    """
+    Send the posts indexed since the newest post of the previous pass
+    A term without a watermark only gets its latest page, older posts are left to the backfill
+    :return: number of posts sent
+    """
+    key = f"{STATE_PREFIX}:{search_term}"
+    state = r.hgetall(key)
+    newest = state.get("newest")
+    cursor = state.get("cursor")
+    pass_newest = state.get("pass_newest")
+    pass_oldest = state.get("pass_oldest")
+    sent = 0
+
+    while page_allowed(clock, s):
+        data = search(clock, headers, search_term, cursor)
+        posts = data.get("posts", [])
+        if not cursor and posts:
+            pass_newest = max(post.get("indexedAt", "") for post in posts)
+            if newest is None:
+                r.hset(key, "backfill_from", min(post.get("indexedAt", "") for post in posts))
+
+        # indexedAt is always formatted as YYYY-MM-DDTHH:MM:SS.sssZ, so the strings compare in time order
+        # the cursor is an offset in the results, the posts indexed since it was saved push posts
+        # already read by this pass back onto the page
+        fresh = [post for post in posts
+                 if (newest is None or post.get("indexedAt", "") > newest)
+                 and (pass_oldest is None or post.get("indexedAt", "") < pass_oldest)]
+        if fresh:
+            fetched = post_schema.fetched_at()
+            batch = [convert_bluesky_post_to_target_format(post, search_term, fetched) for post in fresh]
+            queue_publisher.publish(QUEUE_ENDPOINT, batch)
+            sent += len(batch)
+
+        # the pass ends at the posts of the previous pass, at the end of the search, or after one page for a new term
+        cursor = data.get("cursor")
+        reached = newest is None or any(post.get("indexedAt", "") <= newest for post in posts)
+        if reached or not cursor:
+            watermark = max(filter(None, (newest, pass_newest)), default=None)
+            if watermark:
+                r.hset(key, "newest", watermark)
+            r.hdel(key, "cursor", "pass_newest", "pass_oldest")
+            break
+        if posts:
+            pass_oldest = min(filter(None, (pass_oldest, min(post.get("indexedAt", "") for post in posts))))
+        r.hset(key, mapping={"cursor": cursor, "pass_newest": pass_newest, "pass_oldest": pass_oldest})
+
+    return sent
+
+
+def backfill(r, clock: dict, s: dict, headers: dict, search_term: str) -> int:
+    """
+    Walk back from the first watermark of the term to BACKFILL_END_DATE with the budget left
+    :return: number of posts sent
+    """
+    key = f"{STATE_PREFIX}:{search_term}"
+    state = r.hgetall(key)
+    if state.get("backfill_done") or not state.get("newest"):
+        return 0
+    # the posts newer than the start of the backfill belong to the forward passes, and a cursor
+    # shifted by posts indexed since the previous invocation only re-reads posts already sent
+    backfill_from = state.get("backfill_from") or state["newest"]
+    cursor = state.get("backfill_cursor")
+    end_date = s["BACKFILL_END_DATE"]
+    sent = 0
+
+    while page_allowed(clock, s):
+        data = search(clock, headers, search_term, cursor)
+        posts = data.get("posts", [])
+        older = [post for post in posts if end_date <= post.get("indexedAt", "") < backfill_from]
+        if older:
+            fetched = post_schema.fetched_at()
+            batch = [convert_bluesky_post_to_target_format(post, search_term, fetched) for post in older]
+            queue_publisher.publish(QUEUE_ENDPOINT, batch)
+            sent += len(batch)
+            backfill_from = min(post.get("indexedAt", "") for post in older)
+
+        cursor = data.get("cursor")
+        if not cursor or not posts or min(post.get("indexedAt", "") for post in posts) < end_date:
+            r.hset(key, "backfill_done", 1)
+            r.hdel(key, "backfill_cursor")
+            current_app.logger.info(f"Backfill of '{search_term}' reached {end_date}")
+            break
+        r.hset(key, mapping={"backfill_from": backfill_from, "backfill_cursor": cursor})
+
+    return sent
 
 
 def fetch_bluesky_posts(token):
@@ -119,44 +480,35 @@ def fetch_bluesky_posts(token):
         
     The function:
     1. Gets the next search term from Redis
-    2. Fetches posts matching the search term
+    2. Fetches the posts indexed since the previous pass of the term, then, in backfill mode,
+       older posts, until the time budget, MAX_PAGES or the rate limit reserve is reached
     3. Converts posts to target format
-    4. Sends posts to the queue endpoint
+    4. Sends posts to the queue endpoint and saves the state of the term after every page
+
+    Returns:
+        int: number of posts sent
     """
-    r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+    s = {k: setting(k, v) for k, v in DEFAULTS.items()}
+    clock = {"deadline": time.monotonic() + s["HARVEST_BUDGET"], "pages": 0, "slowest": 0.0,
+             "page_start": None, "account": config('BSKY_USERNAME').strip()}
+    r = redis_pool.get_redis(decode_responses=True)
 
     # Get the current search term from Redis
     search_term = r.lpop(REDIS_TAGS_LIST)
     if not search_term:
         current_app.logger.warning("No more search terms in Redis list.")
-        return
+        return 0
 
-    url = "https://bsky.social/xrpc/app.bsky.feed.searchPosts"
     headers = {
         "Authorization": f"Bearer {token}",
         "Accept-Language": "en"
     }
-
-    params = {
-        "q": search_term,
-        "sort": "latest",
-        "limit": LIMIT
-    }
+    sent = 0
 
     try:
-        res = requests.get(url, headers=headers, params=params)
-        res.raise_for_status()
-        data = res.json()
-
-        posts = data.get("posts", [])
-        if not posts:
-            current_app.logger.warning(f"No posts found for term '{search_term}'")
-            return
-
-        # Process each post and send to queue
-        for post in posts:
-            post_data = convert_bluesky_post_to_target_format(post, search_term)
-            requests.post(QUEUE_ENDPOINT, json=post_data, timeout=5)
+        sent += forward_pass(r, clock, s, headers, search_term)
+        if s["BACKFILL"]:
+            sent += backfill(r, clock, s, headers, search_term)
 
     except Exception as e:
         current_app.logger.error(f"Error during fetch: {e}")
@@ -164,6 +516,10 @@ def fetch_bluesky_posts(token):
     finally:
         r.rpush(REDIS_TAGS_LIST, search_term)
 
+    current_app.logger.info(f"Sent {sent} posts of '{search_term}' in {clock['pages']} pages, "
+                            f"rate limit: {rate_governor.summary()}")
+    return sent
+
 
 def main():
     """
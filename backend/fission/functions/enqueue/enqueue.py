@@ -1,8 +1,60 @@
 import logging
 import json
-from typing import Dict, Any, Optional
+from typing import Any, Optional, List
 from flask import current_app, request
 import redis
+import redis_pool
+import post_schema
+
+# Maximum number of values sent in one LPUSH command, larger batches are
+# split into several LPUSH commands inside the same pipeline
+LPUSH_CHUNK_SIZE = 1000
+
+
+def parse_items(body: bytes) -> (List[Any], int):
+    """
+    Split a request body into the documents to enqueue.
+
+    Accepts a single JSON document, a JSON array of documents (one element per message)
+    or an NDJSON body (one JSON document per line).
+    :param body: raw request body
+    :return: list of parsed documents, number of NDJSON lines that could not be parsed
+    """
+    body = body.strip()
+    if not body:
+        return [], 0
+
+    try:
+        payload = post_schema.loads(body)
+        return (payload if isinstance(payload, list) else [payload]), 0
+    except ValueError:
+        # not a single JSON document, handle as NDJSON
+        pass
+
+    items, skipped = [], 0
+    for line in body.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            items.append(post_schema.loads(line))
+        except ValueError:
+            skipped += 1
+    return items, skipped
+
+
+def push_items(redis_client: redis.Redis, topic: str, values: List[bytes]) -> int:
+    """
+    Push every value to the topic list in a single pipelined round-trip.
+    :param redis_client: Redis client
+    :param topic: name of the Redis list
+    :param values: serialised documents
+    :return: length of the list after the push
+    """
+    pipe = redis_client.pipeline(transaction=False)
+    for i in range(0, len(values), LPUSH_CHUNK_SIZE):
+        pipe.lpush(topic, *values[i:i + LPUSH_CHUNK_SIZE])
+    return pipe.execute()[-1]
 
 
 def main() -> str:
@@ -11,39 +63,50 @@ def main() -> str:
     Handles:
     - Redis connection pooling
     - JSON payload serialization
+    - Single documents, JSON arrays and NDJSON bodies (one message per element)
     - Topic-based message routing via headers
     - Message size logging
 
     Returns:
-        'OK' with HTTP 200 on successful enqueue
+        JSON string with per-item counts (received, enqueued, skipped)
+        and the list length after the push, with HTTP 200 on successful enqueue
 
     Raises:
         redis.RedisError: For connection/operation failures
-        JSONDecodeError: If invalid payload received
     """
     req: Request = request
-    
+
     # Extract routing parameters
     topic: Optional[str] = req.headers.get('X-Fission-Params-Topic')
-    json_data: Dict[str, Any] = req.get_json()
-    
-    # Initialize Redis client with type annotation
-    redis_client: redis.StrictRedis = redis.StrictRedis(
-        host='redis-headless.redis.svc.cluster.local',
-        socket_connect_timeout=5,
-        decode_responses=False
-    )
-    
-    # Publish message to queue
-    redis_client.lpush(
-        topic,
-        json.dumps(json_data).encode('utf-8')
-    )
-    
+    body = req.get_data()
+    items, skipped = parse_items(body)
+
+    if not items:
+        current_app.logger.warning(f'Nothing to enqueue to {topic} topic')
+        return json.dumps({"topic": topic, "received": skipped, "enqueued": 0, "skipped": skipped})
+
+    if len(items) == 1 and not skipped and body.lstrip()[:1] == b"{":
+        # a single document, as queue_publisher sends them, is pushed as it was received
+        values: List[bytes] = [body.strip()]
+    else:
+        values = [post_schema.dumps(item) for item in items]
+
+    # Borrow a client from the pool shared by warm invocations
+    redis_client: redis.Redis = redis_pool.get_redis()
+
+    # Publish every message to the queue in one round-trip
+    length = push_items(redis_client, topic, values)
+
     # Structured logging with message metrics
     current_app.logger.info(
-        f'Enqueued to {topic} topic - '
-        f'Payload size: {len(json_data)} bytes'
+        f'Enqueued {len(values)} messages to {topic} topic - '
+        f'Payload size: {sum(len(v) for v in values)} bytes'
     )
-    
-    return 'OK'
+
+    return json.dumps({
+        "topic": topic,
+        "received": len(items) + skipped,
+        "enqueued": len(values),
+        "skipped": skipped,
+        "length": length
+    })
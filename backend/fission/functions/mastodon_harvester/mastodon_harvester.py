@@ -2,17 +2,57 @@
 Collect data from mastodon.au
 Using timeline_public, which means get the latest mastodon posts
 Finally, send the data to the enqueue/mastodon in redis
+Requests are paced by the rate limit bucket of the account shared with mastodon_harvester_tag
+
+The id of the newest post harvested is checkpointed in the mastodon:public hash, so every
+invocation only asks for the posts newer than it (since_id) and no post is sent twice. A
+page that comes back full may have skipped the posts between it and the checkpoint, which
+is logged as a gap.
+
+Adaptive mode (ADAPTIVE=1 in masto-config): an invocation pages forward from the checkpoint
+(min_id) until it meets the newest post, within HARVEST_BUDGET seconds and MAX_PAGES pages,
+so a busy period is not cut at 40 posts. It measures the posts per second of the timeline and
+derives the next poll from it: TARGET_POSTS posts per poll, between MIN_INTERVAL and
+MAX_INTERVAL seconds. The timer fires every MIN_INTERVAL seconds and the invocations before
+the next poll return at once, so quiet periods cost fewer calls.
+
+The timeline is read as plain JSON, as in mastodon_harvester_tag, and converted by post_schema.
 """
 
-from datetime import datetime
-from mastodon import Mastodon
+import time
+import uuid
+from typing import Any, List, Optional, Tuple
 import requests
-from flask import current_app
+import redis_pool
+import queue_publisher
+import rate_governor
+import post_schema
 
 LIMIT = 40
 CONFIG_MAP = "masto-config"
 QUEUE_ENDPOINT = "http://router.fission.svc.cluster.local/enqueue/mastodon"
 
+# polling of the public timeline, every key can be overridden in masto-config
+DEFAULTS = {
+    "ADAPTIVE": 0,  # 1 pages forward to the newest post and adapts the poll interval
+    "HARVEST_BUDGET": 15.0,  # seconds of paging per invocation in adaptive mode
+    "MAX_PAGES": 10,
+    "TARGET_POSTS": 30,  # posts expected per poll in adaptive mode, under a page
+    "MIN_INTERVAL": 10.0,  # seconds, the period of the timer in adaptive mode
+    "MAX_INTERVAL": 120.0,
+}
+# checkpoint and poll state: since_id, polled_at, rate (posts per second), next_due
+STATE_KEY = "mastodon:public"
+LOCK_KEY = "mastodon:public:lock"
+RATE_SMOOTHING = 0.5  # weight of the latest poll in the posts per second
+# delete the lock only if this invocation still holds it
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end
+return 0
+"""
+
+_session: Optional[requests.Session] = None
+
 
 def config(k: str) -> str:
     """
@@ -22,84 +62,150 @@ def config(k: str) -> str:
         return f.read()
 
 
-def fetch_post_data(post):
-    """
-    Process the raw data, only keep uniformly customised data structures
-    :param post: original post data
-    :return: processed post data struct
-    """
-    data = {
-        "id": post.get("id"),
-        "createdAt": post.get("created_at").isoformat() + "Z" if post.get("created_at") else None,
-        "content": post.get("content"),
-        "sensitive": post.get("sensitive", False),
-        "favouritesCount": post.get("favourites_count", 0),
-        "repliesCount": post.get("replies_count", 0),
-        "tags": [t["name"] for t in post.get("tags", [])],
-        "url": post.get("url"),
-
-        "account": {
-            "id": post["account"].get("id"),
-            "username": post["account"].get("username"),
-            "createdAt": post["account"]["created_at"].isoformat() + "Z"
-            if post["account"].get("created_at") else None,
-            "followersCount/linkKarma": post["account"].get("followers_count", 0),
-            "followingCount/commentKarma": post["account"].get("following_count", 0)
-        }
-    }
-
-    return {
-        "platform": "Mastodon",
-        "version": 1.1,
-        "fetchedAt": datetime.utcnow().isoformat() + "Z",
-        "sentiment": None,
-        "sentimentLabel": None,
-        "keywords": [],
-        "data": data
-    }
-
-
-def fetch_posts(limit):
-    """
-    Get data from mastodon posts, and return processed data
-    :param limit: int, maximum number of posts to fetch that mastodon allowed at once
-    :return: list of mastodon posts
+def setting(k: str, default: Any) -> Any:
     """
+    Optional config map value converted to the type of the default
+    """
+    try:
+        return type(default)(config(k).strip())
+    except (OSError, ValueError):
+        return default
+
 
-    # get token and url from CONFIG_MAP
-    access_token = config('ACCESS_TOKEN')
-    api_base = config('API_BASE_URL')
+def get_session(access_token: str) -> requests.Session:
+    """
+    Keep-alive session governed by the shared rate limit bucket, kept across warm invocations
+    """
+    global _session
+    if _session is None:
+        _session = rate_governor.GovernedSession("mastodon", access_token)
+    return _session
 
-    mastodon = Mastodon(
-        access_token=access_token,
-        api_base_url=api_base
+
+def timeline_public(session: requests.Session, **params) -> list:
+    """
+    One page of the public timeline, newest first
+    :param params: limit, since_id (the newest posts after it), min_id (the posts right after it)
+    """
+    resp = session.get(
+        f"{config('API_BASE_URL').strip().rstrip('/')}/api/v1/timelines/public",
+        params=params,
+        headers={"Authorization": f"Bearer {config('ACCESS_TOKEN').strip()}"},
+        timeout=30,
     )
+    resp.raise_for_status()
+    return resp.json()
 
-    posts = mastodon.timeline_public(limit=limit)
-    results = []
 
-    for post in posts:
-        results.append(fetch_post_data(post))
+def send(posts: list) -> int:
+    """
+    Process a page and send it to enqueue/mastodon concurrently
+    :return: number of posts sent
+    """
+    fetched = post_schema.fetched_at()
+    batch = [post_schema.from_mastodon(post, fetched) for post in posts]
+    queue_publisher.publish(QUEUE_ENDPOINT, batch)
+    return len(batch)
+
+
+def fetch_posts(limit: int, since_id: Optional[str]) -> Tuple[List[dict], bool]:
+    """
+    Get the newest posts after the checkpoint
+    :param limit: int, maximum number of posts to fetch that mastodon allowed at once
+    :param since_id: id of the newest post harvested, None for the latest posts
+    :return: the raw posts, newest first, and whether posts may have been skipped before them
+    """
+    session = get_session(config('ACCESS_TOKEN').strip())
+    params = {"limit": limit}
+    if since_id:
+        params["since_id"] = since_id
+    posts = timeline_public(session, **params)
+    return posts, bool(since_id) and len(posts) >= limit
 
-    return results
+
+def page_forward(r, since_id: str, s: dict) -> Tuple[int, int, bool]:
+    """
+    Adaptive mode: page forward from the checkpoint until the newest post, checkpointing every page
+    :return: posts sent, calls made, and whether the newest post was reached
+    """
+    session = get_session(config('ACCESS_TOKEN').strip())
+    deadline = time.monotonic() + s["HARVEST_BUDGET"]
+    sent = calls = 0
+    slowest = 0.0
+
+    while calls < s["MAX_PAGES"] and (calls == 0 or time.monotonic() + slowest <= deadline):
+        start = time.monotonic()
+        posts = timeline_public(session, limit=LIMIT, min_id=since_id)
+        calls += 1
+        if posts:
+            sent += send(posts)
+            since_id = posts[0]["id"]
+            r.hset(STATE_KEY, "since_id", since_id)
+        if len(posts) < LIMIT:
+            return sent, calls, True
+        slowest = max(slowest, time.monotonic() - start)
+    return sent, calls, False
+
+
+def next_interval(state: dict, sent: int, caught_up: bool, now: float, s: dict) -> Tuple[float, float]:
+    """
+    Posts per second of the timeline since the previous poll, smoothed, and the seconds until the next poll
+    """
+    rate = float(state.get("rate", 0))
+    if state.get("polled_at"):
+        elapsed = max(now - float(state["polled_at"]), 1e-3)
+        rate = RATE_SMOOTHING * sent / elapsed + (1 - RATE_SMOOTHING) * rate
+    if not caught_up:
+        # still behind the newest post, poll again at the next tick
+        return rate, s["MIN_INTERVAL"]
+    interval = s["TARGET_POSTS"] / rate if rate > 0 else s["MAX_INTERVAL"]
+    return rate, min(max(interval, s["MIN_INTERVAL"]), s["MAX_INTERVAL"])
+
+
+def poll(r, s: dict) -> str:
+    """
+    One poll of the public timeline from the checkpoint
+    :return: summary of the poll
+    """
+    state = r.hgetall(STATE_KEY)
+    since_id = state.get("since_id")
+    now = time.time()
+
+    if s["ADAPTIVE"] and since_id:
+        sent, calls, caught_up = page_forward(r, since_id, s)
+        gap = False
+    else:
+        posts, gap = fetch_posts(LIMIT, since_id)
+        sent, calls, caught_up = send(posts), 1, True
+        if posts:
+            r.hset(STATE_KEY, "since_id", posts[0]["id"])
+
+    rate, interval = next_interval(state, sent, caught_up, now, s)
+    r.hset(STATE_KEY, mapping={"polled_at": now, "rate": rate, "next_due": now + interval})
+    summary = f"{sent} posts in {calls} calls, {rate:.2f} posts/s, next poll in {interval:.0f}s"
+    if gap:
+        summary += ", the page was full so older posts since the checkpoint were skipped"
+    return summary
 
 
 def main():
-    # fetch number of limit post
-    posts = fetch_posts(limit=LIMIT)
-
-    # send to enqueue/mastodon one by one
-    for post in posts:
-        try:
-            requests.post(
-                url=QUEUE_ENDPOINT,
-                json=post,
-                timeout=5
-            )
-        except Exception as e:
-            current_app.logger.error(f"Error pushing to queue: {e}")
-
-    return "OK: fetched mastodon posts"
+    s = {k: setting(k, v) for k, v in DEFAULTS.items()}
+    r = redis_pool.get_redis(decode_responses=True)
+
+    # adaptive mode: the timer fires every MIN_INTERVAL, the polls are spaced by the rate of the timeline
+    if s["ADAPTIVE"]:
+        due = r.hget(STATE_KEY, "next_due")
+        if due and time.time() < float(due) - s["MIN_INTERVAL"] / 2:
+            return f"OK: skipped, next poll in {float(due) - time.time():.0f}s"
+
+    # one poll at a time, a second one would send the same posts
+    owner = uuid.uuid4().hex
+    if not r.set(LOCK_KEY, owner, nx=True, ex=int(s["HARVEST_BUDGET"]) + 30):
+        return "OK: skipped, another poll is running"
+    try:
+        return f"OK: {poll(r, s)}"
+    finally:
+        r.eval(RELEASE_SCRIPT, 1, LOCK_KEY, owner)
 
 
 if __name__ == "__main__":
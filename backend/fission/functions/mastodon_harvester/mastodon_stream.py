@@ -0,0 +1,336 @@
+"""
+Streaming mode of mastodon_harvester: follow the Mastodon streaming API instead of polling
+the public timeline.
+
+One reader thread per stream (the public stream, or one hashtag stream per tag of
+STREAM_TAGS) reads the server-sent events and queues every status. The statuses are
+converted with post_schema.from_mastodon in micro-batches of BATCH_SIZE posts, or
+whatever arrived within BATCH_WAIT seconds of the first one, and each micro-batch is pushed
+to the `mastodon` Redis list in one pipelined LPUSH, where the mqtrigger of post-processor
+picks it up.
+
+The id of the newest status of every stream is checkpointed in the mastodon:stream hash.
+When a stream drops, the reader reconnects with exponential backoff, then pages the
+timeline of the stream forward from the checkpoint (min_id) so the posts published while
+it was disconnected are not lost. The same backfill closes the gap between two invocations.
+Posts seen twice around a reconnect are dropped before they are pushed.
+
+An invocation streams for STREAM_SECONDS seconds and returns, the timer starts the next
+one. A Redis lock keeps a single streamer running, so STREAM_SECONDS has to end before the
+next tick of the timer (540s for the 10 minute timer), otherwise the tick finds the lock
+still taken and the stream stays down until the one after.
+
+Settings are optional entries of masto-config:
+- STREAM_TAGS: comma separated tags, empty for the public stream
+- STREAM_URL: base URL of the streaming API, API_BASE_URL if not set
+- STREAM_SECONDS: seconds per invocation
+- BATCH_SIZE, BATCH_WAIT: posts and seconds of a micro-batch
+- RECONNECT_BACKOFF, RECONNECT_MAX: seconds between reconnects
+- BACKFILL_PAGES: maximum timeline pages per backfill, 0 pages until the stream is reached
+
+Counters of the invocation are kept in `stats` and returned.
+"""
+
+import logging
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import quote
+import redis
+import requests
+from flask import current_app, has_app_context
+import redis_pool
+import post_schema
+import mastodon_harvester
+from mastodon_harvester import config, setting
+
+TOPIC = "mastodon"
+DEFAULTS = {
+    "STREAM_TAGS": "",
+    "STREAM_URL": "",
+    "STREAM_SECONDS": 540.0,
+    "BATCH_SIZE": 100,
+    "BATCH_WAIT": 1.0,
+    "RECONNECT_BACKOFF": 1.0,
+    "RECONNECT_MAX": 30.0,
+    "BACKFILL_PAGES": 0,
+}
+CHECKPOINT_KEY = "mastodon:stream"
+LOCK_KEY = "mastodon:stream:lock"
+READ_TIMEOUT = 60  # seconds without an event or a heartbeat before reconnecting
+RECENT_IDS = 10000  # ids remembered to drop the posts seen twice around a reconnect
+
+stats: Dict[str, Any] = {}
+_lock = threading.Lock()
+
+
+def logger() -> logging.Logger:
+    """
+    Flask app logger inside an invocation, module logger otherwise
+    """
+    return current_app.logger if has_app_context() else logging.getLogger(__name__)
+
+
+def count(k: str, n: float = 1):
+    with _lock:
+        stats[k] = stats.get(k, 0) + n
+
+
+def streams(tags: str) -> List[Tuple[str, str, dict]]:
+    """
+    Streams to follow: checkpoint field, streaming path and query of each one
+    """
+    tags = [t.strip().lstrip("#") for t in tags.split(",") if t.strip()]
+    if not tags:
+        return [("public", "/api/v1/streaming/public", {})]
+    return [(f"hashtag:{tag}", "/api/v1/streaming/hashtag", {"tag": tag}) for tag in tags]
+
+
+def timeline_path(field: str) -> str:
+    """
+    REST timeline of a stream, for the backfill
+    """
+    if field == "public":
+        return "/api/v1/timelines/public"
+    return f"/api/v1/timelines/tag/{quote(field.split(':', 1)[1], safe='')}"
+
+
+def newer(a: Optional[str], b: Optional[str]) -> Optional[str]:
+    """
+    The newer of two status ids, ids are increasing integers sent as strings
+    """
+    if not a or not b:
+        return a or b
+    return a if int(a) > int(b) else b
+
+
+def events(resp: requests.Response) -> Iterator[Tuple[str, str]]:
+    """
+    Server-sent events of a streaming response: (event, data), heartbeat comments are skipped
+    """
+    event, data = None, []
+    # chunk_size=None hands every chunk of the stream over as soon as it arrives
+    for line in resp.iter_lines(chunk_size=None, decode_unicode=True):
+        if line is None:
+            continue
+        if not line:
+            if event and data:
+                yield event, "\n".join(data)
+            event, data = None, []
+        elif line.startswith(":"):
+            continue
+        elif line.startswith("event:"):
+            event = line[6:].strip()
+        elif line.startswith("data:"):
+            data.append(line[5:].lstrip())
+
+
+def backfill(field: str, since_id: str, inbox: queue.Queue, pages: int, stop: threading.Event) -> Optional[str]:
+    """
+    Page the timeline of a stream forward from since_id and queue the statuses, oldest first,
+    while the pages come back full
+    :param pages: maximum number of pages, 0 for no limit
+    :return: id of the newest status queued, None if there was none
+    """
+    session = mastodon_harvester.get_session(config('ACCESS_TOKEN').strip())
+    url = f"{config('API_BASE_URL').strip().rstrip('/')}{timeline_path(field)}"
+    newest = None
+    done = 0
+    while not stop.is_set():
+        if pages and done >= pages:
+            # the posts between this page and the opening of the stream are not harvested
+            logger().warning(f"Mastodon stream {field}: backfill stopped after {pages} pages at {since_id}, "
+                             f"the newer posts before the stream opened are skipped")
+            count("backfill_cut")
+            break
+        resp = session.get(url, params={"limit": mastodon_harvester.LIMIT, "min_id": since_id},
+                           headers={"Authorization": f"Bearer {config('ACCESS_TOKEN').strip()}"}, timeout=30)
+        resp.raise_for_status()
+        posts = resp.json()
+        done += 1
+        for post in reversed(posts):
+            inbox.put((field, post, time.monotonic()))
+        count("backfilled", len(posts))
+        if posts:
+            since_id = newest = posts[0]["id"]
+        if len(posts) < mastodon_harvester.LIMIT:
+            break
+    return newest
+
+
+def read(field: str, path: str, params: dict, since_id: Optional[str], inbox: queue.Queue,
+         stop: threading.Event, s: dict, responses: dict):
+    """
+    Reader thread of one stream: connect, backfill from the last status seen, queue the updates,
+    and reconnect until stop is set
+    """
+    base = (s["STREAM_URL"] or config('API_BASE_URL')).strip().rstrip('/')
+    headers = {"Authorization": f"Bearer {config('ACCESS_TOKEN').strip()}", "Accept": "text/event-stream"}
+    session = requests.Session()
+    delay = s["RECONNECT_BACKOFF"]
+
+    while not stop.is_set():
+        resp = None
+        try:
+            resp = session.get(f"{base}{path}", params=params, headers=headers, stream=True,
+                               timeout=(10, READ_TIMEOUT))
+            resp.raise_for_status()
+            responses[field] = resp
+            # the stream is open and buffers the new posts while the gap is paged
+            if since_id:
+                since_id = newer(backfill(field, since_id, inbox, s["BACKFILL_PAGES"], stop), since_id)
+            delay = s["RECONNECT_BACKOFF"]
+            for event, data in events(resp):
+                if stop.is_set():
+                    break
+                if event != "update":
+                    continue
+                # a malformed event is skipped, the stream itself is still fine
+                try:
+                    status = post_schema.loads(data)
+                except ValueError:
+                    status = None
+                if not isinstance(status, dict) or not status.get("id"):
+                    count("invalid")
+                    continue
+                inbox.put((field, status, time.monotonic()))
+                since_id = newer(status["id"], since_id)
+            else:
+                if not stop.is_set():
+                    logger().warning(f"Mastodon stream {field} closed by the server")
+        except (requests.RequestException, ValueError) as e:
+            if stop.is_set():
+                break
+            logger().warning(f"Mastodon stream {field} failed, reconnecting in {delay:.1f}s: {e}")
+        except Exception as e:
+            # run() closes the response at the deadline, which breaks the read
+            if stop.is_set():
+                break
+            count("errors")
+            logger().exception(f"Mastodon stream {field} failed, reconnecting in {delay:.1f}s: {e!r}")
+        if stop.is_set():
+            break
+        if resp is not None:
+            resp.close()
+        count("reconnects")
+        stop.wait(delay)
+        delay = min(delay * 2, s["RECONNECT_MAX"])
+
+
+def push(r: redis.Redis, batch: List[post_schema.Post]) -> int:
+    """
+    Push a micro-batch to the mastodon list in a single pipelined LPUSH
+    :return: length of the list after the push
+    """
+    pipe = r.pipeline(transaction=False)
+    pipe.lpush(TOPIC, *[post_schema.dumps(post) for post in batch])
+    return pipe.execute()[-1]
+
+
+def publish(r: redis.Redis, batch: List[Tuple[str, dict, float]], checkpoints: Dict[str, str]):
+    """
+    Convert and push a micro-batch, then checkpoint the newest id of every stream in it
+    """
+    fetched = post_schema.fetched_at()
+    posts = [post_schema.from_mastodon(status, fetched) for _, status, _ in batch]
+    push(r, posts)
+    done = time.monotonic()
+
+    newest: Dict[str, str] = {}
+    for field, status, received in batch:
+        newest[field] = newer(status["id"], newest.get(field))
+        stats["latency"].append(done - received)
+    for field, status_id in newest.items():
+        checkpoints[field] = newer(status_id, checkpoints.get(field))
+    r.hset(CHECKPOINT_KEY, mapping=checkpoints)
+    count("published", len(posts))
+    count("batches")
+
+
+def run(r: redis.Redis, s: dict, deadline: float):
+    """
+    Follow the streams and push micro-batches until the deadline
+    """
+    checkpoints = r.hgetall(CHECKPOINT_KEY)
+    inbox: queue.Queue = queue.Queue()
+    stop = threading.Event()
+    responses: Dict[str, requests.Response] = {}
+    readers = [threading.Thread(target=read, daemon=True,
+                                args=(field, path, params, checkpoints.get(field), inbox, stop, s, responses))
+               for field, path, params in streams(s["STREAM_TAGS"])]
+    for t in readers:
+        t.start()
+
+    recent: "OrderedDict[str, None]" = OrderedDict()
+    batch: List[Tuple[str, dict, float]] = []
+    first = 0.0
+    try:
+        while True:
+            now = time.monotonic()
+            # a batch that waited long enough still takes the posts already queued, so a backlog
+            # goes out in full batches
+            due = now >= first + s["BATCH_WAIT"] and inbox.empty()
+            if batch and (len(batch) >= s["BATCH_SIZE"] or due or now >= deadline):
+                publish(r, batch, checkpoints)
+                batch = []
+            if now >= deadline:
+                break
+            wait = min(deadline, first + s["BATCH_WAIT"]) - now if batch else deadline - now
+            try:
+                item = inbox.get(timeout=max(wait, 0.001))
+            except queue.Empty:
+                continue
+            count("received")
+            # the same post from the backfill and the stream, or from two hashtag streams
+            if item[1]["id"] in recent:
+                count("duplicates")
+                continue
+            recent[item[1]["id"]] = None
+            if len(recent) > RECENT_IDS:
+                recent.popitem(last=False)
+            if not batch:
+                first = item[2]
+            batch.append(item)
+    finally:
+        stop.set()
+        for resp in list(responses.values()):
+            resp.close()
+        for t in readers:
+            t.join(timeout=5)
+
+
+def summary() -> str:
+    latency = sorted(stats["latency"])
+    p50 = latency[len(latency) // 2] * 1000 if latency else 0.0
+    p95 = latency[int(len(latency) * 0.95)] * 1000 if latency else 0.0
+    return (f"{stats.get('published', 0)} posts in {stats.get('batches', 0)} batches, "
+            f"{stats.get('backfilled', 0)} backfilled, {stats.get('duplicates', 0)} duplicates dropped, "
+            f"{stats.get('invalid', 0)} invalid events, {stats.get('reconnects', 0)} reconnects, "
+            f"{stats.get('errors', 0)} errors, latency p50 {p50:.0f}ms p95 {p95:.0f}ms")
+
+
+def main():
+    s = {k: setting(k, v) for k, v in DEFAULTS.items()}
+    r = redis_pool.get_redis(decode_responses=True)
+
+    # one streamer at a time, a second one would push every post twice
+    owner = uuid.uuid4().hex
+    if not r.set(LOCK_KEY, owner, nx=True, ex=int(s["STREAM_SECONDS"]) + 30):
+        return "OK: skipped, another stream is running"
+    stats.clear()
+    stats["latency"] = []
+    try:
+        run(r, s, time.monotonic() + s["STREAM_SECONDS"])
+    finally:
+        r.eval(mastodon_harvester.RELEASE_SCRIPT, 1, LOCK_KEY, owner)
+
+    result = summary()
+    logger().info(f"Mastodon stream: {result}")
+    return f"OK: {result}"
+
+
+if __name__ == "__main__":
+    main()
@@ -6,23 +6,64 @@ specified TAG and paging
 3. Use Redis to record the max_id of each tag to achieve breakpoints
 4. When a tag backtracks to END_DATE, it automatically removed the current tag from the list,
 and switched to the next tag
+
+Each invocation keeps paging until the HARVEST_BUDGET seconds of masto-config are used up (the
+next page is only started if it is expected to finish in time), MAX_PAGES pages, or the
+instance is down to RATELIMIT_RESERVE requests, with the max_id checkpoint written after every
+page, so a killed pod loses at most one page. Every page takes a request from the rate limit
+bucket of the account shared by all harvesters (rate_governor), waiting for it within the budget.
+
+Scheduler mode (TAG_CONCURRENCY > 0 in masto-config): instead of the first tag of the list,
+an invocation leases up to TAG_CONCURRENCY tags that no other pod is working on (a
+mastodon:lease:<tag> key set with NX and a TTL) and pages them concurrently.
+
+The timeline is read as plain JSON over a keep-alive session: Mastodon.py 2.x casts every
+status into typed entities at about 70ms of CPU per status, which would serialise the
+workers on the GIL. The statuses are converted by post_schema.
 """
 
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
-from mastodon import Mastodon, MastodonNetworkError
+from typing import Any, List, Optional, Tuple
+from urllib.parse import quote
 import requests
+from requests.adapters import HTTPAdapter
 from flask import current_app
-import redis
+import redis_pool
+import queue_publisher
+import rate_governor
+import post_schema
 
 REDIS_TAGS_LIST = "mastodon:tags"
 
 LIMIT = 40
 END_DATE = datetime(2023, 1, 1, tzinfo=timezone.utc)
 CONFIG_MAP = "masto-config"
-REDIS_HOST = "redis-headless.redis.svc.cluster.local"
-REDIS_PORT = 6379
 QUEUE_ENDPOINT = "http://router.fission.svc.cluster.local/enqueue/mastodon"
 
+# paging and scheduler mode, every key can be overridden in masto-config
+DEFAULTS = {
+    "TAG_CONCURRENCY": 0,  # tags leased per invocation, 0 pages the first tag of the list
+    "HARVEST_BUDGET": 20.0,  # seconds of paging per invocation, 0 fetches one page
+    "MAX_PAGES": 50,  # pages per tag per invocation
+    "LEASE_TTL": 120,  # seconds, longer than HARVEST_BUDGET
+    "RATELIMIT_RESERVE": 20,  # requests left to the other harvesters of the instance
+}
+LEASE_PREFIX = "mastodon:lease"
+
+# delete a lease only if this invocation still holds it
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end
+return 0
+"""
+
+_session: Optional[requests.Session] = None
+_session_size = 0
+_session_lock = threading.Lock()
+
 
 def config(k: str) -> str:
     """
@@ -32,116 +73,204 @@ def config(k: str) -> str:
         return f.read()
 
 
-def fetch_post_data(post):
-    """
-        Process the raw data, only keep uniformly customised data structures
-        :param post: original post data
-        :return: processed post data struct
-    """
-    data = {
-        "id": post.get("id"),
-        "createdAt": post.get("created_at").isoformat() + "Z" if post.get("created_at") else None,
-        "content": post.get("content"),
-        "sensitive": post.get("sensitive", False),
-        "favouritesCount": post.get("favourites_count", 0),
-        "repliesCount": post.get("replies_count", 0),
-        "tags": [t["name"] for t in post.get("tags", [])],
-        "url": post.get("url"),
-
-        "account": {
-            "id": post["account"].get("id"),
-            "username": post["account"].get("username"),
-            "createdAt": post["account"]["created_at"].isoformat() + "Z"
-            if post["account"].get("created_at") else None,
-            "followersCount/linkKarma": post["account"].get("followers_count", 0),
-            "followingCount/commentKarma": post["account"].get("following_count", 0)
-        }
-    }
-
-    return {
-        "platform": "Mastodon",
-        "version": 1.1,
-        "fetchedAt": datetime.utcnow().isoformat() + "Z",
-        "sentiment": None,
-        "sentimentLabel": None,
-        "keywords": [],
-        "data": data
-    }
-
-
-def fetch_tags_and_send_posts():
-    r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+def setting(k: str, default: Any) -> Any:
+    """
+    Optional config map value converted to the type of the default
+    """
+    try:
+        return type(default)(config(k).strip())
+    except (OSError, ValueError):
+        return default
+
+
+def get_session(pool_size: int) -> requests.Session:
+    """
+    Keep-alive session of the scheduler, kept across warm invocations
+    and rebuilt when a larger connection pool is needed (TAG_CONCURRENCY raised)
+    :param pool_size: connections kept per host
+    """
+    global _session, _session_size
+    with _session_lock:
+        if _session is None or _session_size < pool_size:
+            if _session is not None:
+                _session.close()
+            session = requests.Session()
+            session.mount("https://", HTTPAdapter(pool_maxsize=pool_size))
+            session.mount("http://", HTTPAdapter(pool_maxsize=pool_size))
+            _session, _session_size = session, pool_size
+        return _session
+
+
+def to_batch(posts: list) -> Tuple[List[post_schema.Post], bool]:
+    """
+    Process one page of raw posts
+    :return: the processed posts newer than END_DATE, and whether the page reached END_DATE
+    """
+    fetched = post_schema.fetched_at()
+    end_date = END_DATE.date().isoformat()
+    batch = []
+    for record in posts:
+        post = post_schema.from_mastodon(record, fetched)
+
+        # ISO dates in UTC compare as strings
+        if post.created_at and post.created_at[:10] < end_date:
+            return batch, True
+        batch.append(post)
+    return batch, False
+
+
+def fetch_tags_and_send_posts(s: dict) -> int:
+    """
+    Page the first tag of the list within the time budget
+    :return: number of posts sent
+    """
+    r = redis_pool.get_redis(decode_responses=True)
 
     # get the tag from redis list, if no more tag in list, then top
     tag = r.lindex(REDIS_TAGS_LIST, 0)
     if not tag:
         current_app.logger.warning("No more tags in Redis list.")
-        return
+        return 0
+
+    return page_tag(r, get_session(1), tag, s, time.monotonic() + s["HARVEST_BUDGET"])
+
+
+def lease_tags(r, k: int, owner: str, ttl: int) -> List[str]:
+    """
+    Lease the first k tags of the list that are not leased by another invocation
+    """
+    leased = []
+    for tag in r.lrange(REDIS_TAGS_LIST, 0, -1):
+        if r.set(f"{LEASE_PREFIX}:{tag}", owner, nx=True, ex=ttl):
+            leased.append(tag)
+            if len(leased) == k:
+                break
+    return leased
+
+
+def timeline_hashtag(session: requests.Session, tag: str, max_id: Optional[int]) -> requests.Response:
+    """
+    One page of the hashtag timeline, newest first, older than max_id
+    """
+    params = {"limit": LIMIT, "remote": "true"}
+    if max_id is not None:
+        params["max_id"] = max_id
+    return session.get(
+        f"{config('API_BASE_URL').strip().rstrip('/')}/api/v1/timelines/tag/{quote(tag)}",
+        params=params,
+        headers={"Authorization": f"Bearer {config('ACCESS_TOKEN').strip()}"},
+        timeout=30,
+    )
+
 
-    # get the last recorded max_id from redis list
+def page_tag(r, session: requests.Session, tag: str, s: dict, deadline: float) -> int:
+    """
+    Page one tag back towards END_DATE until the deadline, checkpointing max_id after every page
+    :param deadline: time.monotonic() after which no page may still be running, the first page is always fetched
+    :return: number of posts sent
+    """
     redis_key = f"mastodon:max_id:{tag}"
     max_id_str = r.get(redis_key)
-    if max_id_str:
-        max_id = int(max_id_str)
-    else:
-        max_id = None
+    max_id = int(max_id_str) if max_id_str else None
+    sent = pages = 0
+    slowest = 0.0
 
-    access_token = config('ACCESS_TOKEN')
-    api_base = config('API_BASE_URL')
+    for pages in range(1, s["MAX_PAGES"] + 1):
+        if pages > 1 and time.monotonic() + slowest > deadline:
+            pages -= 1
+            break
+        # wait for a request of the shared bucket only as long as the page would still fit in the budget
+        if not rate_governor.acquire("mastodon", config('ACCESS_TOKEN'), reserve=s["RATELIMIT_RESERVE"],
+                                     max_wait=max(0.0, deadline - time.monotonic() - slowest)):
+            current_app.logger.warning(f"Rate limit reserve reached, stopped {tag} at max_id={max_id}")
+            break
+        start = time.monotonic()
 
-    mastodon = Mastodon(
-        access_token=access_token,
-        api_base_url=api_base,
-        request_timeout=30
-    )
+        try:
+            resp = timeline_hashtag(session, tag, max_id)
+        except requests.RequestException as e:
+            current_app.logger.error(f"Mastodon Network Error：{e}")
+            break
+        rate_governor.observe("mastodon", config('ACCESS_TOKEN'), resp.headers, resp.status_code)
+        if resp.status_code == 429:
+            current_app.logger.warning(f"Mastodon rate limit reached, stopped {tag} at max_id={max_id}")
+            break
+        if resp.status_code != 200:
+            current_app.logger.error(f"Mastodon error {resp.status_code} for {tag}: {resp.text[:200]}")
+            break
 
-    # fetch data from mastodon.au
-    try:
-        posts = mastodon.timeline_hashtag(
-            tag,
-            limit=LIMIT,
-            max_id=max_id,
-            remote=True,
-        )
-    except MastodonNetworkError as e:
-        current_app.logger.error(f"Mastodon Network Error：{e}")
-        return
-
-    if not posts:
-        r.lpop(REDIS_TAGS_LIST)
-        current_app.logger.warning(f"No more posts, Removed {tag} from Redis.")
-        return
-
-    # process raw data, and send to redis used by enqueue
-    for record in posts:
-        post = fetch_post_data(record)
+        posts = resp.json()
+        if not posts:
+            r.lrem(REDIS_TAGS_LIST, 1, tag)
+            current_app.logger.warning(f"No more posts, Removed {tag} from Redis.")
+            break
 
-        created_str = post["data"]["createdAt"]
-        created_dt = datetime.fromisoformat(
-            created_str.replace("Z", "")
-        ).date() if created_str else None
+        # process raw data, and send to redis used by enqueue
+        batch, touched_end = to_batch(posts)
+        queue_publisher.publish(QUEUE_ENDPOINT, batch)
+        sent += len(batch)
 
-        # checking for exceeding the specified time
-        if created_dt and created_dt < END_DATE.date():
-            r.lpop(REDIS_TAGS_LIST)
+        # checking for exceeding the specified time, the posts before it are still sent
+        if touched_end:
+            r.lrem(REDIS_TAGS_LIST, 1, tag)
             current_app.logger.warning(f"Touched END_DATE. Removed {tag} from Redis.")
-            return
+            break
 
-        try:
-            requests.post(QUEUE_ENDPOINT, json=post, timeout=5)
-        except Exception as e:
-            current_app.logger.error(f"Error pushing to queue：{e}")
+        # updated max_id and send to redis
+        max_id = int(posts[-1]["id"]) - 1
+        r.set(redis_key, max_id)
+        slowest = max(slowest, time.monotonic() - start)
+
+    current_app.logger.info(f"Sent {sent} posts of {tag} in {pages} pages, max_id={max_id}, "
+                            f"rate limit: {rate_governor.summary()}")
+    return sent
+
+
+def harvest_tag(r, session: requests.Session, tag: str, owner: str, s: dict, deadline: float) -> int:
+    """
+    Page one leased tag, then release the lease
+    :return: number of posts sent
+    """
+    try:
+        return page_tag(r, session, tag, s, deadline)
+    finally:
+        r.eval(RELEASE_SCRIPT, 1, f"{LEASE_PREFIX}:{tag}", owner)
 
-    # updated max_id and send to redis
-    new_max_id = int(posts[-1]["id"]) - 1
-    r.set(redis_key, new_max_id)
-    current_app.logger.info(f"Updated new max_id={new_max_id}")
 
-    return
+def schedule_tags(k: int, s: dict) -> int:
+    """
+    Scheduler mode: lease up to k tags and harvest them concurrently
+    :return: number of posts sent
+    """
+    deadline = time.monotonic() + s["HARVEST_BUDGET"]
+    r = redis_pool.get_redis(decode_responses=True)
+    owner = uuid.uuid4().hex
+
+    tags = lease_tags(r, k, owner, s["LEASE_TTL"])
+    if not tags:
+        current_app.logger.warning("No unleased tags in Redis list.")
+        return 0
+
+    # the workers log through the app of this invocation
+    app = current_app._get_current_object()
+    session = get_session(k)
+
+    def work(tag: str) -> int:
+        with app.app_context():
+            return harvest_tag(r, session, tag, owner, s, deadline)
+
+    with ThreadPoolExecutor(max_workers=len(tags)) as executor:
+        sent = sum(executor.map(work, tags))
+    current_app.logger.info(f"Sent {sent} posts of {len(tags)} tags: {', '.join(tags)}")
+    return sent
 
 
 def main():
-    fetch_tags_and_send_posts()
+    s = {k: setting(k, v) for k, v in DEFAULTS.items()}
+    if s["TAG_CONCURRENCY"] > 0:
+        schedule_tags(s["TAG_CONCURRENCY"], s)
+    else:
+        fetch_tags_and_send_posts(s)
 
     return "OK"
 
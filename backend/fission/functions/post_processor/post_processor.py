@@ -4,36 +4,202 @@ produce sentiment, sentiment label and keywords from the context,
 finally, send to back to redis list named elastic, we only process English context, otherwise drop it
 
 Sentiment value used by VADER, Key word extractor used by YAKE
+
+The whole KEDA batch is enriched stage by stage (clean, language, sentiment, keywords),
+each stage being one pass over the list, and the results are handed to the output sink in one go.
+YAKE is the most CPU heavy stage and can be spread over a process pool of KEYWORD_WORKERS
+processes (shared-data config map).
+
+Language identification is tiered, langdetect is only called when the cheaper tiers are unsure:
+1. texts that are mostly non-ASCII letters are dropped
+2. the language declared by the harvester (Mastodon language, Bluesky langs) is used when present
+3. a high ratio of English-only stop words accepts the text, unless foreign stop words come close
+4. langdetect, cached by the hash of the normalised text (cross-posts, retoots)
+
+Posts already seen (same platform_id key as add_es) are dropped before any enrichment.
+The seen ids are kept in one Redis SET per day (dedup:seen:<days since the epoch>), each SET
+expiring after DEDUP_TTL. They are only marked as seen once the sink took the batch: a sink
+failure is raised, so the trigger delivers the batch again and it is processed again.
+
+Output sinks, chosen by POST_PROCESSOR_SINK in the shared-data config map:
+- redis: pipelined LPUSH of the whole batch straight into the elastic list (default)
+- http: one POST of the whole batch to enqueue/elastic through the Fission router
+- inprocess: call handoff_handler with the batch, for code running in the same process
 """
 
+import hashlib
+import re
+import time
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor
 from bs4 import BeautifulSoup
 from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
 import yake
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional, Tuple, Callable
 import requests
 from flask import request, current_app
 from langdetect import detect, DetectorFactory, LangDetectException
+import redis_pool
+import post_schema
 
 DetectorFactory.seed = 0
 analyzer = SentimentIntensityAnalyzer()
 kw_extractor = yake.KeywordExtractor(lan="en", n=1, top=5)
 
+CONFIG_MAP = "shared-data"
+OUTPUT_SINK = "redis"
+OUTPUT_LIST = "elastic"
+QUEUE_ENDPOINT = f"http://router.fission.svc.cluster.local/enqueue/{OUTPUT_LIST}"
+LPUSH_CHUNK_SIZE = 1000
+
+# receives the enriched batch when the inprocess sink is used
+handoff_handler: Optional[Callable[[List[Dict[str, Any]]], Any]] = None
+
+# processes used by the keyword stage, 0 keeps it in the function process,
+# overridden by KEYWORD_WORKERS in the config map
+KEYWORD_WORKERS = 0
+# batches smaller than this are not worth the inter-process overhead
+KEYWORD_POOL_MIN_BATCH = 20
+
+_keyword_pool: Optional[ProcessPoolExecutor] = None
+_keyword_pool_workers = 0
+
+# language identification tiers
+ASCII_MIN_RATIO = 0.6
+STOPWORD_EN_RATIO = 0.25
+STOPWORD_HINTED_RATIO = 0.1
+STOPWORD_MIN_TOKENS = 4
+# the english stop words have to outnumber the foreign ones this many times
+STOPWORD_EN_MARGIN = 3
+LANGUAGE_CACHE_SIZE = 10000
+# english only: words that are also common in other latin script languages (in, is, was, de,
+# also, will, we, of, at, a, i...) are left out, they would let dutch or german posts through
+EN_STOPWORDS = frozenset("""
+about after and any are be because been but by can could did does from get got has have his
+how if into it its just like more not now one our out she should some than that the their
+them then there these they this those too up us what when where which who why with would you
+your
+""".split())
+# frequent stop words of the other latin script languages of the harvested platforms
+FOREIGN_STOPWORDS = frozenset("""
+al als auch aber bei das dass dem der des die du een ein eine einen es est et har het ich
+ik il ist je jeg la las le les los mais med mit mij nicht niet och og ook op os para pas
+por que qui som sont su sur und una une uno voor wat weil wie zijn zu
+""".split())
+TOKEN_RE = re.compile(r"[^\W\d_]+(?:'[^\W\d_]+)?")
+NOISE_RE = re.compile(r"https?://\S+|[@#]\w+")
+
+_language_cache: "OrderedDict[bytes, str]" = OrderedDict()
+language_stats: Dict[str, int] = {"ascii": 0, "hint": 0, "stopwords": 0, "cache": 0, "langdetect": 0}
+
+# posts already seen are dropped before enrichment
+DEDUP_ENABLED = True
+DEDUP_KEY_PREFIX = "dedup:seen"
+DEDUP_STATS_KEY = "dedup:stats"
+DEDUP_TTL = 7 * 24 * 3600
+DEDUP_BUCKET = 24 * 3600
+DEDUP_REPORT_EVERY = 50
+
+dedup_stats: Dict[str, int] = {"hits": 0, "misses": 0, "invocations": 0}
+
+
+def config(k: str) -> str:
+    """
+    Reads configuration from config map file
+    """
+    with open(f'/configs/default/{CONFIG_MAP}/{k}', 'r') as f:
+        return f.read()
+
+
+def setting(k: str, default: Any) -> Any:
+    """
+    Optional config map value converted to the type of the default
+    """
+    try:
+        return type(default)(config(k).strip())
+    except (OSError, ValueError):
+        return default
+
+
+def keyword_workers() -> int:
+    """
+    Processes of the keyword stage, KEYWORD_WORKERS in the config map
+    """
+    return max(0, setting('KEYWORD_WORKERS', KEYWORD_WORKERS))
+
+
+def normalise(context: str) -> str:
+    """
+    lower case text without links, mentions, hashtags and repeated white space
+    """
+    return " ".join(NOISE_RE.sub(" ", context.lower()).split())
+
+
+def detect_cached(context: str) -> str:
+    """
+    langdetect result, cached by the hash of the normalised text
+    :param context: string
+    :return: language code, empty string if it can not be detected
+    """
+    key = hashlib.blake2b(normalise(context).encode('utf-8'), digest_size=16).digest()
+    if key in _language_cache:
+        _language_cache.move_to_end(key)
+        language_stats["cache"] += 1
+        return _language_cache[key]
+
+    language_stats["langdetect"] += 1
+    try:
+        language = detect(context)
+    except LangDetectException as e:
+        current_app.logger.error(f"Language detection failed: {e}")
+        language = ""
+
+    _language_cache[key] = language
+    if len(_language_cache) > LANGUAGE_CACHE_SIZE:
+        _language_cache.popitem(last=False)
+    return language
 
-def is_legal_context(context: str) -> bool:
+
+def is_legal_context(context: str, hint: Optional[str] = None) -> bool:
     """
     checks if context is english or legal context
     :param context: string
+    :param hint: language declared by the harvester, e.g. "en", "de", None if unknown
     :return: bool
     """
     context = context.strip()
     if len(context) < 10:
         return False
-    try:
-        return detect(context) == 'en'
-    except LangDetectException as e:
-        current_app.logger.error(f"Language detection failed: {e}")
+
+    # mostly non-latin script
+    letters = [c for c in context if c.isalpha()]
+    if letters and sum(c.isascii() for c in letters) / len(letters) < ASCII_MIN_RATIO:
+        language_stats["ascii"] += 1
         return False
 
+    tokens = TOKEN_RE.findall(normalise(context))
+    english = sum(t in EN_STOPWORDS for t in tokens)
+    foreign = sum(t in FOREIGN_STOPWORDS for t in tokens)
+    stop_ratio = english / len(tokens) if tokens else 0.0
+    # a few foreign stop words make the stop word tiers unsure, langdetect decides
+    clear = english >= STOPWORD_EN_MARGIN * foreign
+
+    # language declared by the author, double checked against the stop words when it says english
+    if hint:
+        hint = hint.lower()
+        if not hint.startswith("en"):
+            language_stats["hint"] += 1
+            return False
+        if clear and stop_ratio >= STOPWORD_HINTED_RATIO:
+            language_stats["hint"] += 1
+            return True
+
+    if clear and len(tokens) >= STOPWORD_MIN_TOKENS and stop_ratio >= STOPWORD_EN_RATIO:
+        language_stats["stopwords"] += 1
+        return True
+
+    return detect_cached(context) == 'en'
+
 
 def produce_sentiment_analysis(context: str) -> (float, str):
     """
@@ -62,46 +228,307 @@ def extract_keywords(context: str) -> List[str]:
     return [word for word, score in keywords]
 
 
-def main():
+def keyword_pool() -> Optional[Executor]:
     """
-    get data from redis list,
-    produce sentiment, sentiment label and keywords from the context,
-    finally, send to back to redis list named elastic, we only process English context, otherwise drop it
+    Process pool for the keyword stage, created on first use and kept by warm invocations,
+    replaced when KEYWORD_WORKERS changes in the config map
+    :return: Executor, None if KEYWORD_WORKERS is 0
     """
-    payload = request.get_json(force=True)
-    records: List[Dict[str, Any]] = payload if isinstance(payload, list) else [payload]
+    global _keyword_pool, _keyword_pool_workers
+    workers = keyword_workers()
+    if workers != _keyword_pool_workers:
+        if _keyword_pool is not None:
+            _keyword_pool.shutdown(wait=False)
+        _keyword_pool = ProcessPoolExecutor(max_workers=workers) if workers else None
+        _keyword_pool_workers = workers
+    return _keyword_pool
+
 
+def clean_contents(records: List[Dict[str, Any]]) -> List[Optional[str]]:
+    """
+    stage 1: strip the html of every record
+    :param records: batch of records
+    :return: plain text of each record, None if the html parser fails
+    """
+    texts = []
     for record in records:
-        # clean the text
         try:
-            clean_content = BeautifulSoup(record.get("data", {}).get("content", ""), 'html.parser').get_text()
+            texts.append(BeautifulSoup(record.get("data", {}).get("content", ""), 'html.parser').get_text())
         except Exception as e:
             current_app.logger.error(f"HTML parser fail: {e}")
-            continue
+            texts.append(None)
+    return texts
 
-        # only process language of post is english, otherwise drop it
-        if not is_legal_context(clean_content):
-            current_app.logger.error(f"Found non-english post, dropped: {clean_content}")
-            continue
 
-        # produce sentiment value and sentiment label
-        sentiment, sentiment_label = produce_sentiment_analysis(clean_content)
+def detect_english(texts: List[str], hints: Optional[List[Optional[str]]] = None) -> List[bool]:
+    """
+    stage 2: language of every text
+    :param texts: plain texts
+    :param hints: language declared by the harvester for each text
+    :return: whether each text is legal english context
+    """
+    hints = hints or [None] * len(texts)
+    return [is_legal_context(text, hint) for text, hint in zip(texts, hints)]
+
+
+def sentiment_batch(texts: List[str]) -> List[Tuple[float, str]]:
+    """
+    stage 3: sentiment value and sentiment label of every text
+    :param texts: plain texts
+    :return: list of (sentiment, sentiment label)
+    """
+    return [produce_sentiment_analysis(text) for text in texts]
+
+
+def keywords_batch(texts: List[str], executor: Optional[Executor] = None) -> List[List[str]]:
+    """
+    stage 4: top 5 keywords of every text, spread over the executor when one is given
+    :param texts: plain texts
+    :param executor: optional executor, e.g. a process pool
+    :return: keywords of each text
+    """
+    lowered = [text.lower() for text in texts]
+    if executor is None or len(lowered) < KEYWORD_POOL_MIN_BATCH:
+        return [extract_keywords(text) for text in lowered]
+    chunk = max(1, len(lowered) // (4 * (keyword_workers() or 1)))
+    return list(executor.map(extract_keywords, lowered, chunksize=chunk))
+
+
+def enrich_batch(records: List[Dict[str, Any]], executor: Optional[Executor] = None) -> List[Dict[str, Any]]:
+    """
+    produce sentiment, sentiment label and keywords for the whole batch,
+    records whose content is not english are dropped
+    :param records: batch of records
+    :param executor: executor of the keyword stage, defaults to keyword_pool()
+    :return: enriched records
+    """
+    texts = clean_contents(records)
+    parsed = [(record, text) for record, text in zip(records, texts) if text is not None]
+
+    english = detect_english(
+        [text for _, text in parsed],
+        [record.get("data", {}).get("language") for record, _ in parsed]
+    )
+    kept = []
+    for (record, text), legal in zip(parsed, english):
+        if legal:
+            kept.append((record, text))
+        else:
+            current_app.logger.error(f"Found non-english post, dropped: {text}")
+
+    texts = [text for _, text in kept]
+    sentiments = sentiment_batch(texts)
+    keywords = keywords_batch(texts, executor if executor is not None else keyword_pool())
+
+    enriched = []
+    for (record, _), (sentiment, sentiment_label), words in zip(kept, sentiments, keywords):
         record["sentiment"] = sentiment
         record["sentimentLabel"] = sentiment_label
-
-        # find out top 5 keywords from post context
-        record["keywords"] = extract_keywords(clean_content.lower())
+        record["keywords"] = words
         assert all(k == k.lower() for k in record["keywords"]), "Contain upper words"
+        enriched.append(record)
+    return enriched
+
+
+def platform_id(record: Dict[str, Any]) -> Optional[str]:
+    """
+    Same document ID as add_es: platform name and post ID
+    """
+    post_id = record.get("data", {}).get("id")
+    if not post_id or not record.get("platform"):
+        return None
+    return f"{str(record['platform']).lower()}_{post_id}"
 
-        # send to redis list, called elastic
+
+def dedup_buckets(now: Optional[float] = None) -> List[str]:
+    """
+    Keys of the SETs that may still hold ids seen within DEDUP_TTL, newest first
+    """
+    now = time.time() if now is None else now
+    current = int(now // DEDUP_BUCKET)
+    count = -(-DEDUP_TTL // DEDUP_BUCKET) + 1
+    return [f"{DEDUP_KEY_PREFIX}:{current - i}" for i in range(count)]
+
+
+def drop_duplicates(records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Drop the records whose platform_id was already seen, or appears twice in the batch
+    Redis errors let the whole batch through, add_es still rejects duplicates
+    :param records: batch of records
+    :return: records not seen before
+    """
+    if not DEDUP_ENABLED:
+        return records
+
+    ids = [platform_id(record) for record in records]
+    known = [i for i in ids if i]
+    seen = set()
+    if known:
         try:
-            res = requests.post(
-                url="http://router.fission.svc.cluster.local/enqueue/elastic",
-                json=record,
-                timeout=5
-            )
-            res.raise_for_status()
+            pipe = redis_pool.get_redis().pipeline(transaction=False)
+            for key in dedup_buckets():
+                pipe.smismember(key, known)
+            for post_id, flags in zip(known, zip(*pipe.execute())):
+                if any(flags):
+                    seen.add(post_id)
         except Exception as e:
+            current_app.logger.error(f"Dedup check failed, processing the whole batch: {e}")
+
+    kept = []
+    for record, post_id in zip(records, ids):
+        if post_id in seen:
+            continue
+        if post_id:
+            # a second copy in the same batch is a duplicate too
+            seen.add(post_id)
+        kept.append(record)
+
+    hits = len(records) - len(kept)
+    dedup_stats["hits"] += hits
+    dedup_stats["misses"] += len(kept)
+    if hits:
+        current_app.logger.info(f"Dropped {hits} duplicate posts before enrichment")
+    return kept
+
+
+def mark_seen(records: List[Dict[str, Any]], hits: int = 0):
+    """
+    Remember the platform_id of the processed records in today's SET,
+    and add this batch to the hit/miss counters shared by all pods
+    :param records: records that went through enrichment
+    :param hits: duplicates dropped from the batch
+    """
+    if not DEDUP_ENABLED:
+        return
+
+    ids = [post_id for post_id in map(platform_id, records) if post_id]
+    now = time.time()
+    key = dedup_buckets(now)[0]
+    # the bucket lives until its newest id is DEDUP_TTL old
+    expire = int((now // DEDUP_BUCKET + 1) * DEDUP_BUCKET + DEDUP_TTL - now)
+    try:
+        pipe = redis_pool.get_redis().pipeline(transaction=False)
+        if ids:
+            pipe.sadd(key, *ids)
+            pipe.expire(key, expire)
+        pipe.hincrby(DEDUP_STATS_KEY, "hits", hits)
+        pipe.hincrby(DEDUP_STATS_KEY, "misses", len(records))
+        pipe.execute()
+    except Exception as e:
+        current_app.logger.error(f"Failed to mark posts as seen: {e}")
+
+
+def dedup_memory() -> Dict[str, Any]:
+    """
+    Size of every dedup SET: number of ids and bytes used (MEMORY USAGE, None if not supported)
+    """
+    keys = dedup_buckets()
+    redis_client = redis_pool.get_redis()
+    pipe = redis_client.pipeline(transaction=False)
+    for key in keys:
+        pipe.scard(key)
+    ids = sum(pipe.execute())
+
+    # MEMORY USAGE is missing from some Redis-compatible servers, which may drop the connection
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for key in keys:
+            pipe.memory_usage(key)
+        size = sum(r or 0 for r in pipe.execute())
+    except Exception:
+        size = None
+    return {"ids": ids, "bytes": size, "buckets": len(keys)}
+
+
+def send_http(records: List[Dict[str, Any]]):
+    """
+    http sink: one POST of the whole batch to enqueue through the Fission router
+    """
+    res = requests.post(
+        url=QUEUE_ENDPOINT,
+        data=post_schema.dumps(records),
+        headers={"Content-Type": "application/json"},
+        timeout=5
+    )
+    res.raise_for_status()
+
+
+def send_redis(records: List[Dict[str, Any]]):
+    """
+    redis sink: push the whole batch to the output list in one pipelined round-trip
+    """
+    values = [post_schema.dumps(record) for record in records]
+    pipe = redis_pool.get_redis().pipeline(transaction=False)
+    for i in range(0, len(values), LPUSH_CHUNK_SIZE):
+        pipe.lpush(OUTPUT_LIST, *values[i:i + LPUSH_CHUNK_SIZE])
+    pipe.execute()
+
+
+def send_inprocess(records: List[Dict[str, Any]]):
+    """
+    inprocess sink: hand the batch to handoff_handler
+    """
+    if handoff_handler is None:
+        raise RuntimeError("inprocess sink selected but no handoff_handler is set")
+    handoff_handler(records)
+
+
+SINKS: Dict[str, Callable[[List[Dict[str, Any]]], None]] = {
+    "http": send_http,
+    "redis": send_redis,
+    "inprocess": send_inprocess,
+}
+
+
+def output_sink() -> Callable[[List[Dict[str, Any]]], None]:
+    """
+    Sink selected by POST_PROCESSOR_SINK in the config map, OUTPUT_SINK if not set
+    """
+    try:
+        name = config('POST_PROCESSOR_SINK').strip()
+    except OSError:
+        name = OUTPUT_SINK
+    if name not in SINKS:
+        current_app.logger.error(f"Unknown output sink {name}, using {OUTPUT_SINK}")
+        name = OUTPUT_SINK
+    return SINKS[name]
+
+
+def main():
+    """
+    get data from redis list,
+    produce sentiment, sentiment label and keywords from the context,
+    finally, send to back to redis list named elastic, we only process English context, otherwise drop it
+    a failure of the sink is raised, so the message queue trigger retries the batch (--maxretries)
+    and then moves it to its error topic instead of losing it
+    """
+    payload = post_schema.loads(request.get_data())
+    records: List[Dict[str, Any]] = payload if isinstance(payload, list) else [payload]
+
+    # drop the posts seen before, at the cheapest point
+    fresh = drop_duplicates(records)
+    hits = len(records) - len(fresh)
+
+    enriched = enrich_batch(fresh)
+    current_app.logger.info(f"Language tiers: {language_stats}")
+
+    # send the whole batch to redis list, called elastic
+    if enriched:
+        try:
+            output_sink()(enriched)
+        except Exception as e:
+            # the posts are not marked as seen, a retried batch is enriched again
             current_app.logger.error(f"Error pushing to queue: {e}")
+            raise
+
+    # non-english posts are remembered as well, so their copies skip the language stage too
+    mark_seen(fresh, hits)
+
+    dedup_stats["invocations"] += 1
+    if DEDUP_ENABLED and dedup_stats["invocations"] % DEDUP_REPORT_EVERY == 1:
+        try:
+            current_app.logger.info(f"Dedup filter: {dedup_stats}, memory: {dedup_memory()}")
+        except Exception as e:
+            current_app.logger.error(f"Dedup memory report failed: {e}")
 
     return "OK"
@@ -7,10 +7,13 @@ It maintains state using Redis and cycles through subreddit tags for continuous
 """
 
 import sys
-from datetime import datetime, timezone
-import redis
+from typing import Dict
+import redis_pool
 from flask import current_app
-import requests
+import queue_publisher
+import rate_governor
+import reddit_authors
+import post_schema
 import praw
 from praw.models import Submission
 
@@ -19,9 +22,7 @@ CONFIG_MAP = "reddit-config2"
 REDIS_TAGS_LIST = "reddit:hot"
 LIMIT = 40
 
-# Connect to the server
-REDIS_HOST = "redis-headless.redis.svc.cluster.local"
-REDIS_PORT = 6379
+# Connect to the server, Redis settings come from redis_pool
 QUEUE_ENDPOINT = "http://router.fission.svc.cluster.local/enqueue/reddit"
 
 
@@ -59,6 +60,8 @@ def initialize_reddit():
             client_id=client_id,
             client_secret=client_secret,
             user_agent=user_agent,
+            # every Reddit request goes through the rate limit bucket shared by all harvesters
+            requestor_kwargs={"session": rate_governor.GovernedSession("reddit", client_id)},
         )
         # Test if credentials are valid by accessing a public endpoint
         reddit.subreddits.popular(limit=1)
@@ -69,56 +72,20 @@ def initialize_reddit():
         sys.exit(1)
 
 
-def convert_reddit_post_to_target_format(post: Submission, subreddit: str) -> dict:
+def convert_reddit_post_to_target_format(post: Submission, subreddit: str, authors: Dict[str, dict],
+                                         fetched: str) -> post_schema.Post:
     """
     Converts a PRAW Submission object into the target JSON structure
 
     Args:
         post (praw.models.Submission): Reddit post object
         subreddit (str): Name of the current subreddit
+        authors (dict): Author data of the page from reddit_authors.lookup
+        fetched (str): fetchedAt of the page, from post_schema.fetched_at
 
     Returns:
-        dict: Formatted dictionary matching the target schema
+        post_schema.Post: Record matching the target schema
     """
-    fetched_at = datetime.now(timezone.utc).isoformat(timespec="seconds") + "Z"
-    created_at = (
-        datetime.fromtimestamp(post.created_utc, timezone.utc).isoformat(timespec="seconds") + "Z"
-        if post.created_utc else None
-    )
-
-    author_obj = post.author
-    if author_obj is None:
-        account_data = {
-            "id": None,
-            "username": "[Deleted]",
-            "createdAt": None,
-            "followersCount/linkKarma": None,
-            "followingCount/commentKarma": None,
-        }
-    else:
-        try:
-            author_username = author_obj.name or "[Unknown]"
-            author_id = f"t2_{author_username}"
-            author_created = datetime.fromtimestamp(
-                author_obj.created_utc, timezone.utc
-            ).isoformat(timespec="seconds") + "Z"
-            link_karma = comment_karma = 0
-        except Exception as e:
-            current_app.logger.warning(
-                f"[{post.id}] failed to fetch author info: {e}"
-            )
-            author_id = None
-            author_username = "[Unavailable]"
-            author_created = None
-            link_karma = comment_karma = 0
-        # Author information
-        account_data = {
-            "id": author_id,
-            "username": author_username,
-            "createdAt": author_created,
-            "followersCount/linkKarma": link_karma,
-            "followingCount/commentKarma": comment_karma,
-        }
     # Combine title and selftext if applicable
     content = post.title
     if post.is_self and post.selftext:
@@ -127,28 +94,20 @@ def convert_reddit_post_to_target_format(post: Submission, subreddit: str) -> di
     tags = [post.link_flair_text] if post.link_flair_text else []
     if tags:
         tags.append(subreddit.lower())
-
-    data = {
-        "id": post.id,
-        "createdAt": created_at,
-        "content": content,
-        "sensitive": bool(post.over_18),
-        "favouritesCount": post.score,
-        "repliesCount": post.num_comments,
-        "tags": tags,
-        "url": f"https://www.reddit.com{post.permalink}",
-        "account": account_data,
-    }
-
-    return {
-        "platform": "Reddit",
-        "version": 1.1,
-        "fetchedAt": fetched_at,
-        "sentiment": None,
-        "sentimentLabel": None,
-        "keywords": [],
-        "data": data,
-    }
+    return post_schema.Post(
+        platform="Reddit",
+        fetched_at=fetched,
+        id=post.id,
+        created_at=post_schema.from_timestamp(post.created_utc),
+        content=content,
+        language=None,
+        sensitive=bool(post.over_18),
+        favourites=post.score,
+        replies=post.num_comments,
+        tags=tags,
+        url=f"https://www.reddit.com{post.permalink}",
+        account=reddit_authors.account_data(post, authors),
+    )
 
 
 def fetch_reddit_posts(reddit):
@@ -163,7 +122,7 @@ def fetch_reddit_posts(reddit):
         None
     """
     # Connect to Redis to retrieve subreddit and push status
-    r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+    r = redis_pool.get_redis(decode_responses=True)
 
     subreddit = r.lpop(REDIS_TAGS_LIST)
     if not subreddit:
@@ -178,9 +137,10 @@ def fetch_reddit_posts(reddit):
             current_app.logger.warning(f"No posts found for r/{subreddit}")
             return
         # Process and push posts
-        for post in posts:
-            post_data = convert_reddit_post_to_target_format(post, subreddit)
-            requests.post(QUEUE_ENDPOINT, json=post_data, timeout=5)
+        authors = reddit_authors.lookup(reddit, [reddit_authors.author_fullname(post) for post in posts])
+        fetched = post_schema.fetched_at()
+        batch = [convert_reddit_post_to_target_format(post, subreddit, authors, fetched) for post in posts]
+        queue_publisher.publish(QUEUE_ENDPOINT, batch)
     finally:
         # Push the tag back to Redis for the next round
         r.rpush(REDIS_TAGS_LIST, subreddit)
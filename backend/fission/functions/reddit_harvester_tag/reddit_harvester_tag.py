@@ -2,20 +2,35 @@
 This program fetches Reddit posts and comments by tag and sends the data to a processing queue.
 
 1. Subreddit tags are managed via a Redis list to control which topics are fetched.
-2. For each subreddit, posts are retrieved in reverse chronological order (using 'before' pagination).
-3. Each post and its top-level comments are converted into a unified JSON structure.
+2. For each subreddit, posts are retrieved in reverse chronological order (using 'after' pagination).
+3. Each post and its top-level comments are converted into a unified JSON structure. The comments
+of a page are fetched concurrently, each worker with its own praw client, as bounded slices of
+the comment listing (COMMENT_LIMIT top-level comments, COMMENT_DEPTH levels), within the requests
+left above RATELIMIT_RESERVE, and the limit of a subreddit can be changed or set to 0 in the
+reddit:comment_limits hash.
 4. Post and comment data are sent to an external endpoint for further processing.
 5. Progress for each subreddit is tracked using a Redis key, and removed once END_DATE is reached.
+6. Pages are fetched until the HARVEST_BUDGET seconds of the invocation are used up, MAX_PAGES
+pages, or Reddit is down to RATELIMIT_RESERVE requests, with the progress key written after
+every page, so a killed pod loses at most one page.
 """
 
+import queue
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
-import redis
-from flask import current_app
+from typing import Any, Dict, List, Optional, Tuple
+import redis_pool
 import requests
+from flask import current_app
+import queue_publisher
+import rate_governor
+import reddit_authors
+import post_schema
 import praw
 from praw.models import Submission
-from prawcore.exceptions import PrawcoreException, NotFound
 
 # Load a configuration value by key from the mounted config map directory
 CONFIG_MAP = "reddit-config2"
@@ -23,9 +38,23 @@ REDIS_TAGS_LIST = "reddit:tags"
 END_DATE = datetime(2023, 1, 1, tzinfo=timezone.utc)
 LIMIT = 8
 
-# Connect to the server
-REDIS_HOST = "redis-headless.redis.svc.cluster.local"
-REDIS_PORT = 6379
+# Paging of an invocation, every key can be overridden in the config map
+DEFAULTS = {
+    "HARVEST_BUDGET": 40.0,  # seconds of paging per invocation, 0 fetches one page
+    "MAX_PAGES": 25,
+    "RATELIMIT_RESERVE": 50,  # requests left in the Reddit rate limit window
+    "COMMENT_LIMIT": 5,  # top-level comments per post, 0 skips the comments
+    "COMMENT_DEPTH": 2,  # levels of the comment tree, 2 loads the direct replies counted in repliesCount
+    "COMMENT_CONCURRENCY": 4,  # comment listings fetched at the same time
+}
+# Per-subreddit COMMENT_LIMIT, a hash of subreddit -> limit
+COMMENT_LIMITS = "reddit:comment_limits"
+
+# praw clients are not thread safe, each comment worker borrows its own, kept across warm invocations
+_comment_clients: Dict[Tuple[str, str], "queue.SimpleQueue[praw.Reddit]"] = {}
+_comment_clients_lock = threading.Lock()
+
+# Connect to the server, Redis settings come from redis_pool
 QUEUE_ENDPOINT = "http://router.fission.svc.cluster.local/enqueue/reddit"
 
 
@@ -37,6 +66,16 @@ def config(k: str) -> str:
         return f.read()
 
 
+def setting(k: str, default: Any) -> Any:
+    """
+    Optional config map value converted to the type of the default
+    """
+    try:
+        return type(default)(config(k).strip())
+    except (OSError, ValueError):
+        return default
+
+
 def initialize_reddit():
     """
     Initializes and returns a PRAW Reddit instance using credentials from config files
@@ -63,6 +102,8 @@ def initialize_reddit():
             client_id=client_id,
             client_secret=client_secret,
             user_agent=user_agent,
+            # every Reddit request goes through the rate limit bucket shared by all harvesters
+            requestor_kwargs={"session": rate_governor.GovernedSession("reddit", client_id)},
         )
         reddit.subreddits.popular(limit=1)
         # Test if the credentials are valid by accessing a public endpoint
@@ -73,56 +114,20 @@ def initialize_reddit():
         sys.exit(1)
 
 
-def convert_reddit_post_to_target_format(post: Submission, subreddit: str) -> dict:
+def convert_reddit_post_to_target_format(post: Submission, subreddit: str, authors: Dict[str, dict],
+                                         fetched: str) -> post_schema.Post:
     """
     Converts a PRAW Submission object into the target JSON structure
 
     Args:
         post (praw.models.Submission): Reddit post object
         subreddit (str): Name of the current subreddit
+        authors (dict): Author data of the page from reddit_authors.lookup
+        fetched (str): fetchedAt of the page, from post_schema.fetched_at
 
     Returns:
-        dict: Formatted dictionary matching the target schema
+        post_schema.Post: Record matching the target schema
     """
-    fetched_at = datetime.now(timezone.utc).isoformat(timespec="seconds") + "Z"
-    created_at = (
-        datetime.fromtimestamp(post.created_utc, timezone.utc).isoformat(timespec="seconds") + "Z"
-        if post.created_utc else None
-    )
-
-    author_obj = post.author
-    if author_obj is None:
-        account_data = {
-            "id": None,
-            "username": "[Deleted]",
-            "createdAt": None,
-            "followersCount/linkKarma": None,
-            "followingCount/commentKarma": None,
-        }
-    else:
-        try:
-            author_username = author_obj.name or "[Unknown]"
-            author_id = f"t2_{author_username}"
-            author_created = datetime.fromtimestamp(
-                author_obj.created_utc, timezone.utc
-            ).isoformat(timespec="seconds") + "Z"
-            link_karma = comment_karma = 0
-        except Exception as e:
-            current_app.logger.warning(
-                f"[{post.id}] failed to fetch author info: {e}"
-            )
-            author_id = None
-            author_username = "[Unavailable]"
-            author_created = None
-            link_karma = comment_karma = 0
-        # Author's information
-        account_data = {
-            "id": author_id,
-            "username": author_username,
-            "createdAt": author_created,
-            "followersCount/linkKarma": link_karma,
-            "followingCount/commentKarma": comment_karma,
-        }
     # Combine title and selftext if the post is a self-post
     content = post.title
     if post.is_self and post.selftext:
@@ -132,161 +137,274 @@ def convert_reddit_post_to_target_format(post: Submission, subreddit: str) -> di
     if tags:
         tags.append(subreddit.lower())
     # Post's information
-    data = {
-        "id": post.id,
-        "createdAt": created_at,
-        "content": content,
-        "sensitive": bool(post.over_18),
-        "favouritesCount": post.score,
-        "repliesCount": post.num_comments,
-        "tags": tags,
-        "url": f"https://www.reddit.com{post.permalink}",
-        "account": account_data,
-    }
-
-    return {
-        "platform": "Reddit",
-        "version": 1.1,
-        "fetchedAt": fetched_at,
-        "sentiment": None,
-        "sentimentLabel": None,
-        "keywords": [],
-        "data": data,
-    }
-
-
-def convert_comment_to_target_format(comment, subreddit: str) -> dict:
+    return post_schema.Post(
+        platform="Reddit",
+        fetched_at=fetched,
+        id=post.id,
+        created_at=post_schema.from_timestamp(post.created_utc),
+        content=content,
+        language=None,
+        sensitive=bool(post.over_18),
+        favourites=post.score,
+        replies=post.num_comments,
+        tags=tags,
+        url=f"https://www.reddit.com{post.permalink}",
+        account=reddit_authors.account_data(post, authors),
+    )
+
+
+def convert_comment_to_target_format(comment, subreddit: str, authors: Dict[str, dict],
+                                     fetched: str) -> post_schema.Post:
     """
     Converts a PRAW Comment object into the target JSON structure
 
     Args:
         comment (praw.models.Comment): Reddit comment object
         subreddit (str): Name of the subreddit where the comment was posted
+        authors (dict): Author data of the page from reddit_authors.lookup
+        fetched (str): fetchedAt of the page, from post_schema.fetched_at
 
     Returns:
-        dict: Formatted dictionary representing the comment, including author and parent post metadata
+        post_schema.Post: Record representing the comment, including author and parent post metadata
     """
-    fetched_at = datetime.now(timezone.utc).isoformat(timespec='seconds') + 'Z'
-    created_at = datetime.fromtimestamp(comment.created_utc, timezone.utc).isoformat(timespec='seconds') + 'Z'
     post = comment.submission
 
-    author_obj = comment.author
-    if author_obj is None:
-        account_data = {
-            "id": None,
-            "username": "[Deleted]",
-            "createdAt": None,
-            "followersCount/linkKarma": None,
-            "followingCount/commentKarma": None,
-        }
-    else:
-        try:
-            author_username = author_obj.name or "[Unknown]"
-            author_id = f"t2_{author_username}"
-            author_created = datetime.fromtimestamp(author_obj.created_utc, timezone.utc).isoformat(
-                timespec="seconds") + "Z"
-            link_karma = comment_karma = 0
-        except (NotFound, PrawcoreException):
-            author_id = None
-            author_username = "[Unavailable]"
-            author_created = None
-            link_karma = comment_karma = 0
-
-        account_data = {
-            "id": author_id,
-            "username": author_username,
-            "createdAt": author_created,
-            "followersCount/linkKarma": link_karma,
-            "followingCount/commentKarma": comment_karma,
-        }
     # Add a "comment" tag to separate from other posts, and also mark the id of its parent post
     tags = [f"comment: {post.id}", subreddit]
     if post.link_flair_text:
         tags.append(post.link_flair_text)
 
-    data = {
-        "id": f"comment_{comment.id}",
-        "createdAt": created_at,
-        "content": comment.body,
-        "sensitive": post.over_18,
-        "favouritesCount": comment.score,
-        "repliesCount": len(comment.replies),
-        "tags": tags,
-        "url": f"https://www.reddit.com{post.permalink}",
-        "account": account_data
-    }
-
-    return {
-        "platform": "Reddit",
-        "version": 1.1,
-        "fetchedAt": fetched_at,
-        "sentiment": None,
-        "sentimentLabel": None,
-        "keywords": [],
-        "data": data
-    }
+    return post_schema.Post(
+        platform="Reddit",
+        fetched_at=fetched,
+        id=f"comment_{comment.id}",
+        created_at=post_schema.from_timestamp(comment.created_utc),
+        content=comment.body,
+        language=None,
+        sensitive=post.over_18,
+        favourites=comment.score,
+        replies=len(comment.replies),
+        tags=tags,
+        url=f"https://www.reddit.com{post.permalink}",
+        account=reddit_authors.account_data(comment, authors),
+    )
 
 
-def fetch_reddit_posts(reddit):
+def fetch_comments(reddit, post: Submission, limit: int, depth: int) -> list:
     """
-    Fetches recent posts from the current subreddit tag in Redis, converts them to the target format,
-    and uploads them to the queue endpoint
+    Fetches a slice of the comment listing of a post, best first, instead of the whole tree
 
     Args:
         reddit (praw.Reddit): An initialized Reddit API client
+        post (praw.models.Submission): Reddit post object
+        limit (int): Top-level comments to keep
+        depth (int): Levels of the comment tree to download
 
     Returns:
-        None
+        list: Top-level praw.models.Comment objects of the post
     """
-    # Connect to Redis to retrieve the current subreddit and state tracking
-    r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+    _, listing = reddit.get(f"/comments/{post.id}", params={"limit": limit, "depth": depth, "sort": "best"})
+    comments = []
+    for comment in listing:
+        if isinstance(comment, praw.models.Comment) and comment.depth == 0:
+            # the comments point to the post of the page, so converting them does not fetch it again
+            comment.submission = post
+            comment.replies.replace_more(limit=0)
+            comments.append(comment)
+            if len(comments) >= limit:
+                break
+    return comments
+
+
+def comment_clients(reddit) -> "queue.SimpleQueue[praw.Reddit]":
+    """
+    Idle comment clients with the credentials and URLs of reddit
 
-    subreddit = r.lindex(REDIS_TAGS_LIST, 0)
-    if not subreddit:
-        current_app.logger.warning("No more tags in Redis list.")
-        return
+    Args:
+        reddit (praw.Reddit): The client of the invocation
 
-    state_key = f"reddit:max_fullname:{subreddit}"
-    last_fullname = r.get(state_key)
+    Returns:
+        queue.SimpleQueue: Clients not used by any worker at the moment
+    """
+    key = (reddit.config.client_id, reddit.config.oauth_url)
+    with _comment_clients_lock:
+        return _comment_clients.setdefault(key, queue.SimpleQueue())
+
+
+def comment_client(reddit):
+    """
+    A new praw client for one comment worker, with the settings of reddit and its own HTTP session
+
+    Args:
+        reddit (praw.Reddit): The client of the invocation
+
+    Returns:
+        praw.Reddit: Client used by one thread at a time
+    """
+    c = reddit.config
+    session = reddit._core._requestor._http
+    if isinstance(session, rate_governor.GovernedSession):
+        session = rate_governor.GovernedSession(session.platform, session.credential)
+    else:
+        session = requests.Session()
+    return praw.Reddit(client_id=c.client_id, client_secret=c.client_secret, user_agent=c.user_agent,
+                       oauth_url=c.oauth_url, reddit_url=c.reddit_url, short_url=c.short_url,
+                       check_for_updates=False, requestor_kwargs={"session": session})
 
-    sub = reddit.subreddit(subreddit)
-    params = {"before": last_fullname} if last_fullname else None
-    posts = list(sub.new(limit=LIMIT, params=params))
 
-    if not posts:
-        current_app.logger.warning(f"No posts found for r/{subreddit} before {last_fullname}")
-        r.lpop(REDIS_TAGS_LIST)
-        return
+def remaining_requests(reddit) -> Optional[float]:
+    """
+    Requests left in the Reddit rate limit window, the lowest count seen by the client of the
+    invocation and the idle comment clients in the current window (None before any response)
+
+    Args:
+        reddit (praw.Reddit): The client of the invocation
+
+    Returns:
+        float: Requests left, or None
+    """
+    idle = comment_clients(reddit)
+    clients = []
+    while True:
+        try:
+            clients.append(idle.get_nowait())
+        except queue.Empty:
+            break
+    for client in clients:
+        idle.put(client)
+
+    now = time.time()
+    counts = [c.auth.limits["remaining"] for c in [reddit, *clients]
+              if c.auth.limits["remaining"] is not None and (c.auth.limits["reset_timestamp"] or 0) > now]
+    return min(counts, default=None)
+
+
+def fetch_page_comments(reddit, posts: List[Submission], limit: int, s: dict) -> List[Tuple[Submission, list]]:
+    """
+    Fetches the comments of a page concurrently, for as many posts as the rate limit reserve allows
+    """
+    if limit <= 0:
+        return [(post, []) for post in posts]
+
+    allowed = len(posts)
+    remaining = remaining_requests(reddit)
+    if remaining is not None:
+        allowed = max(0, min(allowed, int(remaining) - s["RATELIMIT_RESERVE"]))
+        if allowed < len(posts):
+            current_app.logger.warning(f"Rate limit reserve reached, comments of {len(posts) - allowed} posts skipped")
 
-    for post in posts:
-        # upload post information
-        post_data = convert_reddit_post_to_target_format(post, subreddit)
-        requests.post(QUEUE_ENDPOINT, json=post_data, timeout=5)
+    idle = comment_clients(reddit)
 
-        # upload comment information (same format)
+    def fetch(post: Submission):
         try:
-            post.comment_sort = 'best'
-            post.comments.replace_more(limit=0)
-
-            count = 0
-            for comment in post.comments:
-                if isinstance(comment, praw.models.Comment) and comment.depth == 0:
-                    comment_data = convert_comment_to_target_format(comment, subreddit)
-                    requests.post(QUEUE_ENDPOINT, json=comment_data, timeout=5)
-                    count += 1
-                    if count >= 5:
-                        break
+            client = idle.get_nowait()
+        except queue.Empty:
+            client = comment_client(reddit)
+        try:
+            return fetch_comments(client, post, limit, s["COMMENT_DEPTH"]), None
         except Exception as e:
-            current_app.logger.warning(f"Process comment error: {e}")
+            return [], e
+        finally:
+            idle.put(client)
+
+    with ThreadPoolExecutor(max_workers=max(1, s["COMMENT_CONCURRENCY"])) as pool:
+        results = list(pool.map(fetch, posts[:allowed]))
+
+    threads = []
+    for post, (comments, error) in zip(posts, results):
+        if error:
+            current_app.logger.warning(f"Process comment error: {error}")
+        threads.append((post, comments))
+    return threads + [(post, []) for post in posts[allowed:]]
+
+
+def convert_page(reddit, posts: List[Submission], subreddit: str, limit: int, s: dict) -> List[post_schema.Post]:
+    """
+    Converts a page of posts and up to limit top-level comments of each post into the target format
+    The authors of the whole page are looked up at once
+    """
+    threads = fetch_page_comments(reddit, posts, limit, s)
 
-    oldest = min(posts, key=lambda p: p.created_utc)
-    r.set(state_key, oldest.fullname)
-    current_app.logger.info(f"Updated {state_key} to {oldest.fullname}")
+    authors = reddit_authors.lookup(
+        reddit, [reddit_authors.author_fullname(item) for post, comments in threads for item in [post, *comments]])
 
-    latest_dt = datetime.fromtimestamp(oldest.created_utc, timezone.utc)
-    if latest_dt < END_DATE:
-        r.lpop(REDIS_TAGS_LIST)
-        current_app.logger.warning(f"Touched END_DATE, removed r/{subreddit}")
+    fetched = post_schema.fetched_at()
+    batch = []
+    for post, comments in threads:
+        # post information
+        batch.append(convert_reddit_post_to_target_format(post, subreddit, authors, fetched))
+        # comment information (same format)
+        batch.extend(convert_comment_to_target_format(comment, subreddit, authors, fetched) for comment in comments)
+    return batch
+
+
+def fetch_reddit_posts(reddit):
+    """
+    Fetches pages of older posts from the current subreddit tag in Redis within the time budget,
+    converts them to the target format, and uploads them to the queue endpoint
+
+    Args:
+        reddit (praw.Reddit): An initialized Reddit API client
+
+    Returns:
+        int: number of posts and comments sent
+    """
+    s = {k: setting(k, v) for k, v in DEFAULTS.items()}
+    deadline = time.monotonic() + s["HARVEST_BUDGET"]
+
+    # Connect to Redis to retrieve the current subreddit and state tracking
+    r = redis_pool.get_redis(decode_responses=True)
+
+    subreddit = r.lindex(REDIS_TAGS_LIST, 0)
+    if not subreddit:
+        current_app.logger.warning("No more tags in Redis list.")
+        return 0
+
+    state_key = f"reddit:max_fullname:{subreddit}"
+    limit = r.hget(COMMENT_LIMITS, subreddit)
+    limit = int(limit) if limit is not None else s["COMMENT_LIMIT"]
+    sub = reddit.subreddit(subreddit)
+    sent = pages = 0
+    slowest = 0.0
+
+    for pages in range(1, s["MAX_PAGES"] + 1):
+        # only start a page that is expected to finish within the budget, the first one always runs
+        if pages > 1 and time.monotonic() + slowest > deadline:
+            pages -= 1
+            break
+        remaining = remaining_requests(reddit)
+        if remaining is not None and remaining <= s["RATELIMIT_RESERVE"]:
+            current_app.logger.warning(f"Rate limit reserve reached, {remaining} requests left")
+            break
+        start = time.monotonic()
+
+        last_fullname = r.get(state_key)
+        params = {"after": last_fullname} if last_fullname else None
+        posts = list(sub.new(limit=LIMIT, params=params))
+
+        if not posts:
+            current_app.logger.warning(f"No posts found for r/{subreddit} after {last_fullname}")
+            r.lpop(REDIS_TAGS_LIST)
+            break
+
+        # upload posts and comments concurrently
+        batch = convert_page(reddit, posts, subreddit, limit, s)
+        queue_publisher.publish(QUEUE_ENDPOINT, batch)
+        sent += len(batch)
+
+        oldest = min(posts, key=lambda p: p.created_utc)
+        r.set(state_key, oldest.fullname)
+        current_app.logger.info(f"Updated {state_key} to {oldest.fullname}")
+
+        latest_dt = datetime.fromtimestamp(oldest.created_utc, timezone.utc)
+        if latest_dt < END_DATE:
+            r.lpop(REDIS_TAGS_LIST)
+            current_app.logger.warning(f"Touched END_DATE, removed r/{subreddit}")
+            break
+        slowest = max(slowest, time.monotonic() - start)
+
+    current_app.logger.info(f"Sent {sent} posts and comments of r/{subreddit} in {pages} pages")
+    return sent
 
 
 def main():
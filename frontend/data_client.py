@@ -0,0 +1,171 @@
+"""
+Client helper for the data-filter function, used by the notebooks.
+
+refresh(payload) keeps a local Parquet copy of the documents matched by a payload.
+The first call downloads every document, later calls only ask data-filter for the
+documents fetched since the watermark of the previous call and merge them in, so a
+refresh costs O(new posts) instead of O(all posts).
+
+The documents are requested in the columnar format of data-filter and mapped straight
+into the data frame (read_response also reads the row and arrow formats).
+
+Files, per payload (named after a hash of the payload):
+- <name>.parquet: the documents, one row per _id
+- <name>.json: the payload and the watermark (newest fetchedAt) of the last refresh
+
+Note: need to run `kubectl port-forward svc/router 8888:80 -n fission` in terminal
+"""
+
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+import pandas as pd
+import requests
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+BASE_URL = "http://127.0.0.1:8888/data-filter"
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+SINCE_FIELD = "fetchedAt"
+# posts fetched just before the previous watermark can still be in the pipeline (Redis lists,
+# post processing) when it was taken, so every refresh asks again for a few minutes before it
+SINCE_OVERLAP = timedelta(minutes=10)
+# keys of the payload that do not change which documents match
+IGNORED_KEYS = ("size", "mode", "cache", "since", "since_field", "format")
+
+logger = logging.getLogger(__name__)
+ARROW_MIMETYPE = "application/vnd.apache.arrow.stream"
+COLUMNS = ["sentiment", "platform", "_id", "sentimentLabel", "keywords", "tags", "createdAt"]
+
+
+def payload_name(payload: dict) -> str:
+    """
+    Stable file name of a payload
+    """
+    key = {k: v for k, v in payload.items() if k not in IGNORED_KEYS}
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def fetch(payload: dict, base_url: str = BASE_URL, timeout: int = 120) -> Tuple[pd.DataFrame, dict]:
+    """
+    One data-filter request in the default mode
+    :return: the documents, and the total and watermark of the response
+    """
+    headers = {"Accept": ARROW_MIMETYPE} if payload.get("format") == "arrow" else {}
+    resp = requests.post(base_url, json=payload, headers=headers, timeout=timeout)
+    resp.raise_for_status()
+    return read_response(resp)
+
+
+def read_response(resp: requests.Response) -> Tuple[pd.DataFrame, dict]:
+    """
+    Data frame of a data-filter response in any format, and the other keys of the response
+    """
+    if resp.headers.get("Content-Type", "").startswith(ARROW_MIMETYPE):
+        table = pa.ipc.open_stream(resp.content).read_all()
+        meta = {k.decode(): json.loads(v) for k, v in (table.schema.metadata or {}).items()}
+        return table.to_pandas()[COLUMNS], meta
+    result = resp.json()
+    if "error" in result:
+        raise ValueError(result["error"])
+    if "columns" in result:
+        return from_columns(result.pop("columns")), result
+    return to_frame(result.pop("data")), result
+
+
+def from_columns(columns: dict) -> pd.DataFrame:
+    """
+    Columnar documents of data-filter as the data frame of the notebooks, without a loop over the rows
+    """
+    def categorical(encoded: dict) -> pd.Categorical:
+        return pd.Categorical.from_codes(encoded["codes"], categories=encoded["dictionary"])
+
+    return pd.DataFrame({
+        "sentiment": pd.Series(columns["sentiment"], dtype="float64"),
+        "platform": categorical(columns["platform"]),
+        "_id": columns["_id"],
+        "sentimentLabel": categorical(columns["sentimentLabel"]),
+        "keywords": columns["keywords"],
+        "tags": columns["tags"],
+        "createdAt": pd.to_datetime(pd.Series(columns["createdAt"], dtype="float64"), unit="ms", utc=True),
+    })
+
+
+def to_frame(docs: list) -> pd.DataFrame:
+    """
+    Documents of data-filter as the data frame of the notebooks
+    """
+    df = pd.DataFrame({
+        "sentiment": [d.get("sentiment") for d in docs],
+        "platform": [d.get("platform") for d in docs],
+        "_id": [d.get("_id") for d in docs],
+        "sentimentLabel": [d.get("sentimentLabel") for d in docs],
+        "keywords": [d.get("keywords") for d in docs],
+        "tags": [d.get("data", {}).get("tags") for d in docs],
+        "createdAt": [d.get("data", {}).get("createdAt") for d in docs],
+    })
+    df["createdAt"] = pd.to_datetime(df["createdAt"].str.replace(r"Z$", "", regex=True),
+                                     utc=True, errors="raise", format="ISO8601")
+    return df
+
+
+def load_state(name: str, data_dir: str) -> Optional[dict]:
+    path = os.path.join(data_dir, f"{name}.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save(df: pd.DataFrame, state: dict, name: str, data_dir: str):
+    """
+    Write the data set and then its state, each one through a temporary file,
+    so an interrupted refresh leaves the previous copy in place
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    base = os.path.join(data_dir, name)
+    df.to_parquet(base + ".parquet.tmp", index=False)
+    with open(base + ".json.tmp", "w") as f:
+        json.dump(state, f)
+    os.replace(base + ".parquet.tmp", base + ".parquet")
+    os.replace(base + ".json.tmp", base + ".json")
+
+
+def refresh(payload: dict, data_dir: str = DATA_DIR, base_url: str = BASE_URL, full: bool = False) -> pd.DataFrame:
+    """
+    Bring the local copy of the documents matched by the payload up to date
+    :param payload: data-filter payload, as in the notebooks
+    :param data_dir: folder of the local copies
+    :param base_url: data-filter route
+    :param full: download every document again
+    :return: every document matched by the payload, newest first
+    """
+    name = payload_name(payload)
+    state = None if full else load_state(name, data_dir)
+    request_payload = dict(payload, since_field=SINCE_FIELD, format="columnar")
+    request_payload.pop("mode", None)
+
+    if state and state.get("watermark"):
+        since = datetime.fromisoformat(state["watermark"].replace("Z", "+00:00")) - SINCE_OVERLAP
+        request_payload["since"] = since.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+        delta, result = fetch(request_payload, base_url)
+        df = pd.read_parquet(os.path.join(data_dir, f"{name}.parquet"))
+        if len(delta):
+            # a document fetched again (overlap, or harvested twice) replaces the stored one
+            df = pd.concat([df, delta], ignore_index=True)
+            df = df.drop_duplicates("_id", keep="last")
+    else:
+        df, result = fetch(request_payload, base_url)
+
+    df = df.sort_values("createdAt", ascending=False, ignore_index=True)
+    watermark = result["watermark"]["value"] or (state or {}).get("watermark")
+    save(df, {"payload": payload, "watermark": watermark, "delta": result["total"], "rows": len(df)}, name, data_dir)
+    logger.info(f"{'Refreshed' if state else 'Downloaded'}: {result['total']} posts from data-filter, {len(df)} in total")
+    return df
@@ -1,33 +1,90 @@
 """
 Handles query requests from the front-end, constructs Elasticsearch queries,
-performs scroll paging, and returns structured results.
+pages through the hits with a point in time, and returns structured results.
 
 Input:
 payload (str): a JSON string passed in by the frontend, containing filtered fields such as content,
- tags, keywords, as well as size and max_docs configuration.
+ tags, keywords, as well as size, max_docs and mode configuration.
 
 Returns:
 - str: JSON string containing the total number of hits and a list of documents,
  only the required fields are kept for each document.
+- mode "stream": NDJSON response, one document per line, read page by page with a
+ point in time and search_after, so only one page is held in memory at a time.
+- mode "aggregate": JSON string with the buckets the notebook charts are drawn from
+ (sentiment by platform, label, keyword, tag and over time), computed by ES.
+- format "columnar" (default mode): JSON string of one list per column, platform and
+ sentimentLabel dictionary encoded and createdAt in epoch ms, gzip compressed when the
+ client accepts it. format "arrow" (or Accept: application/vnd.apache.arrow.stream): the
+ same columns as a zstd compressed Arrow IPC stream.
+- slices: the default mode reads the hits with that many slices of a point in time,
+ fetched concurrently and merged back in data.createdAt order (or left unordered with
+ "sorted": false), instead of one sequential read.
+- since: only the documents whose since_field (fetchedAt or data.createdAt) is at or after
+ the given date are matched, and the default mode also returns the newest value of the field
+ as the watermark of the next incremental query.
+
+The JSON results of the default and aggregate modes are cached in Redis (zlib compressed),
+keyed on a hash of the query, _source, max_docs, since and mode. An entry is served for
+CACHE_TTL seconds after it was computed, so a result lags the harvesters by at most that
+long, and the least recently used entries are evicted when the cache grows over
+CACHE_MAX_BYTES. Both can be changed with DATA_FILTER_CACHE_TTL and
+DATA_FILTER_CACHE_MAX_BYTES in redis-config, as the cache shares Redis with the queues.
 """
 
+import gzip
+import hashlib
+import heapq
 import json
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
 from elasticsearch8 import Elasticsearch
-from flask import request, current_app
-from datetime import datetime
+from flask import request, current_app, Response, stream_with_context
+from datetime import datetime, timezone
+import es_pool
+import redis_pool
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
 
-ES_HOST = "https://elasticsearch-master.elastic.svc.cluster.local:9200"
 ES_INDEX = "socialplatform"
-CONFIG_MAP = "shared-data"
 MAX_DOCS_DEFAULT = 500000
+AGG_INTERVALS = ("day", "week", "month", "quarter", "year")
+AGG_TOP_DEFAULT = 50
+SENTIMENT_PERCENTS = [5, 25, 50, 75, 95]
+PIT_KEEP_ALIVE = "2m"
+# _shard_doc breaks ties between posts created in the same millisecond
+PIT_SORT = [{"data.createdAt": {"order": "desc"}}, {"_shard_doc": "asc"}]
+# each slice holds one connection of the client while it is read
+SLICES_MAX = es_pool.CONNECTIONS_PER_NODE
+SINCE_FIELDS = ("fetchedAt", "data.createdAt")
+FORMATS = ("rows", "columnar", "arrow")
+ARROW_MIMETYPE = "application/vnd.apache.arrow.stream"
+GZIP_LEVEL = 6
+SOURCE_FIELDS = [
+    "platform",
+    "sentiment",
+    "sentimentLabel",
+    "keywords",
+    "data.createdAt",
+    "data.tags"
+]
 
-
-def config(k: str) -> str:
-    """
-    Reads configuration from config map file
-    """
-    with open(f'/configs/default/{CONFIG_MAP}/{k}', 'r') as f:
-        return f.read()
+CACHE_ENABLED = True
+CACHE_KEY_PREFIX = "data_filter:cache"
+CACHE_LRU_KEY = "data_filter:cache-lru"
+CACHE_SIZES_KEY = "data_filter:cache-sizes"
+CACHE_STATS_KEY = "data_filter:cache-stats"
+CACHE_TTL = 5 * 60
+CACHE_MAX_BYTES = 32 * 2 ** 20
+CACHE_REPORT_EVERY = 20
+cache_stats = {"hits": 0, "misses": 0}
 
 
 def query(payload: dict) -> dict:
@@ -92,11 +149,450 @@ def query(payload: dict) -> dict:
     return {"bool": bool_q}
 
 
-def handle_request(payload: str):
+def to_doc(hit: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Keep the _source of a hit and its _id
+    """
+    src = hit["_source"].copy()
+    src["_id"] = hit["_id"]
+    return src
+
+
+def pit_pages(es: Elasticsearch, query_body: dict, pit: Dict[str, str], batch_size: int, max_docs: int,
+              slice_id: Optional[int] = None, slices: int = 1) -> Iterator[List[dict]]:
+    """
+    Pages of hits of an open point in time sorted by data.createdAt desc, read with search_after
+    :param pit: id and keep_alive of the point in time, the id is updated when ES changes it
+    :param slice_id: only read this slice of the point in time
+    :param slices: number of slices the point in time is split into
+    """
+    body = dict(query_body)
+    body.update({"track_total_hits": False, "sort": PIT_SORT, "pit": dict(pit)})
+    if slice_id is not None:
+        body["slice"] = {"id": slice_id, "max": slices}
+    remaining = max_docs
+    while remaining > 0:
+        body["size"] = min(batch_size, remaining)
+        resp = es.search(body=body)
+        # the id of the point in time may change between requests
+        pit["id"] = body["pit"]["id"] = resp.get("pit_id", body["pit"]["id"])
+        hits = resp["hits"]["hits"]
+        if not hits:
+            break
+        yield hits
+        remaining -= len(hits)
+        if len(hits) < body["size"]:
+            break
+        body["search_after"] = hits[-1]["sort"]
+
+
+def search_pages(es: Elasticsearch, query_body: dict, batch_size: int, max_docs: int) -> Iterator[List[dict]]:
+    """
+    Pages of hits sorted by data.createdAt desc, read with a point in time and search_after
+    The point in time is closed when the pages are exhausted or the generator is closed
+    :param es: Elasticsearch client
+    :param query_body: query and _source of the search
+    :param batch_size: hits per page
+    :param max_docs: maximum number of hits over all pages
+    """
+    pit = {"id": es.open_point_in_time(index=ES_INDEX, keep_alive=PIT_KEEP_ALIVE)["id"], "keep_alive": PIT_KEEP_ALIVE}
+    try:
+        yield from pit_pages(es, query_body, pit, batch_size, max_docs)
+    finally:
+        try:
+            es.close_point_in_time(id=pit["id"])
+        except Exception as e:
+            current_app.logger.error(e)
+
+
+def sliced_hits(es: Elasticsearch, query_body: dict, batch_size: int, max_docs: int, slices: int,
+                ordered: bool = True) -> List[dict]:
+    """
+    Hits of a point in time split into slices, each slice read by its own thread
+    A sorted read stops a slice once its hits are older than the max_docs newest read so far,
+    so about max_docs / slices hits (plus a page) are read from each slice
+    :param slices: number of slices (and threads)
+    :param ordered: merge the slices back in data.createdAt desc order, otherwise concatenate them
+    :return: at most max_docs hits
+    """
+    pit = {"id": es.open_point_in_time(index=ES_INDEX, keep_alive=PIT_KEEP_ALIVE)["id"], "keep_alive": PIT_KEEP_ALIVE}
+    lock = threading.Lock()
+    collected = [0]
+    # ordered: sort keys of the max_docs newest hits read so far, the oldest of them on top
+    newest = []
+
+    def read_slice(slice_id: int) -> List[dict]:
+        hits = []
+        for page in pit_pages(es, query_body, pit, batch_size, max_docs, slice_id, slices):
+            hits.extend(page)
+            with lock:
+                collected[0] += len(page)
+                if not ordered:
+                    if collected[0] >= max_docs:
+                        break
+                    continue
+                for hit in page:
+                    key = (hit["sort"][0], -hit["sort"][1])
+                    if len(newest) < max_docs:
+                        heapq.heappush(newest, key)
+                    elif key > newest[0]:
+                        heapq.heapreplace(newest, key)
+                # the rest of the slice is older than its last hit, which is already out of the merged result
+                last = page[-1]["sort"]
+                if len(newest) == max_docs and (last[0], -last[1]) <= newest[0]:
+                    break
+        return hits
+
+    try:
+        with ThreadPoolExecutor(max_workers=slices) as executor:
+            parts = list(executor.map(read_slice, range(slices)))
+    finally:
+        try:
+            es.close_point_in_time(id=pit["id"])
+        except Exception as e:
+            current_app.logger.error(e)
+
+    if ordered:
+        merged = heapq.merge(*parts, key=lambda h: (-h["sort"][0], h["sort"][1]))
+        return [hit for _, hit in zip(range(max_docs), merged)]
+    return list(chain.from_iterable(parts))[:max_docs]
+
+
+def stream_response(es: Elasticsearch, query_body: dict, batch_size: int, max_docs: int) -> Response:
+    """
+    NDJSON response written page by page as the hits arrive from ES
+    The first page is read before the response starts, so ES errors still fail the request
+    """
+    pages = search_pages(es, query_body, batch_size, max_docs)
+    first = next(pages, [])
+
+    def generate():
+        for hits in chain([first], pages):
+            if hits:
+                yield "".join(json.dumps(to_doc(h), ensure_ascii=False) + "\n" for h in hits)
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+def aggregations(interval: str, top: int) -> dict:
+    """
+    ES aggregations for the notebook charts
+    :param interval: calendar interval of the timeline
+    :param top: number of keyword and tag buckets
+    :return: aggs of the search body
+    """
+    avg_sentiment = {"avg_sentiment": {"avg": {"field": "sentiment"}}}
+    labels = {"labels": {"terms": {"field": "sentimentLabel"}}}
+    return {
+        "sentiment": {"stats": {"field": "sentiment"}},
+        "sentiment_percentiles": {"percentiles": {"field": "sentiment", "percents": SENTIMENT_PERCENTS}},
+        "sentimentLabel": {"terms": {"field": "sentimentLabel"}},
+        "platform": {"terms": {"field": "platform"}, "aggs": {**avg_sentiment, **labels}},
+        "keywords": {"terms": {"field": "keywords", "size": top}, "aggs": avg_sentiment},
+        "tags": {"terms": {"field": "data.tags", "size": top}, "aggs": avg_sentiment},
+        "timeline": {
+            "date_histogram": {
+                "field": "data.createdAt",
+                "calendar_interval": interval,
+                "format": "yyyy-MM-dd",
+                "min_doc_count": 1
+            },
+            "aggs": {**avg_sentiment, **labels}
+        }
+    }
+
+
+def flatten_buckets(buckets: List[dict], key: str = "key") -> List[dict]:
+    """
+    Bucket list of a terms or date_histogram aggregation without the ES wrapping
+    """
+    out = []
+    for b in buckets:
+        row = {key: b.get("key_as_string", b["key"]), "count": b["doc_count"]}
+        if "avg_sentiment" in b:
+            row["avg_sentiment"] = b["avg_sentiment"]["value"]
+        if "labels" in b:
+            row["labels"] = {label["key"]: label["doc_count"] for label in b["labels"]["buckets"]}
+        out.append(row)
+    return out
+
+
+def aggregate_response(es: Elasticsearch, query_body: dict, interval: str, top: int) -> str:
+    """
+    Run the aggregations on the documents matched by the query, without returning any hit
+    :return: JSON string of the total and the flattened buckets
+    """
+    resp = es.search(index=ES_INDEX, body={
+        "size": 0,
+        "track_total_hits": True,
+        "query": query_body["query"],
+        "aggs": aggregations(interval, top)
+    })
+    aggs = resp["aggregations"]
+    stats = aggs["sentiment"]
+    return json.dumps({
+        "total": resp["hits"]["total"]["value"],
+        "sentiment": {
+            "count": stats["count"],
+            "min": stats["min"],
+            "max": stats["max"],
+            "avg": stats["avg"],
+            "percentiles": aggs["sentiment_percentiles"]["values"]
+        },
+        "sentimentLabel": {b["key"]: b["doc_count"] for b in aggs["sentimentLabel"]["buckets"]},
+        "platform": flatten_buckets(aggs["platform"]["buckets"]),
+        "keywords": flatten_buckets(aggs["keywords"]["buckets"]),
+        "tags": flatten_buckets(aggs["tags"]["buckets"]),
+        "timeline": flatten_buckets(aggs["timeline"]["buckets"], key="date")
+    }, ensure_ascii=False)
+
+
+def canonical(value: Any) -> Any:
+    """
+    Same structure with every list sorted, as the order of terms and bool clauses does not change the hits
+    """
+    if isinstance(value, dict):
+        return {k: canonical(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return sorted((canonical(v) for v in value), key=lambda v: json.dumps(v, sort_keys=True))
+    return value
+
+
+def cache_key(query_body: dict, max_docs: int, mode: Optional[str], **options: Any) -> str:
+    """
+    Redis key of a result: hash of the canonical query, _source, max_docs, mode and mode options
+    """
+    key = {
+        "query": canonical(query_body["query"]),
+        "_source": query_body["_source"],
+        "max_docs": max_docs,
+        "mode": mode,
+        **options
+    }
+    digest = hashlib.sha256(json.dumps(key, sort_keys=True, separators=(",", ":")).encode("utf-8")).hexdigest()
+    return f"{CACHE_KEY_PREFIX}:{digest}"
+
+
+def cache_settings() -> Tuple[int, int]:
+    """
+    TTL in seconds and size limit in bytes of the cache, from redis-config
+    """
+    return (redis_pool.config("DATA_FILTER_CACHE_TTL", CACHE_TTL),
+            redis_pool.config("DATA_FILTER_CACHE_MAX_BYTES", CACHE_MAX_BYTES))
+
+
+def cache_get(key: str) -> Optional[Union[str, bytes]]:
+    """
+    Cached result of the key, entries expire CACHE_TTL after they were computed
+    Redis errors are logged and treated as a miss
+    """
+    try:
+        redis_client = redis_pool.get_redis()
+        body, binary = redis_client.hmget(key, ["body", "binary"])
+        outcome = "misses" if body is None else "hits"
+        pipe = redis_client.pipeline(transaction=False)
+        if body is None:
+            # expired, forget its size
+            pipe.zrem(CACHE_LRU_KEY, key)
+            pipe.hdel(CACHE_SIZES_KEY, key)
+        else:
+            pipe.zadd(CACHE_LRU_KEY, {key: time.time()})
+        pipe.hincrby(CACHE_STATS_KEY, outcome, 1)
+        pipe.execute()
+    except Exception as e:
+        current_app.logger.error(f"Query cache lookup failed: {e}")
+        return None
+
+    cache_stats[outcome] += 1
+    lookups = sum(cache_stats.values())
+    if lookups % CACHE_REPORT_EVERY == 1:
+        current_app.logger.info(f"Query cache: {cache_stats}, hit rate {cache_stats['hits'] / lookups:.1%}")
+    if body is None:
+        return None
+    result = zlib.decompress(body)
+    return result if binary == b"1" else result.decode("utf-8")
+
+
+def cache_put(key: str, result: Union[str, bytes]):
+    """
+    Store a result for CACHE_TTL, then evict the least recently used entries over CACHE_MAX_BYTES
+    """
+    ttl, max_bytes = cache_settings()
+    binary = isinstance(result, bytes)
+    body = zlib.compress(result if binary else result.encode("utf-8"))
+    if len(body) > max_bytes:
+        return
+    now = time.time()
+    try:
+        redis_client = redis_pool.get_redis()
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.hset(key, mapping={"body": body, "binary": int(binary)})
+        pipe.expire(key, ttl)
+        pipe.zadd(CACHE_LRU_KEY, {key: now})
+        pipe.hset(CACHE_SIZES_KEY, key, len(body))
+        pipe.execute()
+
+        # entries not used within the TTL have expired already
+        expired = redis_client.zrangebyscore(CACHE_LRU_KEY, "-inf", now - ttl)
+        sizes = redis_client.hgetall(CACHE_SIZES_KEY)
+        total = sum(int(size) for k, size in sizes.items() if k not in expired)
+        evicted = list(expired)
+        if total > max_bytes:
+            for k in redis_client.zrange(CACHE_LRU_KEY, 0, -1):
+                if total <= max_bytes:
+                    break
+                if k not in expired:
+                    total -= int(sizes.get(k, 0))
+                    evicted.append(k)
+        if evicted:
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.delete(*evicted)
+            pipe.zrem(CACHE_LRU_KEY, *evicted)
+            pipe.hdel(CACHE_SIZES_KEY, *evicted)
+            pipe.execute()
+    except Exception as e:
+        current_app.logger.error(f"Query cache store failed: {e}")
+
+
+def since_query(base: dict, field: str, since: Any) -> dict:
+    """
+    The query restricted to the documents whose field is at or after since
+    :param base: query built from the payload
+    :param field: date field of the watermark
+    :param since: epoch ms
+    """
+    return {"bool": {"must": [base], "filter": [{"range": {field: {"gte": since}}}]}}
+
+
+def epoch_ms(value: Optional[str]) -> Optional[int]:
+    """
+    Epoch milliseconds of an ISO date, None if missing or not a date
+    """
+    if not value:
+        return None
+    try:
+        date = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return int(date.timestamp() * 1000)
+
+
+def dictionary_encode(values: List[Optional[str]]) -> Dict[str, list]:
+    """
+    Distinct values and the index of each value in them (-1 for None)
+    """
+    index: Dict[str, int] = {}
+    codes = [-1 if v is None else index.setdefault(v, len(index)) for v in values]
+    return {"dictionary": list(index), "codes": codes}
+
+
+def to_columns(hits: List[dict]) -> Dict[str, list]:
+    """
+    One list per column of the notebook data frame, read straight from the hits
+    """
+    columns = {name: [] for name in ("_id", "platform", "sentiment", "sentimentLabel", "keywords", "tags", "createdAt")}
+    for hit in hits:
+        src = hit["_source"]
+        data = src.get("data") or {}
+        columns["_id"].append(hit["_id"])
+        columns["platform"].append(src.get("platform"))
+        columns["sentiment"].append(src.get("sentiment"))
+        columns["sentimentLabel"].append(src.get("sentimentLabel"))
+        columns["keywords"].append(src.get("keywords"))
+        columns["tags"].append(data.get("tags"))
+        columns["createdAt"].append(epoch_ms(data.get("createdAt")))
+    return columns
+
+
+def to_arrow(columns: Dict[str, list], metadata: Dict[str, str]) -> bytes:
+    """
+    Columns as an Arrow IPC stream, buffers compressed with zstd
+    """
+    table = pa.table({
+        "_id": pa.array(columns["_id"], pa.string()),
+        "platform": pa.array(columns["platform"], pa.string()).dictionary_encode(),
+        "sentiment": pa.array(columns["sentiment"], pa.float64()),
+        "sentimentLabel": pa.array(columns["sentimentLabel"], pa.string()).dictionary_encode(),
+        "keywords": pa.array(columns["keywords"], pa.list_(pa.string())),
+        "tags": pa.array(columns["tags"], pa.list_(pa.string())),
+        "createdAt": pa.array(columns["createdAt"], pa.timestamp("ms", tz="UTC")),
+    }).replace_schema_metadata(metadata)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema, options=pa.ipc.IpcWriteOptions(compression="zstd")) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def format_response(result: Union[str, bytes], fmt: str, accept_encoding: str):
+    """
+    Response of the default mode in the requested format
+    """
+    if fmt == "arrow":
+        return Response(result, mimetype=ARROW_MIMETYPE)
+    if fmt == "columnar" and "gzip" in accept_encoding:
+        return Response(gzip.compress(result.encode("utf-8"), GZIP_LEVEL), mimetype="application/json",
+                        headers={"Content-Encoding": "gzip"})
+    return result
+
+
+def hits_response(es: Elasticsearch, query_body: dict, batch_size: int, max_docs: int,
+                  watermark_field: Optional[str] = None, fmt: str = "rows",
+                  slices: int = 1, ordered: bool = True) -> Union[str, bytes]:
+    """
+    Every hit read with a point in time and search_after (sliced_hits when slices > 1), up to max_docs
+    :param watermark_field: also return the newest value of this date field among the matched documents
+    :param fmt: rows (list of documents), columnar (JSON lists per column) or arrow (IPC stream)
+    :param slices: number of slices read concurrently
+    :param ordered: keep the sliced hits in data.createdAt order
+    :return: JSON string of the total, the documents and the watermark, or the Arrow stream
+    """
+    aggs = {}
+    if watermark_field:
+        aggs = es.search(index=ES_INDEX, body={
+            "size": 0,
+            "query": query_body["query"],
+            "aggs": {"watermark": {"max": {"field": watermark_field}}}
+        })["aggregations"]
+    if slices > 1:
+        docs = sliced_hits(es, query_body, batch_size, max_docs, slices, ordered)
+    else:
+        docs = list(chain.from_iterable(search_pages(es, query_body, batch_size, max_docs)))
+    return format_result(docs, aggs, watermark_field, fmt)
+
+
+def format_result(docs: List[dict], aggs: dict, watermark_field: Optional[str], fmt: str) -> Union[str, bytes]:
+    """
+    Hits of the default mode in the requested format
+    """
+    result: Dict[str, Any] = {"total": len(docs)}
+    if watermark_field:
+        # None when nothing matched, the caller keeps its previous watermark
+        result["watermark"] = {"field": watermark_field, "value": aggs["watermark"].get("value_as_string")}
+    if fmt == "rows":
+        result["data"] = [to_doc(d) for d in docs]
+        return json.dumps(result, ensure_ascii=False)
+
+    columns = to_columns(docs)
+    if fmt == "arrow":
+        return to_arrow(columns, {k: json.dumps(v) for k, v in result.items()})
+    for name in ("platform", "sentimentLabel"):
+        columns[name] = dictionary_encode(columns[name])
+    result["columns"] = columns
+    return json.dumps(result, ensure_ascii=False)
+
+
+def handle_request(payload: str, accept: str = "", accept_encoding: str = ""):
     """
     handle payload request, and return the filtered data from ES
     :param payload: json string contains content, tags, keywords,
-                    scroll batch size, and maximum document count
+                    page size, maximum document count, and mode ("stream" for NDJSON,
+                    "aggregate" for buckets only, with optional interval and top),
+                    since and since_field for incremental queries, format, slices and sorted
+                    of the default mode, and cache (false to bypass the result cache)
+    :param accept: Accept header, the arrow format is picked when it asks for an Arrow stream
+    :param accept_encoding: Accept-Encoding header, the columnar format is gzip compressed when it allows it
     :return:
     """
 
@@ -112,64 +608,78 @@ def handle_request(payload: str):
     # building ES query_body
     query_body = {
         "track_total_hits": True,
-        "_source": [
-            "platform",
-            "sentiment",
-            "sentimentLabel",
-            "keywords",
-            "data.createdAt",
-            "data.tags"
-        ],
+        "_source": SOURCE_FIELDS,
         "sort": [{"data.createdAt": {"order": "desc"}}],
         "query": query(payload)
     }
 
-    es_auth = (config('ES_USERNAME'), config('ES_PASSWORD'))
-    es = Elasticsearch(hosts=ES_HOST,
-                       verify_certs=False,
-                       ssl_show_warn=False,
-                       basic_auth=es_auth)
-    scroll_time = "2m"
-
-    # start query
-    resp = es.search(
-        index=ES_INDEX,
-        body=query_body,
-        scroll=scroll_time,
-        size=batch_size,
-
-    )
-    scroll_id = resp.get("_scroll_id")
-    hits = resp["hits"]["hits"]
-    docs = hits.copy()
-
-    # scrolling query
-    while hits and len(docs) < max_docs and scroll_id:
-        resp = es.scroll(scroll_id=scroll_id, scroll=scroll_time)
-        scroll_id = resp.get("_scroll_id") or ""
-        hits = resp["hits"]["hits"]
-        docs.extend(hits)
+    mode = payload.get("mode")
+    interval = payload.get("interval", "month")
+    if mode == "aggregate" and interval not in AGG_INTERVALS:
+        return json.dumps({"error": f"interval must be one of {', '.join(AGG_INTERVALS)}"})
 
-    # check scrolling id
-    if scroll_id:
-        try:
-            es.clear_scroll(scroll_id=scroll_id)
-        except Exception as e:
-            current_app.logger.error(e)
-            pass
+    since = payload.get("since")
+    since_field = payload.get("since_field", "fetchedAt")
+    if since_field not in SINCE_FIELDS:
+        return json.dumps({"error": f"since_field must be one of {', '.join(SINCE_FIELDS)}"})
+    if since is not None:
+        # ISO dates are sent as epoch ms, anything else would only fail in Elasticsearch
+        if isinstance(since, str):
+            since = epoch_ms(since)
+        elif isinstance(since, bool) or not isinstance(since, int):
+            since = None
+        if since is None:
+            return json.dumps({"error": "since must be epoch milliseconds or an ISO date"})
+        query_body["query"] = since_query(query_body["query"], since_field, since)
+    watermark_field = since_field if "since" in payload or "since_field" in payload else None
+
+    fmt = payload.get("format") or ("arrow" if ARROW_MIMETYPE in accept else "rows")
+    if fmt not in FORMATS:
+        return json.dumps({"error": f"format must be one of {', '.join(FORMATS)}"})
+    if fmt == "arrow" and pa is None:
+        return json.dumps({"error": "The arrow format needs pyarrow, which is not installed"})
+
+    slices = payload.get("slices", 1)
+    ordered = payload.get("sorted", True)
+    if isinstance(slices, bool) or not isinstance(slices, int) or not 1 <= slices <= SLICES_MAX:
+        return json.dumps({"error": f"slices must be an integer between 1 and {SLICES_MAX}"})
+    if not isinstance(ordered, bool):
+        return json.dumps({"error": "sorted must be true or false"})
+
+    # a stream is NDJSON read page by page in order
+    if mode == "stream" and payload.get("format") is not None:
+        return json.dumps({"error": "format is not supported with mode stream, which returns NDJSON"})
+    if mode == "stream" and (slices != 1 or "sorted" in payload):
+        return json.dumps({"error": "slices and sorted are not supported with mode stream"})
+
+    es = es_pool.get_es()
+    if mode == "stream":
+        return stream_response(es, query_body, batch_size, max_docs)
+
+    top = int(payload.get("top", AGG_TOP_DEFAULT))
+    use_cache = CACHE_ENABLED and payload.get("cache", True)
+    if use_cache:
+        if mode == "aggregate":
+            options = {"interval": interval, "top": top}
+        else:
+            options = {"watermark": watermark_field, "format": fmt, "sorted": ordered}
+        # since is part of the query, notebooks refreshing from the same watermark share an entry
+        key = cache_key(query_body, max_docs, mode, **options)
+        cached = cache_get(key)
+        if cached is not None:
+            return cached if mode == "aggregate" else format_response(cached, fmt, accept_encoding)
 
-    # produce output
-    docs = docs[:max_docs]
-    data = []
-    for d in docs:
-        src = d["_source"].copy()
-        src["_id"] = d["_id"]
-        data.append(src)
+    if mode == "aggregate":
+        result = aggregate_response(es, query_body, interval, top)
+    else:
+        result = hits_response(es, query_body, batch_size, max_docs, watermark_field, fmt, slices, ordered)
 
-    return json.dumps({"total": len(data), "data": data}, ensure_ascii=False)
+    if use_cache:
+        cache_put(key, result)
+    return result if mode == "aggregate" else format_response(result, fmt, accept_encoding)
 
 
 def main():
     # main function
     payload = request.get_data(as_text=True)
-    return handle_request(payload)
+    return handle_request(payload, request.headers.get("Accept", ""), request.headers.get("Accept-Encoding", ""))
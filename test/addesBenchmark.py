@@ -0,0 +1,129 @@
+"""
+Benchmark for add_es: one index request per record (the previous behaviour)
+against the _bulk path in addes.main, both writing to a local mock ES HTTP server.
+
+Usage:
+    python addesBenchmark.py --records 5000 --batch 100 --latency 0.002
+    python addesBenchmark.py --reject-rate 0.05    # exercise the 429 retry path
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+from elasticsearch8 import Elasticsearch
+from elasticsearch8.exceptions import ConflictError
+from flask import Flask
+
+from mockElasticsearch import MockElasticsearch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend", "fission", "functions", "add_es"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend", "fission", "common"))
+import addes  # noqa: E402
+import es_pool  # noqa: E402
+
+
+def make_record(i: int) -> dict:
+    return {
+        "platform": ("Mastodon", "Reddit", "Bluesky")[i % 3],
+        "version": 1.1,
+        "fetchedAt": "2025-05-01T00:00:00Z",
+        "sentiment": 0.25,
+        "sentimentLabel": "positive",
+        "keywords": ["melbourne", "rent", "prices"],
+        "data": {
+            "id": str(1000000 + i),
+            "createdAt": "2025-05-01T00:00:00Z",
+            "content": f"Synthetic post {i} about rent prices in Melbourne",
+            "sensitive": False,
+            "favouritesCount": i % 11,
+            "repliesCount": i % 5,
+            "tags": ["melbourne"],
+            "url": f"https://example.org/post/{i}",
+            "account": {
+                "id": str(i % 100),
+                "username": f"user{i % 100}",
+                "createdAt": "2023-01-01T00:00:00Z",
+                "followersCount/linkKarma": 1,
+                "followingCount/commentKarma": 2
+            }
+        }
+    }
+
+
+def fake_config(k: str) -> str:
+    """
+    Stand-in for the shared-data config map, only the credentials are set
+    """
+    if k in ("ES_USERNAME", "ES_PASSWORD"):
+        return "elastic"
+    raise FileNotFoundError(k)
+
+
+def per_doc(es: Elasticsearch, app: Flask, records: list):
+    """
+    The previous add_es loop: validate and index one record per request
+    """
+    with app.app_context():
+        for record in records:
+            if not addes.legal_record(record):
+                continue
+            try:
+                es.index(
+                    index="socialplatform",
+                    id=f"{record['platform'].lower()}_{record['data']['id']}",
+                    body=record,
+                    op_type="create"
+                )
+            except ConflictError:
+                pass
+
+
+def bulk(app: Flask, records: list, batch: int) -> dict:
+    """
+    Call addes.main with KEDA sized batches and sum up the returned counts
+    """
+    totals = {}
+    for i in range(0, len(records), batch):
+        with app.test_request_context("/", method="POST", json=records[i:i + batch]):
+            for k, v in json.loads(addes.main()).items():
+                totals[k] = totals.get(k, 0) + v
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records", type=int, default=5000, help="Number of synthetic records")
+    parser.add_argument("--batch", type=int, default=100, help="Records per add_es invocation (KEDA listLength)")
+    parser.add_argument("--latency", type=float, default=0.002, help="Seconds added to every ES request")
+    parser.add_argument("--reject-rate", type=float, default=0.0, help="Fraction of bulk items first rejected with 429")
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    records = [make_record(i) for i in range(args.records)]
+    print(f"records: {args.records}, batch: {args.batch}, latency: {args.latency * 1000:.1f}ms")
+
+    server = MockElasticsearch(latency=args.latency).start()
+    es = Elasticsearch(server.url)
+    start = time.perf_counter()
+    per_doc(es, app, records)
+    elapsed = time.perf_counter() - start
+    print(f"per-doc: {elapsed:8.3f}s  {args.records / elapsed:10.0f} docs/s  "
+          f"{server.requests} requests, {len(server.docs)} docs")
+
+    server = MockElasticsearch(latency=args.latency, reject_rate=args.reject_rate).start()
+    es_pool.ES_URL = server.url
+    es_pool.config = addes.config = fake_config
+    es_pool.config_mtime = lambda *keys: 0.0
+    addes.BULK_INITIAL_BACKOFF = 0.01
+    start = time.perf_counter()
+    totals = bulk(app, records + records[:args.batch], args.batch)
+    elapsed = time.perf_counter() - start
+    print(f"   bulk: {elapsed:8.3f}s  {args.records / elapsed:10.0f} docs/s  "
+          f"{server.requests} requests, {len(server.docs)} docs, {totals}")
+
+
+if __name__ == "__main__":
+    main()
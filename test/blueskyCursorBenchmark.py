@@ -0,0 +1,117 @@
+"""
+Benchmark of the Bluesky search paging: duplicate ratio and useful posts per API call of
+the latest page per tick (as bluesky_harvester_tag did before the per-term state) against
+the forward passes of fetch_bluesky_posts, with and without backfill.
+
+A MockBluesky stand-in publishes new posts on the term between the timer ticks (a random
+number around --rate per tick, in bursts), the enqueue stand-in counts the posts received
+per id, and a fakeredis server keeps the state of the term.
+
+Usage:
+    python blueskyCursorBenchmark.py --ticks 40 --rate 30 --latency 50
+"""
+
+import argparse
+import logging
+import os
+import random
+import sys
+from urllib.parse import urlparse
+
+import requests
+from flask import Flask
+
+BACKEND = os.path.join(os.path.dirname(__file__), "..", "backend", "fission")
+sys.path.insert(0, os.path.join(BACKEND, "functions", "bluesky_harvester_tag"))
+sys.path.insert(0, os.path.join(BACKEND, "common"))
+import bluesky_harvester_tag  # noqa: E402
+import post_schema  # noqa: E402
+import queue_publisher  # noqa: E402
+from enqueueBenchmark import start_redis_stand_in, redis_pool  # noqa: E402
+from queuePublisherBenchmark import EnqueueStandIn, start_stand_in  # noqa: E402
+from mastodonTagBenchmark import config_map  # noqa: E402
+from mockSocial import MockBluesky  # noqa: E402
+
+TERM = "cost of living"
+
+
+def latest_page_tick(token: str) -> int:
+    """
+    The search of bluesky_harvester_tag before the per-term state: the latest page, every post sent
+    """
+    res = requests.get(f"{bluesky_harvester_tag.API_BASE}/app.bsky.feed.searchPosts",
+                       headers={"Authorization": f"Bearer {token}"},
+                       params={"q": TERM, "sort": "latest", "limit": bluesky_harvester_tag.LIMIT})
+    res.raise_for_status()
+    posts = res.json().get("posts", [])
+    fetched = post_schema.fetched_at()
+    batch = [bluesky_harvester_tag.convert_bluesky_post_to_target_format(post, TERM, fetched) for post in posts]
+    queue_publisher.publish(bluesky_harvester_tag.QUEUE_ENDPOINT, batch)
+    return len(batch)
+
+
+def run(app: Flask, bluesky: MockBluesky, mode: str, ticks: int, rate: int, seed: int) -> dict:
+    growth = random.Random(seed)
+    bluesky.restart()
+    EnqueueStandIn.ids.clear()
+    r = redis_pool.get_redis(decode_responses=True)
+    r.flushall()
+    r.rpush(bluesky_harvester_tag.REDIS_TAGS_LIST, TERM)
+    settings = {"BSKY_USERNAME": "benchmark", "BSKY_APP_PASSWORD": "benchmark", "HARVEST_BUDGET": "10",
+                "BACKFILL": "1" if mode == "forward+backfill" else "0"}
+    bluesky_harvester_tag.config = lambda k: config_map(settings, k)
+
+    with app.app_context():
+        token = bluesky_harvester_tag.load_session()
+        for _ in range(ticks):
+            # bursts: most ticks see a few posts, some see more than a page
+            bluesky.grow(TERM, int(growth.expovariate(1 / rate)))
+            if mode == "latest page":
+                latest_page_tick(token)
+            else:
+                bluesky_harvester_tag.fetch_bluesky_posts(token)
+
+    new = {bluesky.rkey(TERM, seq) for seq in range(-bluesky.added[TERM], 0)}
+    sent = sum(EnqueueStandIn.ids.values())
+    unique = len(EnqueueStandIn.ids)
+    calls = bluesky.calls["searchPosts"]
+    return {
+        "new": len(new),
+        "sent": sent,
+        "unique": unique,
+        "duplicates": 1 - unique / max(sent, 1),
+        "coverage": len(new & set(EnqueueStandIn.ids)) / max(len(new), 1),
+        "calls": calls,
+        "useful_per_call": unique / max(calls, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ticks", type=int, default=40, help="timer ticks per mode")
+    parser.add_argument("--rate", type=float, default=30, help="mean new posts per tick")
+    parser.add_argument("--latency", type=float, default=50, help="latency of the Bluesky stand-in in ms")
+    parser.add_argument("--size", type=int, default=2000, help="posts of the term before the first tick")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    bluesky = MockBluesky(size=args.size, latency=args.latency / 1000, ratelimit=3000).start()
+    bluesky_harvester_tag.API_BASE = bluesky.url + "/xrpc"
+    EnqueueStandIn.latency = 0.002
+    bluesky_harvester_tag.QUEUE_ENDPOINT = start_stand_in()
+    url = urlparse(start_redis_stand_in())
+    redis_pool.DEFAULTS.update(REDIS_HOST=url.hostname, REDIS_PORT=url.port)
+    app = Flask(__name__)
+    app.logger.setLevel(logging.ERROR)
+
+    print(f"{args.ticks} ticks, ~{args.rate} new posts per tick, {args.size} older posts, latency={args.latency}ms")
+    for mode in ("latest page", "forward", "forward+backfill"):
+        row = run(app, bluesky, mode, args.ticks, args.rate, args.seed)
+        print(f"{mode:<17} new={row['new']:>5} sent={row['sent']:>5} unique={row['unique']:>5} "
+              f"duplicates={row['duplicates']:>6.1%} new covered={row['coverage']:>6.1%} "
+              f"searchPosts={row['calls']:>4} useful/call={row['useful_per_call']:>5.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""
+Unit tests of bluesky_harvester_tag against the MockBluesky stand-in and a fakeredis server:
+the forward passes and the backfill of a search term, and the session shared through Redis.
+
+Usage:
+    python blueskyHarvesterTest.py
+"""
+
+import logging
+import os
+import sys
+import threading
+import unittest
+from collections import Counter
+from unittest import mock
+from urllib.parse import urlparse
+
+from flask import Flask
+
+BACKEND = os.path.join(os.path.dirname(__file__), "..", "backend", "fission")
+sys.path.insert(0, os.path.join(BACKEND, "functions", "bluesky_harvester_tag"))
+sys.path.insert(0, os.path.join(BACKEND, "common"))
+import bluesky_harvester_tag  # noqa: E402
+import queue_publisher  # noqa: E402
+import rate_governor  # noqa: E402
+import redis_pool  # noqa: E402
+from standIns import start_redis_stand_in, config_map  # noqa: E402
+from mockSocial import MockBluesky, iso, jwt  # noqa: E402
+
+TERM = "cost of living"
+
+
+class BlueskyCase(unittest.TestCase):
+    """
+    MockBluesky and fakeredis shared by the tests, the posts published are recorded in sent
+    """
+    @classmethod
+    def setUpClass(cls):
+        logging.basicConfig(level=logging.CRITICAL)
+        cls.bluesky = MockBluesky(size=400, ratelimit=1000000).start()
+        bluesky_harvester_tag.API_BASE = cls.bluesky.url + "/xrpc"
+        rate_governor.LIMITS["bluesky"] = (1000000, 300)
+        url = urlparse(start_redis_stand_in())
+        redis_pool.DEFAULTS.update(REDIS_HOST=url.hostname, REDIS_PORT=url.port)
+        cls.app = Flask(__name__)
+        cls.app.logger.setLevel(logging.CRITICAL)
+
+    def setUp(self):
+        self.bluesky.restart()
+        self.r = redis_pool.get_redis(decode_responses=True)
+        self.r.flushall()
+        self.r.rpush(bluesky_harvester_tag.REDIS_TAGS_LIST, TERM)
+        self.settings = {"BSKY_USERNAME": "test", "BSKY_APP_PASSWORD": "test"}
+        bluesky_harvester_tag.config = lambda k: config_map(self.settings, k)
+        # posts sent per record key, and their createdAt
+        self.sent = Counter()
+        self.created = {}
+        publish = mock.patch.object(queue_publisher, "publish", side_effect=self.publish)
+        publish.start()
+        self.addCleanup(publish.stop)
+        self.context = self.app.app_context()
+        self.context.push()
+        self.addCleanup(self.context.pop)
+
+    def publish(self, endpoint, posts, concurrency=None):
+        for post in posts:
+            self.sent[post.id] += 1
+            self.created[post.id] = post.created_at
+        return {}
+
+    def tick(self, **settings) -> int:
+        self.settings.update({k: str(v) for k, v in settings.items()})
+        return bluesky_harvester_tag.fetch_bluesky_posts(bluesky_harvester_tag.load_session())
+
+    def state(self) -> dict:
+        return self.r.hgetall(f"{bluesky_harvester_tag.STATE_PREFIX}:{TERM}")
+
+    def rkeys(self, seqs) -> set:
+        return {self.bluesky.rkey(TERM, seq) for seq in seqs}
+
+
+class PagingTest(BlueskyCase):
+    def test_new_term_gets_its_latest_page(self):
+        self.tick(HARVEST_BUDGET=20)
+        self.assertEqual(set(self.sent), self.rkeys(range(bluesky_harvester_tag.LIMIT)))
+        self.assertEqual(self.bluesky.calls["searchPosts"], 1)
+        self.assertIn("newest", self.state())
+        self.assertNotIn("cursor", self.state())
+
+    def test_resumed_pass_sends_no_post_twice(self):
+        self.tick(HARVEST_BUDGET=20)
+        self.bluesky.grow(TERM, 200)
+        # the pass is cut after 2 pages and resumed from its cursor
+        self.tick(MAX_PAGES=2)
+        self.assertIn("cursor", self.state())
+        # posts indexed meanwhile shift the positions the cursor points at
+        self.bluesky.grow(TERM, 30)
+        for _ in range(5):
+            self.tick(MAX_PAGES=2)
+        self.assertNotIn("cursor", self.state())
+
+        self.assertEqual(max(self.sent.values()), 1, [k for k, n in self.sent.items() if n > 1])
+        self.assertEqual(set(self.sent), self.rkeys(range(-230, bluesky_harvester_tag.LIMIT)))
+
+    def test_completed_pass_resends_nothing(self):
+        self.tick(HARVEST_BUDGET=20)
+        self.bluesky.grow(TERM, 10)
+        self.tick(HARVEST_BUDGET=20)
+        before = sum(self.sent.values())
+        self.tick(HARVEST_BUDGET=20)
+        self.assertEqual(sum(self.sent.values()), before)
+        self.assertEqual(max(self.sent.values()), 1)
+
+    def test_backfill_stops_at_end_date(self):
+        end_date = "2024-06-01"
+        for _ in range(10):
+            self.tick(HARVEST_BUDGET=20, BACKFILL=1, BACKFILL_END_DATE=end_date)
+            if self.state().get("backfill_done"):
+                break
+        self.assertEqual(self.state().get("backfill_done"), "1")
+        self.assertNotIn("backfill_cursor", self.state())
+
+        expected = {seq for seq in range(self.bluesky.size) if iso(self.bluesky.created(seq)) >= end_date}
+        self.assertEqual(set(self.sent), self.rkeys(expected))
+        self.assertGreaterEqual(min(self.created.values()), end_date)
+        self.assertEqual(max(self.sent.values()), 1)
+
+        # a finished backfill makes no more requests
+        calls = self.bluesky.calls["searchPosts"]
+        self.tick(HARVEST_BUDGET=20, BACKFILL=1, BACKFILL_END_DATE=end_date)
+        self.assertEqual(self.bluesky.calls["searchPosts"], calls + 1)
+
+
+class SessionTest(BlueskyCase):
+    def setUp(self):
+        super().setUp()
+        self.bluesky.access_lifetime = 7200
+        self.key = f"{bluesky_harvester_tag.SESSION_PREFIX}:test"
+
+    def calls(self) -> tuple:
+        return self.bluesky.calls["createSession"], self.bluesky.calls["refreshSession"]
+
+    def test_cached_session_reused(self):
+        token = bluesky_harvester_tag.load_session()
+        self.assertEqual(bluesky_harvester_tag.load_session(), token)
+        self.assertEqual(self.calls(), (1, 0))
+
+    def test_expired_access_token_refreshed(self):
+        token = bluesky_harvester_tag.load_session()
+        self.r.hset(self.key, "access_exp", 0)
+        self.assertNotEqual(bluesky_harvester_tag.load_session(), token)
+        self.assertEqual(self.calls(), (1, 1))
+        # the refreshed session is cached for the next invocations
+        bluesky_harvester_tag.load_session()
+        self.assertEqual(self.calls(), (1, 1))
+
+    def test_refused_refresh_logs_in(self):
+        bluesky_harvester_tag.load_session()
+        self.r.hset(self.key, mapping={"access_exp": 0, "refresh": jwt("did:plc:test", -10, "com.atproto.refresh")})
+        self.assertTrue(bluesky_harvester_tag.load_session())
+        self.assertEqual(self.calls(), (2, 1))
+
+    def test_expired_refresh_token_logs_in_without_refresh(self):
+        bluesky_harvester_tag.load_session()
+        self.r.hset(self.key, mapping={"access_exp": 0, "refresh_exp": 0})
+        self.assertTrue(bluesky_harvester_tag.load_session())
+        self.assertEqual(self.calls(), (2, 0))
+
+    def test_pods_refresh_once_under_the_lock(self):
+        bluesky_harvester_tag.load_session()
+        self.r.hset(self.key, "access_exp", 0)
+        tokens = []
+
+        def pod():
+            with self.app.app_context():
+                tokens.append(bluesky_harvester_tag.load_session())
+
+        pods = [threading.Thread(target=pod) for _ in range(4)]
+        for t in pods:
+            t.start()
+        for t in pods:
+            t.join()
+        self.assertEqual(self.calls(), (1, 1))
+        self.assertEqual(len(set(tokens)), 1)
+        self.assertIsNone(self.r.get(f"{self.key}:lock"))
+
+    def test_token_refused_by_search_is_refreshed(self):
+        bluesky_harvester_tag.load_session()
+        # revoked early: the cached token still looks valid but the server refuses it
+        revoked = jwt("did:plc:test", -10, "com.atproto.access")
+        self.r.hset(self.key, "access", revoked)
+        self.assertEqual(bluesky_harvester_tag.load_session(), revoked)
+        self.assertEqual(bluesky_harvester_tag.fetch_bluesky_posts(revoked), 0)
+        self.assertNotEqual(bluesky_harvester_tag.load_session(), revoked)
+        self.assertEqual(self.calls(), (1, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+"""
+Benchmark of the Bluesky session: a createSession per invocation (as bluesky_harvester_tag
+did before the session cache) against the session shared through Redis and refreshed
+with refreshSession before it expires.
+
+Several pods (threads) are invoked at every tick of the timer against a MockBluesky
+stand-in with a short access token lifetime, so the refreshes and the lock between the
+pods show up within a short run. Every invocation logs in and fetches one page.
+
+Usage:
+    python blueskySessionBenchmark.py --ticks 60 --interval 0.5 --pods 3 --access 10
+"""
+
+import argparse
+import logging
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from flask import Flask
+
+BACKEND = os.path.join(os.path.dirname(__file__), "..", "backend", "fission")
+sys.path.insert(0, os.path.join(BACKEND, "functions", "bluesky_harvester_tag"))
+sys.path.insert(0, os.path.join(BACKEND, "common"))
+import bluesky_harvester_tag  # noqa: E402
+from enqueueBenchmark import start_redis_stand_in, redis_pool  # noqa: E402
+from queuePublisherBenchmark import EnqueueStandIn, start_stand_in  # noqa: E402
+from mastodonTagBenchmark import config_map  # noqa: E402
+from mockSocial import MockBluesky  # noqa: E402
+
+TERM = "cost of living"
+
+
+def login_per_invocation() -> str:
+    """
+    load_session before the cache: createSession on every invocation
+    """
+    res = bluesky_harvester_tag.create_session("benchmark", "benchmark")
+    return res["accessJwt"] if res else None
+
+
+def invoke(app: Flask, login) -> float:
+    """
+    One timer invocation of a pod, login and one page
+    :return: seconds
+    """
+    start = time.perf_counter()
+    with app.app_context():
+        token = login()
+        if token:
+            bluesky_harvester_tag.fetch_bluesky_posts(token)
+    return time.perf_counter() - start
+
+
+def run(app: Flask, bluesky: MockBluesky, mode: str, args) -> dict:
+    bluesky.restart()
+    r = redis_pool.get_redis(decode_responses=True)
+    r.flushall()
+    r.rpush(bluesky_harvester_tag.REDIS_TAGS_LIST, *[TERM] * args.pods)
+    login = login_per_invocation if mode == "createSession" else bluesky_harvester_tag.load_session
+
+    latencies = []
+    with ThreadPoolExecutor(max_workers=args.pods) as pool:
+        for _ in range(args.ticks):
+            tick = time.monotonic()
+            latencies += pool.map(lambda _: invoke(app, login), range(args.pods))
+            time.sleep(max(0.0, tick + args.interval - time.monotonic()))
+
+    latencies.sort()
+    logins = bluesky.calls["createSession"] + bluesky.calls["refreshSession"]
+    return {
+        "p50": statistics.median(latencies) * 1000,
+        "p95": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        "created": bluesky.calls["createSession"],
+        "refreshed": bluesky.calls["refreshSession"],
+        "per_invocation": logins / len(latencies),
+        "searches": bluesky.calls["searchPosts"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ticks", type=int, default=60, help="timer ticks per mode")
+    parser.add_argument("--interval", type=float, default=0.5, help="seconds between ticks")
+    parser.add_argument("--pods", type=int, default=3, help="pods invoked at every tick")
+    parser.add_argument("--access", type=float, default=10, help="access token lifetime in seconds")
+    parser.add_argument("--latency", type=float, default=80, help="latency of the Bluesky stand-in in ms")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    bluesky = MockBluesky(size=2000, latency=args.latency / 1000, ratelimit=100000,
+                          access_lifetime=args.access).start()
+    bluesky_harvester_tag.API_BASE = bluesky.url + "/xrpc"
+    # the stand-in tokens live seconds instead of hours, keep the same share of their life
+    bluesky_harvester_tag.SESSION_SKEW = args.access * 60 / 7200
+    settings = {"BSKY_USERNAME": "benchmark", "BSKY_APP_PASSWORD": "benchmark", "HARVEST_BUDGET": "0"}
+    bluesky_harvester_tag.config = lambda k: config_map(settings, k)
+    EnqueueStandIn.latency = 0.002
+    bluesky_harvester_tag.QUEUE_ENDPOINT = start_stand_in()
+    url = urlparse(start_redis_stand_in())
+    redis_pool.DEFAULTS.update(REDIS_HOST=url.hostname, REDIS_PORT=url.port)
+    app = Flask(__name__)
+    app.logger.setLevel(logging.ERROR)
+
+    invocations = args.ticks * args.pods
+    print(f"{args.ticks} ticks x {args.pods} pods every {args.interval}s, access token lifetime {args.access}s, "
+          f"latency={args.latency}ms")
+    for mode in ("createSession", "cached session"):
+        row = run(app, bluesky, mode, args)
+        print(f"{mode:<15} invocation p50={row['p50']:>6.1f}ms p95={row['p95']:>6.1f}ms "
+              f"createSession={row['created']:>4} refreshSession={row['refreshed']:>3} "
+              f"login calls/invocation={row['per_invocation']:.3f} "
+              f"searchPosts={row['searches']}/{invocations}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,370 @@
+"""
+Benchmark for the data_filter query modes against a local mock ES with generated hits.
+
+For every result set size, each mode runs in a fresh process that sends the request
+through a Flask test client and reads the response body chunk by chunk, and reports:
+- time to first byte (the first chunk of the body)
+- total time until the last chunk
+- peak RSS of the process above its RSS before the request
+
+Modes:
+- default: point in time + search_after, every hit collected and dumped into one JSON string
+- stream: point in time + search_after, NDJSON written page by page
+
+--aggregate compares, for the AFL and cost of living payloads of frontend.ipynb, the
+response size and latency (including decoding the JSON) of the default mode against the
+aggregate mode. The mock matches every generated hit with any query and computes the
+aggregations in Python, so the aggregate latency is an upper bound of what ES takes.
+
+--cache re-runs the two payloads round after round against a Redis stand-in, with new
+posts ingested every few rounds, and reports the cache hit rate, the latency of the
+requests served from ES and from the cache, and the most posts a cached result missed.
+
+--formats compares the rows, columnar (gzip) and arrow formats of the default mode:
+response size, server time, and the time to decode the response into the notebook data
+frame (for rows, the way post_processing in frontend.ipynb builds it).
+
+--slices reads the same result set with 1..N slices of a point in time, sorted and
+unordered, and reports the hits per second. --latency stands in for the time ES takes to
+answer each page.
+
+--since refreshes a local Parquet copy with frontend/data_client.py over HTTP, after new
+posts are ingested, and compares it with downloading everything again.
+
+Usage:
+    python dataFilterBenchmark.py --hits 10000,100000,500000 --size 10000
+    python dataFilterBenchmark.py --aggregate --hits 10000,100000
+    python dataFilterBenchmark.py --cache --hits 100000 --rounds 12 --ingest-every 4
+    python dataFilterBenchmark.py --since --hits 100000 --rounds 5 --new 500
+    python dataFilterBenchmark.py --formats --hits 100000
+    python dataFilterBenchmark.py --slices 1,2,3,4,6,8 --hits 100000 --size 2000 --latency 0.05
+"""
+
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlparse
+
+from flask import Flask
+
+from mockElasticsearch import MockElasticsearch
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, os.path.join(ROOT, "frontend", "fission", "functions", "data_filter"))
+sys.path.insert(0, os.path.join(ROOT, "backend", "fission", "common"))
+sys.path.insert(0, os.path.join(ROOT, "frontend"))
+
+MODES = ("default", "stream")
+
+AFL_TERMS = [
+    "afl", "AFL", "afl*", "footy", "footy*", "aflmatch", "aflfinal",
+    "aflfans", "aflteam", "aflgame", "aflnews", "aflclub", "aflround",
+    "afldebate", "aflgrandfinal", "australian football", "aussie rules",
+    "aflw", "aflplayers", "aflscore", "afllive", "afltalk", "aflstats", "aflumpires"
+]
+PAYLOADS = {
+    "afl": {
+        "content": AFL_TERMS,
+        "tags": AFL_TERMS,
+        "keywords": AFL_TERMS,
+        "combine": "or",
+        "size": 10000,
+        "max_docs": 500000,
+        "date_range": {"from": "01-01-2000", "to": "31-12-2026"}
+    },
+    "cost of living": {
+        "content": ["cost", "rent", "price", "grocery", "transport", "bill", "living", "wage", "income", "expensive",
+                    "afford", "renting", "apartment", "real estate", "landlord", "tenant", "lease", "mortgage",
+                    "housing", "electricity", "gas", "water", "utility", "power bill", "food", "supermarket"],
+        "tags": [],
+        "keywords": ["brisbane", "melbourne", "sydney", "canberra", "adelaide", "perth", "hobart", "darwin"],
+        "combine": "and",
+        "size": 10000,
+        "max_docs": 500000,
+        "date_range": {"from": "01-01-2023", "to": "31-12-2026"}
+    }
+}
+
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def child(url: str, mode: str, hits: int, size: int):
+    """
+    Run one request in this process, print the measurements as JSON
+    """
+    app = setup_app(url)
+    payload = {"keywords": ["melbourne"], "size": size, "max_docs": hits, "mode": mode}
+
+    with app.test_client() as client:
+        # warm up the client connection, so both modes start from the same state
+        client.post("/", data=json.dumps(dict(payload, max_docs=1))).close()
+        baseline = peak_rss_mb()
+
+        start = time.perf_counter()
+        resp = client.post("/", data=json.dumps(payload), buffered=False)
+        chunks = iter(resp.response)
+        first = next(chunks)
+        ttfb = time.perf_counter() - start
+        size_bytes = len(first)
+        if mode == "stream":
+            docs = first.count(b"\n")
+            for chunk in chunks:
+                size_bytes += len(chunk)
+                docs += chunk.count(b"\n")
+        else:
+            docs = json.loads(first)["total"]
+        resp.close()
+        total = time.perf_counter() - start
+
+    print(json.dumps({"ttfb": ttfb, "total": total, "docs": docs, "bytes": size_bytes,
+                      "rss": peak_rss_mb() - baseline}))
+
+
+def setup_app(url: str) -> Flask:
+    import data_filter
+    import es_pool
+
+    es_pool.config = lambda k: "elastic"
+    es_pool.config_mtime = lambda *keys: 0.0
+    es_pool.ES_URL = url
+    data_filter.CACHE_ENABLED = False
+    app = Flask(__name__)
+    app.logger.disabled = True
+    app.add_url_rule("/", "data_filter", data_filter.main, methods=["POST"])
+    return app
+
+
+def aggregate_benchmark(hits_list: list, latency: float):
+    for hits in hits_list:
+        server = MockElasticsearch(latency=latency, hits=hits).start()
+        with setup_app(server.url).test_client() as client:
+            for name, payload in PAYLOADS.items():
+                for mode in ("default", "aggregate"):
+                    start = time.perf_counter()
+                    body = client.post("/", data=json.dumps(dict(payload, mode=mode))).get_data()
+                    result = json.loads(body)
+                    elapsed = time.perf_counter() - start
+                    assert result["total"] == hits
+                    print(f"{hits:>7} hits {name:>14} {mode:>9}: {elapsed * 1000:9.1f}ms  "
+                          f"response {len(body) / 1024:10.1f}KB")
+        server.shutdown()
+
+
+def cache_benchmark(hits: int, rounds: int, ingest_every: int, latency: float):
+    import data_filter
+    from enqueueBenchmark import start_redis_stand_in, redis_pool
+
+    url = urlparse(start_redis_stand_in())
+    redis_pool.DEFAULTS.update(REDIS_HOST=url.hostname, REDIS_PORT=url.port)
+    server = MockElasticsearch(latency=latency, hits=hits).start()
+    app = setup_app(server.url)
+    data_filter.CACHE_ENABLED = True
+    latencies = {"es": [], "cache": []}
+    lag = 0
+
+    with app.test_client() as client:
+        for r in range(rounds):
+            if r and r % ingest_every == 0:
+                # the harvesters add a post, moving the newest fetchedAt of the index
+                server.grow(1)
+            for payload in PAYLOADS.values():
+                hits_before = data_filter.cache_stats["hits"]
+                start = time.perf_counter()
+                body = client.post("/", data=json.dumps(payload)).get_data()
+                elapsed = time.perf_counter() - start
+                total = json.loads(body)["total"]
+                # a cached result misses the posts ingested within its TTL
+                assert total <= server.hits
+                lag = max(lag, server.hits - total)
+                latencies["cache" if data_filter.cache_stats["hits"] > hits_before else "es"].append(elapsed * 1000)
+
+    stats = data_filter.cache_stats
+    print(f"{hits} hits, {rounds} rounds of {len(PAYLOADS)} payloads, new posts every {ingest_every} rounds")
+    print(f"cache: {stats}, hit rate {stats['hits'] / sum(stats.values()):.1%}")
+    for source, values in latencies.items():
+        print(f"served from {source:>5}: {len(values):3d} requests  p50 {statistics.median(values):8.1f}ms  "
+              f"max {max(values):8.1f}ms")
+    print(f"most posts missed by a cached result: {lag}")
+    sizes = redis_pool.get_redis().hvals(data_filter.CACHE_SIZES_KEY)
+    print(f"cached entries: {len(sizes)}, {sum(map(int, sizes)) / 2 ** 20:.1f}MB compressed")
+
+
+def notebook_frame(body: bytes):
+    """
+    post_processing of frontend.ipynb
+    """
+    import pandas as pd
+
+    docs = json.loads(body)["data"]
+    records = []
+    for d in docs:
+        record = {
+            "sentiment": d.get("sentiment"),
+            "platform": d.get("platform"),
+            "_id": d.get("_id"),
+            "sentimentLabel": d.get("sentimentLabel"),
+            "keywords": d.get("keywords"),
+            "tags": d.get("data", {}).get("tags"),
+            "createdAt": d.get("data", {}).get("createdAt"),
+        }
+        records.append(record)
+    df = pd.DataFrame(records)
+    df["createdAt"] = df["createdAt"].str.replace(r"Z$", "", regex=True)
+    df["createdAt"] = pd.to_datetime(df["createdAt"], utc=True, errors="raise", format="ISO8601")
+    return df
+
+
+def formats_benchmark(hits: int, latency: float):
+    import gzip
+    import pyarrow as pa
+    import data_client
+
+    decoders = {
+        "rows": notebook_frame,
+        "columnar": lambda body: data_client.from_columns(json.loads(gzip.decompress(body))["columns"]),
+        "arrow": lambda body: pa.ipc.open_stream(body).read_all().to_pandas()[data_client.COLUMNS],
+    }
+    server = MockElasticsearch(latency=latency, hits=hits).start()
+    frames = {}
+    print(f"{hits} rows")
+    with setup_app(server.url).test_client() as client:
+        for fmt, decode in decoders.items():
+            start = time.perf_counter()
+            resp = client.post("/", data=json.dumps(dict(PAYLOADS["afl"], format=fmt)),
+                               headers={"Accept-Encoding": "gzip"})
+            body = resp.get_data()
+            served = time.perf_counter() - start
+            start = time.perf_counter()
+            frames[fmt] = df = decode(body)
+            decoded = time.perf_counter() - start
+            assert len(df) == hits
+            print(f"{fmt:>9}: response {len(body) / 2 ** 20:7.2f}MB  server {served * 1000:8.1f}ms  "
+                  f"decode to DataFrame {decoded * 1000:8.1f}ms")
+    for fmt, df in frames.items():
+        assert df["_id"].tolist() == frames["rows"]["_id"].tolist(), fmt
+        assert df["createdAt"].equals(frames["rows"]["createdAt"].astype(df["createdAt"].dtype)), fmt
+        assert df["platform"].astype(str).tolist() == frames["rows"]["platform"].tolist(), fmt
+
+
+def slices_benchmark(hits: int, slice_counts: list, size: int, latency: float):
+    import data_filter
+
+    server = MockElasticsearch(latency=latency, hits=hits).start()
+    print(f"{hits} hits, page size {size}, latency {latency * 1000:.0f}ms per page")
+    baseline = None
+    with setup_app(server.url).test_client() as client:
+        for ordered in (True, False):
+            for slices in slice_counts:
+                payload = dict(PAYLOADS["afl"], size=size, max_docs=hits, slices=slices, sorted=ordered,
+                               format="columnar")
+                start = time.perf_counter()
+                result = json.loads(client.post("/", data=json.dumps(payload)).get_data())
+                elapsed = time.perf_counter() - start
+                ids = result["columns"]["_id"]
+                assert len(set(ids)) == hits, f"{len(set(ids))} distinct hits"
+                if ordered:
+                    baseline = baseline or ids
+                    assert ids == baseline, "sliced hits out of order"
+                print(f"{'sorted' if ordered else 'unordered':>9} slices {slices:2d}: {elapsed:7.2f}s  "
+                      f"{hits / elapsed:9.0f} hits/s")
+
+        # a sorted read of the newest quarter stops each slice once it is past the merged result
+        cut = hits // 4
+        for slices in slice_counts:
+            payload = dict(PAYLOADS["afl"], size=size, max_docs=cut, slices=slices, format="columnar")
+            requests = server.requests
+            result = json.loads(client.post("/", data=json.dumps(payload)).get_data())
+            assert result["columns"]["_id"] == baseline[:cut], "sliced hits out of order"
+            print(f"   sorted slices {slices:2d}, max_docs {cut}: {server.requests - requests:4d} requests")
+    assert server.open_pits == 0 and data_filter.SLICES_MAX >= max(slice_counts)
+
+
+def since_benchmark(hits: int, rounds: int, new: int, latency: float):
+    import logging
+    import data_client
+    from werkzeug.serving import make_server
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+
+    server = MockElasticsearch(latency=latency, hits=hits).start()
+    http = make_server("127.0.0.1", 0, setup_app(server.url), threaded=True)
+    threading.Thread(target=http.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{http.server_port}/"
+    payload = PAYLOADS["cost of living"]
+    data_dir = tempfile.mkdtemp()
+
+    def timed(label: str, **kwargs):
+        start = time.perf_counter()
+        df = data_client.refresh(payload, data_dir=data_dir, base_url=base_url, **kwargs)
+        elapsed = time.perf_counter() - start
+        assert len(df) == server.hits and df["_id"].is_unique, f"{len(df)} rows for {server.hits} posts"
+        print(f"{label:>24}: {elapsed * 1000:9.1f}ms")
+
+    print(f"{hits} posts, {rounds} refreshes after {new} new posts each")
+    timed("first download")
+    for r in range(rounds):
+        server.grow(new)
+        timed(f"refresh {r + 1} (+{new} posts)")
+    timed("full download again", full=True)
+    http.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hits", type=str, default="10000,100000,500000", help="Comma separated result set sizes")
+    parser.add_argument("--size", type=int, default=10000, help="Hits per page (the notebooks use 10000)")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every ES request")
+    parser.add_argument("--aggregate", action="store_true", help="Compare the aggregate mode with the default one")
+    parser.add_argument("--cache", action="store_true", help="Measure the result cache")
+    parser.add_argument("--rounds", type=int, default=12, help="Rounds of the payloads (--cache) or refreshes (--since)")
+    parser.add_argument("--ingest-every", type=int, default=4, help="Rounds between new posts for --cache")
+    parser.add_argument("--slices", type=str, help="Comma separated slice counts to compare")
+    parser.add_argument("--formats", action="store_true", help="Compare the response formats")
+    parser.add_argument("--since", action="store_true", help="Measure incremental refreshes of a local copy")
+    parser.add_argument("--new", type=int, default=500, help="Posts ingested before every refresh for --since")
+    parser.add_argument("--child", nargs=4, metavar=("URL", "MODE", "HITS", "SIZE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        url, mode, hits, size = args.child
+        return child(url, mode, int(hits), int(size))
+
+    if args.slices:
+        return slices_benchmark(int(args.hits.split(",")[0]), list(map(int, args.slices.split(","))),
+                                args.size, args.latency)
+    if args.formats:
+        return formats_benchmark(int(args.hits.split(",")[0]), args.latency)
+    if args.since:
+        return since_benchmark(int(args.hits.split(",")[0]), args.rounds, args.new, args.latency)
+    if args.cache:
+        return cache_benchmark(int(args.hits.split(",")[0]), args.rounds, args.ingest_every, args.latency)
+    if args.aggregate:
+        return aggregate_benchmark(list(map(int, args.hits.split(","))), args.latency)
+
+    print(f"page size: {args.size}, latency: {args.latency * 1000:.1f}ms")
+    for hits in map(int, args.hits.split(",")):
+        server = MockElasticsearch(latency=args.latency, hits=hits).start()
+        for mode in MODES:
+            out = subprocess.run(
+                [sys.executable, __file__, "--child", server.url, mode, str(hits), str(args.size)],
+                check=True, capture_output=True, text=True
+            ).stdout
+            result = json.loads(out.strip().splitlines()[-1])
+            assert result["docs"] == hits, f"{mode}: {result['docs']} of {hits} docs"
+            print(f"{hits:>7} hits {mode:>6}: ttfb {result['ttfb'] * 1000:9.1f}ms  total {result['total']:7.2f}s  "
+                  f"peak rss +{result['rss']:7.1f}MB  body {result['bytes'] / 2 ** 20:6.1f}MB")
+        assert server.open_pits == 0, f"{server.open_pits} point in time left open"
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
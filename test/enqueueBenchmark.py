@@ -0,0 +1,123 @@
+"""
+Throughput benchmark for the enqueue function: one HTTP call per post (single)
+against one HTTP call per page of posts (batch), and a new Redis connection per
+call (cold, as before the shared pool) against the shared redis_pool.
+
+A local Redis stand-in (fakeredis TCP server) is started unless --redis-url is given,
+so every LPUSH pays a real socket round-trip.
+
+Usage:
+    python enqueueBenchmark.py --posts 2000 --page 40
+    python enqueueBenchmark.py --redis-url redis://localhost:6379/0
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from urllib.parse import urlparse
+
+import redis
+from flask import Flask
+
+BACKEND = os.path.join(os.path.dirname(__file__), "..", "backend", "fission")
+sys.path.insert(0, os.path.join(BACKEND, "functions", "enqueue"))
+sys.path.insert(0, os.path.join(BACKEND, "common"))
+import enqueue  # noqa: E402
+import redis_pool  # noqa: E402
+from standIns import start_redis_stand_in  # noqa: E402
+
+TOPIC = "benchmark"
+
+
+def make_post(i: int) -> dict:
+    return {
+        "platform": "Mastodon",
+        "version": 1.1,
+        "fetchedAt": "2025-05-01T00:00:00.000000Z",
+        "sentiment": None,
+        "sentimentLabel": None,
+        "keywords": [],
+        "data": {
+            "id": str(110000000000000000 + i),
+            "createdAt": "2025-05-01T00:00:00Z",
+            "content": f"<p>Benchmark post number {i} about the cost of living in Melbourne</p>",
+            "sensitive": False,
+            "favouritesCount": i % 7,
+            "repliesCount": i % 3,
+            "tags": ["melbourne", "costofliving"],
+            "url": f"https://mastodon.au/@bench/{i}",
+            "account": {
+                "id": str(1000 + i % 50),
+                "username": f"user{i % 50}",
+                "createdAt": "2023-01-01T00:00:00Z",
+                "followersCount/linkKarma": 10,
+                "followingCount/commentKarma": 20
+            }
+        }
+    }
+
+
+def call_enqueue(app: Flask, body: bytes) -> dict:
+    with app.test_request_context(
+            "/enqueue/" + TOPIC,
+            method="POST",
+            data=body,
+            headers={"X-Fission-Params-Topic": TOPIC, "Content-Type": "application/json"}):
+        return json.loads(enqueue.main())
+
+
+def run(app: Flask, client: redis.Redis, posts: list, page: int, mode: str) -> float:
+    """
+    Enqueue every post and return the elapsed seconds
+    """
+    client.delete(TOPIC)
+    start = time.perf_counter()
+    if mode == "cold":
+        for post in posts:
+            redis_pool.reset()
+            call_enqueue(app, json.dumps(post).encode("utf-8"))
+    elif mode == "single":
+        for post in posts:
+            call_enqueue(app, json.dumps(post).encode("utf-8"))
+    elif mode == "batch":
+        for i in range(0, len(posts), page):
+            call_enqueue(app, json.dumps(posts[i:i + page]).encode("utf-8"))
+    else:
+        for i in range(0, len(posts), page):
+            lines = "\n".join(json.dumps(p) for p in posts[i:i + page])
+            call_enqueue(app, lines.encode("utf-8"))
+    elapsed = time.perf_counter() - start
+    assert client.llen(TOPIC) == len(posts), f"{mode}: expected {len(posts)} messages"
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--posts", type=int, default=2000, help="Number of posts to enqueue")
+    parser.add_argument("--page", type=int, default=40, help="Posts per batch call")
+    parser.add_argument("--redis-url", type=str, help="Use an existing Redis instead of the stand-in")
+    args = parser.parse_args()
+
+    url = args.redis_url or start_redis_stand_in()
+    client = redis.Redis.from_url(url)
+
+    # no config map outside the cluster, point the pool defaults at the benchmark Redis
+    parsed = urlparse(url)
+    redis_pool.DEFAULTS.update(REDIS_HOST=parsed.hostname, REDIS_PORT=parsed.port or 6379)
+
+    app = Flask(__name__)
+    posts = [make_post(i) for i in range(args.posts)]
+
+    print(f"Redis: {url}, posts: {args.posts}, page size: {args.page}")
+    baseline = None
+    for mode in ("cold", "single", "batch", "ndjson"):
+        elapsed = run(app, client, posts, args.page, mode)
+        rate = args.posts / elapsed
+        baseline = baseline or rate
+        print(f"{mode:>7}: {elapsed:8.3f}s  {rate:10.0f} posts/s  x{rate / baseline:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Benchmark for the cached Elasticsearch client of add_es and data_filter.
+
+Runs a number of warm invocations of addes.main and data_filter.handle_request against
+a local https mock ES, once with a new client per invocation (the previous behaviour)
+and once with the cached es_pool.get_es(), and reports the TLS handshakes seen by the server
+and the p50/p99 invocation latency.
+
+Usage:
+    python esClientBenchmark.py --invocations 200 --latency 0.001
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+from flask import Flask
+
+from mockElasticsearch import MockElasticsearch
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, os.path.join(ROOT, "backend", "fission", "functions", "add_es"))
+sys.path.insert(0, os.path.join(ROOT, "frontend", "fission", "functions", "data_filter"))
+sys.path.insert(0, os.path.join(ROOT, "backend", "fission", "common"))
+import addes  # noqa: E402
+import data_filter  # noqa: E402
+import es_pool  # noqa: E402
+from addesBenchmark import make_record  # noqa: E402
+
+PAYLOAD = json.dumps({"keywords": ["melbourne"], "size": 100, "max_docs": 100})
+
+
+def fake_config(k: str) -> str:
+    return "elastic"
+
+
+def percentile(values: list, p: float) -> float:
+    return statistics.quantiles(values, n=100, method="inclusive")[int(p) - 1]
+
+
+def run(app: Flask, server: MockElasticsearch, invocations: int, cached: bool) -> list:
+    """
+    Alternate add_es and data_filter invocations, return the latency of each one in ms
+    """
+    latencies = []
+    for i in range(invocations):
+        if not cached:
+            # forget the client, as when every invocation built its own
+            es_pool.reset()
+
+        start = time.perf_counter()
+        if i % 2:
+            with app.app_context():
+                data_filter.handle_request(PAYLOAD)
+        else:
+            with app.test_request_context("/", method="POST", json=[make_record(i)]):
+                addes.main()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--invocations", type=int, default=200, help="Number of function invocations")
+    parser.add_argument("--latency", type=float, default=0.001, help="Seconds added to every ES request")
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    es_pool.config = addes.config = fake_config
+    es_pool.config_mtime = lambda *keys: 0.0
+    data_filter.CACHE_ENABLED = False
+
+    print(f"invocations: {args.invocations}, latency: {args.latency * 1000:.1f}ms")
+    for name, cached in (("new client", False), ("cached", True)):
+        server = MockElasticsearch(latency=args.latency, tls=True).start()
+        es_pool.ES_URL = server.url
+        latencies = run(app, server, args.invocations, cached)
+        print(f"{name:>10}: {server.connections:5d} handshakes  "
+              f"p50 {percentile(latencies, 50):7.2f}ms  p99 {percentile(latencies, 99):7.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
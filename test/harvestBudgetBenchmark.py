@@ -0,0 +1,149 @@
+"""
+Benchmark of the time-budgeted paging of the tag harvesters: posts per invocation and per
+CPU-second with HARVEST_BUDGET=0 (one page per invocation, as before) against a budget.
+
+The stand-ins (mockSocial for Mastodon, Reddit and Bluesky, the enqueue stand-in of
+queuePublisherBenchmark and a fakeredis server) run in a child process, so the CPU time
+measured in this process is the one of the harvester: client setup, paging, formatting
+and publishing.
+
+Usage:
+    python harvestBudgetBenchmark.py --budget 10 --invocations 3 --latency 100
+    python harvestBudgetBenchmark.py --platforms reddit --budget 20
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from urllib.parse import urlparse
+
+from flask import Flask
+
+BACKEND = os.path.join(os.path.dirname(__file__), "..", "backend", "fission")
+FUNCTIONS = ("mastodon_harvester_tag", "reddit_harvester_tag", "bluesky_harvester_tag")
+for name in FUNCTIONS:
+    sys.path.insert(0, os.path.join(BACKEND, "functions", name))
+sys.path.insert(0, os.path.join(BACKEND, "common"))
+import mastodon_harvester_tag  # noqa: E402
+import reddit_harvester_tag  # noqa: E402
+import bluesky_harvester_tag  # noqa: E402
+from enqueueBenchmark import start_redis_stand_in, redis_pool  # noqa: E402
+from mastodonTagBenchmark import config_map  # noqa: E402
+
+TAGS = {"mastodon": "melbourne", "reddit": "melbourne", "bluesky": "cost of living"}
+
+
+def stand_ins(conn, latency: float, size: int):
+    """
+    Child process: serve the stand-ins, answer "calls" with the API calls since the last "restart"
+    """
+    from mockSocial import MockMastodon, MockReddit, MockBluesky
+    from queuePublisherBenchmark import EnqueueStandIn, start_stand_in
+
+    EnqueueStandIn.latency = 0.005
+    servers = {
+        "mastodon": MockMastodon(size=size, latency=latency, ratelimit=300).start(),
+        "reddit": MockReddit(size=size, latency=latency, ratelimit=1000, window=600).start(),
+        "bluesky": MockBluesky(size=size, latency=latency, ratelimit=3000).start(),
+    }
+    conn.send({
+        "urls": {k: s.url for k, s in servers.items()},
+        "enqueue": start_stand_in(),
+        "redis": start_redis_stand_in(),
+    })
+    while True:
+        command = conn.recv()
+        if command == "restart":
+            for s in servers.values():
+                s.restart()
+            conn.send(True)
+        elif command == "calls":
+            conn.send({k: dict(s.calls) for k, s in servers.items()})
+        else:
+            return
+
+
+def invoke(platform: str, urls: dict, settings: dict) -> int:
+    """
+    One timer invocation of a harvester, client setup included
+    :return: posts and comments sent
+    """
+    if platform == "mastodon":
+        mastodon_harvester_tag.config = lambda k: config_map(
+            dict(settings, ACCESS_TOKEN="benchmark", API_BASE_URL=urls["mastodon"]), k)
+        s = {k: mastodon_harvester_tag.setting(k, v) for k, v in mastodon_harvester_tag.DEFAULTS.items()}
+        return mastodon_harvester_tag.fetch_tags_and_send_posts(s)
+    if platform == "reddit":
+        import praw
+
+        reddit_harvester_tag.config = lambda k: config_map(settings, k)
+        url = urls["reddit"]
+        reddit = praw.Reddit(client_id="benchmark", client_secret="benchmark", user_agent="benchmark",
+                             oauth_url=url, reddit_url=url, short_url=url, check_for_updates=False)
+        return reddit_harvester_tag.fetch_reddit_posts(reddit)
+    bluesky_harvester_tag.config = lambda k: config_map(
+        dict(settings, BSKY_USERNAME="benchmark", BSKY_APP_PASSWORD="benchmark"), k)
+    bluesky_harvester_tag.API_BASE = urls["bluesky"] + "/xrpc"
+    token = bluesky_harvester_tag.load_session()
+    return bluesky_harvester_tag.fetch_bluesky_posts(token)
+
+
+def run(app: Flask, conn, env: dict, platform: str, budget: float, invocations: int) -> dict:
+    conn.send("restart")
+    conn.recv()
+    r = redis_pool.get_redis(decode_responses=True)
+    r.flushall()
+    module = {"mastodon": mastodon_harvester_tag, "reddit": reddit_harvester_tag,
+              "bluesky": bluesky_harvester_tag}[platform]
+    r.rpush(module.REDIS_TAGS_LIST, TAGS[platform])
+
+    sent = 0
+    cpu = time.process_time()
+    start = time.perf_counter()
+    for _ in range(invocations):
+        with app.app_context():
+            sent += invoke(platform, env["urls"], {"HARVEST_BUDGET": str(budget)}) or 0
+    wall = time.perf_counter() - start
+    cpu = time.process_time() - cpu
+    conn.send("calls")
+    calls = sum(conn.recv()[platform].values())
+    return {"sent": sent, "wall": wall, "cpu": cpu, "calls": calls}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--platforms", default="mastodon,reddit,bluesky")
+    parser.add_argument("--budget", type=float, default=10, help="HARVEST_BUDGET in seconds")
+    parser.add_argument("--invocations", type=int, default=3, help="invocations per run")
+    parser.add_argument("--latency", type=float, default=100, help="latency of the platform stand-ins in ms")
+    parser.add_argument("--size", type=int, default=5000, help="posts per timeline")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    conn, child = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=stand_ins, args=(child, args.latency / 1000, args.size), daemon=True)
+    process.start()
+    env = conn.recv()
+
+    url = urlparse(env["redis"])
+    redis_pool.DEFAULTS.update(REDIS_HOST=url.hostname, REDIS_PORT=url.port)
+    for module in (mastodon_harvester_tag, reddit_harvester_tag, bluesky_harvester_tag):
+        module.QUEUE_ENDPOINT = env["enqueue"]
+    app = Flask(__name__)
+    app.logger.setLevel(logging.ERROR)
+
+    print(f"{args.invocations} invocations per run, latency={args.latency}ms")
+    for platform in args.platforms.split(","):
+        for budget in (0, args.budget):
+            row = run(app, conn, env, platform, budget, args.invocations)
+            print(f"{platform:<9} budget={budget:>5.1f}s {row['sent'] / args.invocations:>7.1f} posts/invocation "
+                  f"{row['wall'] / args.invocations:>6.2f}s/invocation {row['calls']:>4} API calls "
+                  f"cpu={row['cpu']:.2f}s {row['sent'] / max(row['cpu'], 1e-9):>7.0f} posts/CPU-s")
+    conn.send("stop")
+
+
+if __name__ == "__main__":
+    main()
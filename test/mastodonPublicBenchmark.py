@@ -0,0 +1,139 @@
+"""
+Benchmark of the mastodon_harvester public timeline polling: API calls, duplicates per call
+and missed posts of the latest page every 20s (as mastodon_harvester did before the
+checkpoint), the since_id checkpoint every 20s and 10s, and the adaptive mode with a 10s timer.
+
+The timeline of a MockMastodon stand-in grows in quiet and busy phases (--quiet and --busy
+posts per second, alternating every --phase seconds) on a simulated clock, so an hour of
+timer ticks runs in seconds. The enqueue stand-in counts the posts received per id and a
+fakeredis server keeps the checkpoint.
+
+Usage:
+    python mastodonPublicBenchmark.py --hours 1 --quiet 0.2 --busy 4 --phase 600
+"""
+
+import argparse
+import logging
+import os
+import random
+import sys
+import time
+from types import SimpleNamespace
+from urllib.parse import urlparse
+
+import requests
+from flask import Flask
+
+BACKEND = os.path.join(os.path.dirname(__file__), "..", "backend", "fission")
+sys.path.insert(0, os.path.join(BACKEND, "functions", "mastodon_harvester"))
+sys.path.insert(0, os.path.join(BACKEND, "common"))
+import mastodon_harvester  # noqa: E402
+import post_schema  # noqa: E402
+import queue_publisher  # noqa: E402
+import rate_governor  # noqa: E402
+from enqueueBenchmark import start_redis_stand_in, redis_pool  # noqa: E402
+from queuePublisherBenchmark import EnqueueStandIn, start_stand_in  # noqa: E402
+from mastodonTagBenchmark import config_map  # noqa: E402
+from mockSocial import MockMastodon, ID_BASE  # noqa: E402
+
+MODES = {
+    # mode: (timer period in seconds, masto-config)
+    "latest page, 20s": (20, {}),
+    "since_id, 20s": (20, {"ADAPTIVE": "0"}),
+    "since_id, 10s": (10, {"ADAPTIVE": "0"}),
+    "adaptive, 10s": (10, {"ADAPTIVE": "1"}),
+}
+
+
+def latest_page_tick(url: str):
+    """
+    The poll of mastodon_harvester before the checkpoint: the latest page, every post sent
+    """
+    res = requests.get(f"{url}/api/v1/timelines/public", params={"limit": mastodon_harvester.LIMIT})
+    res.raise_for_status()
+    fetched = post_schema.fetched_at()
+    batch = [post_schema.from_mastodon(post, fetched) for post in res.json()]
+    queue_publisher.publish(mastodon_harvester.QUEUE_ENDPOINT, batch)
+
+
+def arrivals(args) -> list:
+    """
+    New posts of every simulated second, the same for every mode
+    """
+    rng = random.Random(args.seed)
+    seconds = int(args.hours * 3600)
+    rates = [args.busy if (t // args.phase) % 2 else args.quiet for t in range(seconds)]
+    return [int(rate) + (rng.random() < rate - int(rate)) for rate in rates]
+
+
+def run(app: Flask, server: MockMastodon, mode: str, per_second: list) -> dict:
+    period, settings = MODES[mode]
+    settings = dict(settings, API_BASE_URL=server.url, ACCESS_TOKEN="benchmark")
+    mastodon_harvester.config = lambda k: config_map(settings, k)
+    clock = [0.0]
+    mastodon_harvester.time = SimpleNamespace(time=lambda: clock[0], monotonic=time.monotonic)
+    server.restart()
+    EnqueueStandIn.ids.clear()
+    redis_pool.get_redis(decode_responses=True).flushall()
+
+    ticks = 0
+    with app.app_context():
+        for t in range(0, len(per_second), period):
+            server.grow("public", sum(per_second[t:t + period]))
+            clock[0] = t + period
+            ticks += 1
+            if mode.startswith("latest page"):
+                latest_page_tick(server.url)
+            else:
+                mastodon_harvester.main()
+
+    new = {str(ID_BASE + server.number("public", seq)) for seq in range(-server.added["public"], 0)}
+    sent = sum(EnqueueStandIn.ids.values())
+    unique = len(EnqueueStandIn.ids)
+    calls = server.calls["timeline_public"]
+    rate = float(redis_pool.get_redis(decode_responses=True).hget(mastodon_harvester.STATE_KEY, "rate") or 0)
+    return {
+        "ticks": ticks,
+        "calls": calls,
+        "new": len(new),
+        "dup_per_call": (sent - unique) / max(calls, 1),
+        "missed": len(new - set(EnqueueStandIn.ids)),
+        "per_call": unique / max(calls, 1),
+        "rate": rate,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hours", type=float, default=1, help="simulated hours per mode")
+    parser.add_argument("--quiet", type=float, default=0.2, help="posts per second of the quiet phases")
+    parser.add_argument("--busy", type=float, default=4, help="posts per second of the busy phases")
+    parser.add_argument("--phase", type=int, default=600, help="seconds of a phase")
+    parser.add_argument("--latency", type=float, default=5, help="latency of the Mastodon stand-in in ms")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    server = MockMastodon(size=2000, latency=args.latency / 1000, ratelimit=1000000).start()
+    # the simulated hour runs in seconds, keep the shared bucket out of the way
+    rate_governor.LIMITS["mastodon"] = (1000000, 300)
+    EnqueueStandIn.latency = 0.001
+    mastodon_harvester.QUEUE_ENDPOINT = start_stand_in()
+    url = urlparse(start_redis_stand_in())
+    redis_pool.DEFAULTS.update(REDIS_HOST=url.hostname, REDIS_PORT=url.port)
+    app = Flask(__name__)
+    app.logger.setLevel(logging.ERROR)
+
+    per_second = arrivals(args)
+    print(f"{args.hours}h simulated, {args.quiet} / {args.busy} posts/s every {args.phase}s, "
+          f"{sum(per_second)} new posts")
+    for mode in MODES:
+        row = run(app, server, mode, per_second)
+        print(f"{mode:<17} ticks={row['ticks']:>4} calls={row['calls']:>4} "
+              f"duplicates/call={row['dup_per_call']:>5.1f} missed={row['missed']:>5} "
+              f"({row['missed'] / max(row['new'], 1):>5.1%}) unique/call={row['per_call']:>5.1f} "
+              f"estimated rate={row['rate']:.2f} posts/s")
+
+
+if __name__ == "__main__":
+    main()
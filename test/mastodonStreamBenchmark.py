@@ -0,0 +1,197 @@
+"""
+Benchmark of the streaming mode of mastodon_harvester (mastodon_stream): throughput, end to
+end latency (post published on the stand-in to post in the `mastodon` Redis list), LPUSH
+batches, duplicates and missed posts for several micro-batch settings.
+
+A MockMastodon stand-in publishes --rate posts per second on the public timeline and sends
+them as server-sent events. Every run is split into two invocations with a --pause second
+gap between them, and the streams are dropped --drops times per invocation, so the posts of
+the gaps can only arrive through the since_id backfill. A consumer thread pops the list of
+a fakeredis server. The burst row publishes --burst posts at once to measure the throughput
+of a single streamer.
+
+Usage:
+    python mastodonStreamBenchmark.py --seconds 10 --rate 200 --drops 2 --burst 5000
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from urllib.parse import urlparse
+
+from flask import Flask
+
+BACKEND = os.path.join(os.path.dirname(__file__), "..", "backend", "fission")
+sys.path.insert(0, os.path.join(BACKEND, "functions", "mastodon_harvester"))
+sys.path.insert(0, os.path.join(BACKEND, "common"))
+import mastodon_harvester  # noqa: E402
+import mastodon_stream  # noqa: E402
+import rate_governor  # noqa: E402
+from enqueueBenchmark import start_redis_stand_in, redis_pool  # noqa: E402
+from mastodonTagBenchmark import config_map  # noqa: E402
+from mockSocial import MockMastodon, ID_BASE  # noqa: E402
+
+BATCHES = [(1, 0.0), (100, 0.2), (100, 1.0)]
+
+
+class Consumer(threading.Thread):
+    """
+    Pops the mastodon list and records the latency of every post from its publication
+    """
+
+    def __init__(self, published: dict):
+        super().__init__(daemon=True)
+        self.published = published
+        self.ids = Counter()
+        self.latency = []
+        self.last = 0.0
+        self.running = True
+
+    def run(self):
+        r = redis_pool.get_redis()
+        while self.running:
+            item = r.brpop(mastodon_stream.TOPIC, timeout=0.2)
+            if item is None:
+                continue
+            now = time.perf_counter()
+            post_id = json.loads(item[1])["data"]["id"]
+            self.ids[post_id] += 1
+            self.latency.append(now - self.published[post_id])
+            self.last = now
+
+
+def produce(server: MockMastodon, published: dict, n: int):
+    """
+    Publish n posts on the public timeline and record when
+    """
+    now = time.perf_counter()
+    before = server.added["public"]
+    server.grow("public", n)
+    for seq in range(-before - n, -before):
+        published[str(ID_BASE + server.number("public", seq))] = now
+
+
+def producer(server: MockMastodon, published: dict, rate: float, seconds: float, drop_at: list):
+    # the first invocation has no checkpoint, only the posts after the stream opened are sent
+    while not server.calls["streaming"]:
+        time.sleep(0.005)
+    time.sleep(0.1)
+    start = time.perf_counter()
+    made = 0
+    while True:
+        elapsed = time.perf_counter() - start
+        if elapsed >= seconds:
+            return
+        if drop_at and elapsed >= drop_at[0]:
+            drop_at.pop(0)
+            server.drop()
+        due = int(rate * elapsed) - made
+        if due > 0:
+            produce(server, published, due)
+            made += due
+        time.sleep(0.005)
+
+
+def percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * p), len(values) - 1)] * 1000 if values else 0.0
+
+
+def invoke(app: Flask) -> Counter:
+    with app.app_context():
+        mastodon_stream.main()
+    return Counter({k: v for k, v in mastodon_stream.stats.items() if k != "latency"})
+
+
+def run(app: Flask, server: MockMastodon, settings: dict, args, burst: bool) -> dict:
+    mastodon_harvester.config = mastodon_stream.config = lambda k: config_map(settings, k)
+    server.restart()
+    r = redis_pool.get_redis()
+    r.flushall()
+    published = {}
+    consumer = Consumer(published)
+    consumer.start()
+    totals = Counter()
+
+    if burst:
+        settings["STREAM_SECONDS"] = str(args.seconds)
+        threading.Timer(0.5, produce, args=(server, published, args.burst)).start()
+        totals += invoke(app)
+    else:
+        # two invocations, the producer keeps publishing in the pause between them
+        half = args.seconds / 2
+        settings["STREAM_SECONDS"] = str(half)
+        drops = sorted([half * (i + 1) / (args.drops + 1) for i in range(args.drops)]
+                       + [args.pause + half + half * (i + 1) / (args.drops + 1) for i in range(args.drops)])
+        thread = threading.Thread(target=producer, args=(server, published, args.rate,
+                                                          args.seconds + args.pause - 0.5, drops))
+        thread.start()
+        totals += invoke(app)
+        time.sleep(args.pause)
+        totals += invoke(app)
+        thread.join()
+
+    # wait for the consumer to drain the list
+    deadline = time.time() + 5
+    while r.llen(mastodon_stream.TOPIC) and time.time() < deadline:
+        time.sleep(0.05)
+    time.sleep(0.3)
+    consumer.running = False
+    consumer.join()
+
+    produced = set(published)
+    received = set(consumer.ids)
+    first = min(published.values()) if published else 0.0
+    return {
+        "produced": len(produced),
+        "unique": len(received & produced),
+        "duplicates": sum(consumer.ids.values()) - len(received),
+        "missed": len(produced - received),
+        "throughput": len(received) / max(consumer.last - first, 1e-9),
+        "p50": percentile(consumer.latency, 0.5),
+        "p95": percentile(consumer.latency, 0.95),
+        "batches": totals["batches"],
+        "reconnects": totals["reconnects"],
+        "backfilled": totals["backfilled"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=10, help="seconds of streaming per run")
+    parser.add_argument("--rate", type=float, default=200, help="posts published per second")
+    parser.add_argument("--drops", type=int, default=2, help="stream drops per invocation")
+    parser.add_argument("--pause", type=float, default=1, help="seconds between the two invocations")
+    parser.add_argument("--burst", type=int, default=5000, help="posts published at once in the burst row")
+    parser.add_argument("--latency", type=float, default=5, help="latency of the Mastodon stand-in in ms")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    server = MockMastodon(size=2000, latency=args.latency / 1000, ratelimit=1000000, heartbeat=0.5).start()
+    rate_governor.LIMITS["mastodon"] = (1000000, 300)
+    url = urlparse(start_redis_stand_in())
+    redis_pool.DEFAULTS.update(REDIS_HOST=url.hostname, REDIS_PORT=url.port)
+    app = Flask(__name__)
+    app.logger.setLevel(logging.ERROR)
+
+    print(f"{args.rate} posts/s for {args.seconds}s in 2 invocations, {args.drops} drops each, "
+          f"pause {args.pause}s; burst of {args.burst}")
+    rows = [(f"batch {size:>3} / {wait}s", size, wait, False) for size, wait in BATCHES]
+    rows.append(("burst, 100 / 0.2s", 100, 0.2, True))
+    for name, size, wait, burst in rows:
+        settings = {"API_BASE_URL": server.url, "ACCESS_TOKEN": "benchmark", "BATCH_SIZE": str(size),
+                    "BATCH_WAIT": str(wait), "RECONNECT_BACKOFF": "0.5"}
+        row = run(app, server, settings, args, burst)
+        print(f"{name:<18} produced={row['produced']:>5} received={row['unique']:>5} missed={row['missed']:>4} "
+              f"duplicates={row['duplicates']:>3} throughput={row['throughput']:>7.0f} posts/s "
+              f"latency p50={row['p50']:>6.1f}ms p95={row['p95']:>6.1f}ms LPUSH={row['batches']:>5} "
+              f"reconnects={row['reconnects']} backfilled={row['backfilled']}")
+
+
+if __name__ == "__main__":
+    main()
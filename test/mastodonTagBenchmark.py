@@ -0,0 +1,108 @@
+"""
+Benchmark of the mastodon_harvester_tag scheduler mode: posts per minute when K tags
+are leased and paged concurrently, against paging the first tag of the list.
+
+Local stand-ins are started for every service of the function:
+- Mastodon: MockMastodon of mockSocial, pages of a generated timeline per tag after an
+  injected latency, with X-RateLimit-* headers (and a 429 once they are used up)
+- enqueue: the stand-in of queuePublisherBenchmark
+- Redis: a fakeredis TCP server
+
+Usage:
+    python mastodonTagBenchmark.py --tags 8 --posts-per-tag 2000 --latency 250 --invocations 3
+"""
+
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer
+from urllib.parse import urlparse
+
+from flask import Flask
+
+BACKEND = os.path.join(os.path.dirname(__file__), "..", "backend", "fission")
+sys.path.insert(0, os.path.join(BACKEND, "functions", "mastodon_harvester_tag"))
+sys.path.insert(0, os.path.join(BACKEND, "common"))
+import mastodon_harvester_tag  # noqa: E402
+from enqueueBenchmark import start_redis_stand_in, redis_pool  # noqa: E402
+from queuePublisherBenchmark import EnqueueStandIn  # noqa: E402
+from mockSocial import MockMastodon  # noqa: E402
+from standIns import config_map  # noqa: E402
+
+def start(handler) -> str:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address
+    return f"http://{host}:{port}"
+
+
+def run(app: Flask, mastodon: MockMastodon, settings: dict, tags: list, invocations: int) -> dict:
+    r = redis_pool.get_redis(decode_responses=True)
+    r.flushall()
+    r.rpush(mastodon_harvester_tag.REDIS_TAGS_LIST, *tags)
+    mastodon.restart()
+    EnqueueStandIn.received = 0
+    mastodon_harvester_tag.config = lambda k: config_map(settings, k)
+
+    cpu = time.process_time()
+    start = time.perf_counter()
+    for _ in range(invocations):
+        with app.app_context():
+            mastodon_harvester_tag.main()
+    wall = time.perf_counter() - start
+    cpu = time.process_time() - cpu
+
+    return {
+        "posts": EnqueueStandIn.received,
+        "wall": wall,
+        "posts_per_min": EnqueueStandIn.received / wall * 60,
+        "requests": sum(mastodon.calls.values()),
+        "throttled": mastodon.throttled,
+        "cpu": cpu,
+        "tags_left": r.llen(mastodon_harvester_tag.REDIS_TAGS_LIST),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tags", type=int, default=8, help="tags in the Redis list")
+    parser.add_argument("--posts-per-tag", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=250, help="latency of the Mastodon stand-in in ms")
+    parser.add_argument("--ratelimit", type=int, default=300, help="requests per window of the stand-in")
+    parser.add_argument("--invocations", type=int, default=3, help="invocations per K")
+    parser.add_argument("--pages", type=int, default=5, help="MAX_PAGES per tag")
+    parser.add_argument("--max-k", type=int, default=8)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    logging.getLogger("queue_publisher").setLevel(logging.ERROR)
+    mastodon = MockMastodon(size=args.posts_per_tag, latency=args.latency / 1000, ratelimit=args.ratelimit).start()
+    EnqueueStandIn.latency = 0.005
+
+    api_base = mastodon.url
+    mastodon_harvester_tag.QUEUE_ENDPOINT = start(EnqueueStandIn) + "/enqueue/mastodon"
+    url = urlparse(start_redis_stand_in())
+    redis_pool.DEFAULTS.update(REDIS_HOST=url.hostname, REDIS_PORT=url.port)
+
+    app = Flask(__name__)
+    app.logger.setLevel(logging.ERROR)
+    tags = [f"tag{i}" for i in range(args.tags)]
+    base = {"ACCESS_TOKEN": "benchmark", "API_BASE_URL": api_base, "MAX_PAGES": str(args.pages), "HARVEST_BUDGET": "60"}
+
+    print(f"{args.tags} tags x {args.posts_per_tag} posts, latency={args.latency}ms, "
+          f"ratelimit={args.ratelimit}, {args.invocations} invocations per run")
+    modes = [("first tag", dict(base, TAG_CONCURRENCY="0"))]
+    modes += [(f"K={k}", dict(base, TAG_CONCURRENCY=str(k))) for k in range(1, args.max_k + 1)]
+    for name, settings in modes:
+        row = run(app, mastodon, settings, tags, args.invocations)
+        print(f"{name:<13} {row['posts']:>6} posts in {row['wall']:6.2f}s = {row['posts_per_min']:>8.0f} posts/min "
+              f"requests={row['requests']} throttled={row['throttled']} cpu={row['cpu']:.2f}s "
+              f"tags left={row['tags_left']}")
+
+
+if __name__ == "__main__":
+    main()
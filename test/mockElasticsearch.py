@@ -0,0 +1,377 @@
+"""
+Minimal in-memory Elasticsearch HTTP stand-in used by the benchmarks.
+
+Supports the calls made by add_es and data_filter:
+- PUT  /<index>/_create/<id>, PUT /<index>/_doc/<id>?op_type=create
+- POST /_bulk, POST /<index>/_bulk (create actions)
+- POST /<index>/_search (with scroll), POST /_search/scroll, DELETE /_search/scroll
+- POST /<index>/_pit, POST /_search with pit + search_after (and slice), DELETE /_pit
+- aggregations used by data_filter: terms, date_histogram, stats, avg, max, percentiles
+  (the query is ignored, every document matches)
+
+Searches return the stored documents in one page, or, when started with hits=N, page
+through N generated documents sorted by data.createdAt desc without storing them.
+grow(n) adds n generated documents newer than all the others, and a range on fetchedAt
+in the query only matches the generated documents fetched since then.
+
+Every accepted connection (a TLS handshake when started with tls=True) is counted,
+and an optional latency is added to each request to stand in for the network round-trip
+to the cluster.
+"""
+
+import calendar
+import json
+import math
+import os
+import random
+import statistics
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Optional
+from urllib.parse import urlparse, parse_qs
+
+
+class MockElasticsearch(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency: float = 0.0, reject_rate: float = 0.0, tls: bool = False, hits: int = 0):
+        """
+        :param latency: seconds added to every request
+        :param reject_rate: fraction of bulk items rejected with 429 the first time they are seen
+        :param tls: serve https with a throw-away self-signed certificate
+        :param hits: number of generated documents matched by every search
+        """
+        super().__init__(("127.0.0.1", 0), MockHandler)
+        self.latency = latency
+        self.reject_rate = reject_rate
+        self.tls = tls
+        self.hits = hits
+        self.generated = None
+        self.open_pits = 0
+        self.docs = {}
+        self.rejected = set()
+        self.requests = 0
+        self.connections = 0
+        self.lock = threading.Lock()
+        if tls:
+            self.socket = self_signed_context().wrap_socket(self.socket, server_side=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address
+        return f"{'https' if self.tls else 'http'}://{host}:{port}"
+
+    def start(self) -> "MockElasticsearch":
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def get_request(self):
+        with self.lock:
+            self.connections += 1
+        return super().get_request()
+
+    def create(self, doc_id: str, source: dict, bulk: bool = False) -> int:
+        with self.lock:
+            if bulk and doc_id not in self.rejected and random.random() < self.reject_rate:
+                self.rejected.add(doc_id)
+                return 429
+            if doc_id in self.docs:
+                return 409
+            self.docs[doc_id] = source
+            return 201
+
+    def grow(self, n: int):
+        with self.lock:
+            self.hits += n
+            self.generated = None
+
+    def generated_hit(self, i: int) -> dict:
+        """
+        The i-th newest generated document, with the sort values of a pit search
+        Documents are numbered from the oldest one, so their _id does not change when the index grows
+        """
+        seq = self.hits - 1 - i
+        created = GENERATED_EPOCH_MS + seq * GENERATED_STEP_MS
+        timestamp = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(created / 1000))
+        return {
+            "_index": "socialplatform",
+            "_id": f"mastodon_{seq}",
+            "_source": {
+                "platform": ("Mastodon", "Reddit", "Bluesky")[seq % 3],
+                "fetchedAt": timestamp,
+                "sentiment": round((seq % 200) / 100 - 1, 2),
+                "sentimentLabel": ("negative", "neutral", "positive")[seq % 3],
+                "keywords": ["melbourne", "rent", f"keyword{seq % 50}"],
+                "data": {
+                    "createdAt": timestamp,
+                    "tags": ["auspol"] if seq % 2 else []
+                }
+            },
+            "sort": [created, i]
+        }
+
+    def matching(self, query: dict) -> int:
+        """
+        Number of generated documents matched by the fetchedAt range of the query (all without one)
+        """
+        since = fetched_since(query)
+        if since is None:
+            return self.hits
+        first = math.ceil((epoch_ms(since) - GENERATED_EPOCH_MS) / GENERATED_STEP_MS)
+        return min(self.hits, max(0, self.hits - first))
+
+    def page(self, offset: int, size: int, limit: Optional[int] = None, step: int = 1) -> list:
+        """
+        size hits from the offset-th one, every step-th one (the hits of a slice)
+        """
+        if self.hits:
+            limit = self.hits if limit is None else limit
+            return [self.generated_hit(i) for i in range(offset, limit, step)[:size]]
+        # stored documents all come in the first page
+        if offset:
+            return []
+        return [{"_index": "socialplatform", "_id": doc_id, "_source": doc} for doc_id, doc in self.docs.items()]
+
+    def sources(self, limit: Optional[int] = None) -> list:
+        """
+        Generated (the newest limit ones) and stored documents
+        """
+        if limit is not None and limit < self.hits:
+            generated = [self.generated_hit(i)["_source"] for i in range(limit)]
+        else:
+            if self.generated is None:
+                self.generated = [self.generated_hit(i)["_source"] for i in range(self.hits)]
+            generated = self.generated
+        return generated + list(self.docs.values())
+
+    def aggregate(self, aggs: dict, sources: list) -> dict:
+        """
+        Evaluate the aggregations over the given sources
+        """
+        out = {}
+        for name, spec in aggs.items():
+            sub = spec.get("aggs", {})
+            if "terms" in spec or "date_histogram" in spec:
+                histogram = spec.get("date_histogram")
+                field = (histogram or spec["terms"])["field"]
+                groups = defaultdict(list)
+                for src in sources:
+                    value = source_field(src, field)
+                    for v in value if isinstance(value, list) else [value]:
+                        if v is not None:
+                            groups[calendar_key(v, histogram["calendar_interval"]) if histogram else v].append(src)
+                if histogram:
+                    ordered = sorted(groups.items())
+                else:
+                    ordered = sorted(groups.items(), key=lambda kv: -len(kv[1]))[:spec["terms"].get("size", 10)]
+                buckets = []
+                for key, group in ordered:
+                    bucket = {"key": key, "doc_count": len(group), **self.aggregate(sub, group)}
+                    if histogram:
+                        bucket["key_as_string"] = key
+                    buckets.append(bucket)
+                out[name] = {"buckets": buckets}
+                continue
+
+            kind = next(iter(spec))
+            values = [v for v in (source_field(src, spec[kind]["field"]) for src in sources) if v is not None]
+            if kind == "max":
+                out[name] = {"value": max(map(epoch_ms, values), default=None)}
+                if values and isinstance(values[0], str):
+                    out[name]["value_as_string"] = time.strftime(
+                        "%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(out[name]["value"] / 1000))
+            elif kind == "avg":
+                out[name] = {"value": statistics.fmean(values) if values else None}
+            elif kind == "stats":
+                out[name] = {"count": len(values), "min": min(values, default=None), "max": max(values, default=None),
+                             "avg": statistics.fmean(values) if values else None, "sum": sum(values)}
+            elif kind == "percentiles":
+                ordered = sorted(values)
+                out[name] = {"values": {
+                    f"{float(p)}": ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] if ordered else None
+                    for p in spec[kind]["percents"]
+                }}
+        return out
+
+
+GENERATED_EPOCH_MS = 1767225600000  # 2026-01-01T00:00:00Z
+GENERATED_STEP_MS = 60000
+
+
+def source_field(source: dict, field: str):
+    for part in field.split("."):
+        source = source.get(part) if isinstance(source, dict) else None
+    return source
+
+
+def fetched_since(query: Any) -> Optional[Any]:
+    """
+    Lower bound of the first range on fetchedAt found in the query
+    """
+    if isinstance(query, dict):
+        bounds = query.get("range", {}).get("fetchedAt")
+        if bounds:
+            return bounds.get("gte", bounds.get("gt"))
+        values = query.values()
+    elif isinstance(query, list):
+        values = query
+    else:
+        return None
+    for value in values:
+        since = fetched_since(value)
+        if since is not None:
+            return since
+    return None
+
+
+def epoch_ms(value) -> float:
+    """
+    Numeric value of a number or an ISO date, as ES returns for min/max
+    """
+    if isinstance(value, str):
+        return calendar.timegm(time.strptime(value[:19], "%Y-%m-%dT%H:%M:%S")) * 1000.0
+    return float(value)
+
+
+def calendar_key(value: str, interval: str) -> str:
+    """
+    Start of the calendar interval of an ISO date, as yyyy-MM-dd (weeks and quarters fall back to months)
+    """
+    if interval == "day":
+        return value[:10]
+    if interval == "year":
+        return value[:4] + "-01-01"
+    return value[:7] + "-01"
+
+
+def self_signed_context() -> ssl.SSLContext:
+    """
+    Server TLS context with a certificate generated by the openssl CLI
+    """
+    folder = tempfile.mkdtemp()
+    cert, key = os.path.join(folder, "cert.pem"), os.path.join(folder, "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+         "-subj", "/CN=localhost", "-keyout", key, "-out", cert],
+        check=True, capture_output=True
+    )
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    return context
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, status: int, body: dict):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("X-Elastic-Product", "Elasticsearch")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def handle_request(self):
+        server: MockElasticsearch = self.server
+        with server.lock:
+            server.requests += 1
+        if server.latency:
+            time.sleep(server.latency)
+
+        url = urlparse(self.path)
+        parts = [p for p in url.path.split("/") if p]
+        body = self.read_body()
+
+        if parts and parts[-1] == "_bulk":
+            return self.bulk(body)
+        if parts and parts[-1] == "_pit":
+            return self.pit()
+        if parts and parts[-1] in ("_search", "scroll"):
+            return self.search(parts, url.query, body)
+        if len(parts) == 3 and parts[1] in ("_create", "_doc"):
+            if parts[1] == "_doc" and parse_qs(url.query).get("op_type") != ["create"]:
+                return self.send_json(400, {"error": "only op_type=create is supported"})
+            status = server.create(parts[2], json.loads(body))
+            if status == 409:
+                return self.send_json(409, {
+                    "error": {"type": "version_conflict_engine_exception", "reason": "document already exists"},
+                    "status": 409
+                })
+            return self.send_json(201, {"_index": parts[0], "_id": parts[2], "result": "created"})
+        if not parts:
+            return self.send_json(200, {"version": {"number": "8.14.0"}, "tagline": "You Know, for Search"})
+        return self.send_json(404, {"error": f"unsupported path {url.path}"})
+
+    def bulk(self, body: bytes):
+        server: MockElasticsearch = self.server
+        lines = body.decode("utf-8").splitlines()
+        items, errors = [], False
+        for i in range(0, len(lines), 2):
+            action = json.loads(lines[i])["create"]
+            status = server.create(action["_id"], json.loads(lines[i + 1]), bulk=True)
+            item = {"_index": action.get("_index"), "_id": action["_id"], "status": status}
+            if status != 201:
+                errors = True
+                item["error"] = {"type": "version_conflict_engine_exception" if status == 409
+                                 else "es_rejected_execution_exception"}
+            items.append({"create": item})
+        self.send_json(200, {"took": 1, "errors": errors, "items": items})
+
+    def pit(self):
+        server: MockElasticsearch = self.server
+        with server.lock:
+            server.open_pits += 1 if self.command == "POST" else -1
+        if self.command == "DELETE":
+            return self.send_json(200, {"succeeded": True, "num_freed": 1})
+        self.send_json(200, {"id": "mock-pit"})
+
+    def search(self, parts: list, query: str, body: bytes):
+        """
+        Scroll pages carry their offset in the scroll id, pit pages continue after the
+        second sort value (the position of the document) of search_after
+        Slice i of n holds the documents at positions i, i + n, i + 2n...
+        Without generated hits, every document of the index comes in the first page
+        """
+        server: MockElasticsearch = self.server
+        if self.command == "DELETE":
+            return self.send_json(200, {"succeeded": True, "num_freed": 1})
+        request = json.loads(body) if body else {}
+        if parts[-1] == "scroll":
+            offset, size, limit = map(int, request["scroll_id"].split(":")[1:])
+            step = 1
+        else:
+            size = int(request.get("size", parse_qs(query).get("size", [10])[0]))
+            limit = server.matching(request.get("query"))
+            part = request.get("slice", {"id": 0, "max": 1})
+            step = part["max"]
+            offset = request["search_after"][1] + step if "search_after" in request else part["id"]
+        hits = server.page(offset, size, limit, step)
+        response = {
+            "took": 1,
+            "timed_out": False,
+            "hits": {"total": {"value": limit if server.hits else len(server.docs), "relation": "eq"}, "hits": hits}
+        }
+        if "aggs" in request:
+            sources = server.sources(limit)
+            response["hits"]["total"]["value"] = len(sources)
+            response["aggregations"] = server.aggregate(request["aggs"], sources)
+        if "pit" in request:
+            response["pit_id"] = request["pit"]["id"]
+        else:
+            response["_scroll_id"] = f"mock-scroll:{offset + len(hits)}:{size}:{limit}"
+        self.send_json(200, response)
+
+    do_GET = do_PUT = do_POST = do_HEAD = do_DELETE = handle_request
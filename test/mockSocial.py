@@ -0,0 +1,572 @@
+"""
+Minimal HTTP stand-ins of the social platforms used by the harvester benchmarks.
+
+Every stand-in serves generated timelines, one per tag / search term / subreddit, newest
+first, with size posts spread back over the years so a backfill reaches END_DATE part way
+through. grow(key, n) publishes n posts newer than all the others.
+
+- MockMastodon: GET /api/v1/timelines/tag/<tag> (limit, max_id), GET /api/v1/timelines/public
+  (limit, max_id, since_id, min_id) on the timeline of key "public", X-RateLimit-Limit/Remaining/Reset headers,
+  and the server-sent events of GET /api/v1/streaming/public and /api/v1/streaming/hashtag (tag)
+- MockBluesky: POST /xrpc/com.atproto.server.createSession, POST /xrpc/com.atproto.server.refreshSession,
+  GET /xrpc/app.bsky.feed.searchPosts (q, limit, cursor), RateLimit-Limit/Remaining/Reset headers
+- MockReddit (for praw with oauth_url and reddit_url pointed at it): POST /api/v1/access_token,
+  GET /r/<sub>/new (limit, after, before), GET /comments/<id> (limit, depth), GET /user/<name>/about,
+  GET /api/user_data_by_account_ids (ids), X-Ratelimit-Remaining/Used/Reset headers
+
+Each server adds an optional latency to every request, counts the calls per endpoint in
+calls and the response bytes per first path segment in bytes, and answers 429 once the
+requests of its rate limit window are used up.
+"""
+
+import base64
+import json
+import math
+import threading
+import time
+import zlib
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Tuple
+from urllib.parse import urlparse, parse_qs
+
+NEWEST = datetime(2025, 5, 1, tzinfo=timezone.utc).timestamp()
+ID_BASE = 110000000000000000
+
+
+def base36(n: int) -> str:
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    out = ""
+    while True:
+        n, d = divmod(n, 36)
+        out = digits[d] + out
+        if not n:
+            return out
+
+
+def iso(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+class MockSocial(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, handler, size: int = 2000, latency: float = 0.0, ratelimit: int = 300,
+                 window: int = 300, span_days: float = 1000):
+        """
+        :param size: posts per timeline
+        :param latency: seconds added to every request
+        :param ratelimit: requests per window
+        :param window: seconds of a rate limit window
+        :param span_days: days between the newest and the oldest post of a timeline
+        """
+        super().__init__(("127.0.0.1", 0), handler)
+        self.size = size
+        self.latency = latency
+        self.ratelimit = ratelimit
+        self.window = window
+        self.step = span_days * 86400 / size
+        self.added = defaultdict(int)
+        self.lock = threading.Lock()
+        self.restart()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockSocial":
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def restart(self):
+        """
+        New rate limit window, counters and timelines
+        """
+        with self.lock:
+            self.remaining = self.ratelimit
+            self.reset = time.time() + self.window
+            self.calls = Counter()
+            self.bytes = Counter()
+            self.throttled = 0
+            self.added.clear()
+
+    def take(self, endpoint: str) -> bool:
+        """
+        Count a call and take it from the rate limit window
+        :return: False once the window is used up
+        """
+        with self.lock:
+            self.calls[endpoint] += 1
+            if time.time() >= self.reset:
+                self.remaining = self.ratelimit
+                self.reset = time.time() + self.window
+            if self.remaining <= 0:
+                self.throttled += 1
+                return False
+            self.remaining -= 1
+            return True
+
+    def grow(self, key: str, n: int):
+        """
+        Publish n new posts on the timeline of key
+        """
+        with self.lock:
+            self.added[key] += n
+
+    def length(self, key: str) -> int:
+        return self.size + self.added[key]
+
+    def seq(self, key: str, position: int) -> int:
+        """
+        Stable number of the post at a position of the timeline, 0 is the newest post before any grow
+        """
+        return position - self.added[key]
+
+    def created(self, seq: int) -> float:
+        return NEWEST - seq * self.step
+
+    def number(self, key: str, seq: int) -> int:
+        """
+        Unique increasing number of a post, newer posts have larger numbers
+        """
+        return (self.size - seq) * 100 + zlib.crc32(key.encode()) % 100
+
+
+class MockSocialHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def ratelimit_headers(self) -> dict:
+        return {}
+
+    def send_json(self, status: int, body, headers: Optional[dict] = None):
+        reply = json.dumps(body).encode("utf-8")
+        with self.server.lock:
+            self.server.bytes[self.path.split("?")[0].split("/")[1]] += len(reply)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(reply)))
+        for k, v in dict(self.ratelimit_headers(), **(headers or {})).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(reply)
+
+    def read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def parse(self) -> Tuple[list, dict]:
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        return [p for p in url.path.split("/") if p], query
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        self.route("GET")
+
+    def do_POST(self):
+        time.sleep(self.server.latency)
+        self.route("POST")
+
+    def throttled(self):
+        self.send_json(429, {"error": "Too many requests"})
+
+    def route(self, method: str):
+        raise NotImplementedError
+
+
+class MastodonHandler(MockSocialHandler):
+    def ratelimit_headers(self) -> dict:
+        s = self.server
+        return {
+            "X-RateLimit-Limit": str(s.ratelimit),
+            "X-RateLimit-Remaining": str(max(s.remaining, 0)),
+            "X-RateLimit-Reset": datetime.fromtimestamp(s.reset, timezone.utc).isoformat(),
+        }
+
+    def status(self, tag: str, seq: int) -> dict:
+        s = self.server
+        return {
+            "id": str(ID_BASE + s.number(tag, seq)),
+            "created_at": iso(s.created(seq)),
+            "content": f"<p>Recorded status {seq} about #{tag} and the cost of living in Melbourne</p>",
+            "language": "en",
+            "sensitive": False,
+            "favourites_count": seq % 7,
+            "replies_count": seq % 3,
+            "tags": [{"name": tag, "url": f"https://mastodon.au/tags/{tag}"}],
+            "url": f"https://mastodon.au/@bench/{seq}",
+            "account": {
+                "id": str(1000 + seq % 50),
+                "username": f"user{seq % 50}",
+                "created_at": "2023-01-01T00:00:00.000Z",
+                "followers_count": 10,
+                "following_count": 20,
+            },
+        }
+
+    def newer(self, tag: str, status_id: str) -> int:
+        """
+        Number of posts of the timeline with an id above status_id, the first positions
+        """
+        s = self.server
+        number = int(status_id) - ID_BASE - zlib.crc32(tag.encode()) % 100
+        return min(max(0, s.length(tag) - number // 100), s.length(tag))
+
+    def stream(self, tag: str):
+        """
+        Send an update event for every post published after the connection, and a heartbeat
+        every heartbeat seconds, until the client goes away or drop() is called
+        """
+        s = self.server
+        with s.lock:
+            s.calls["streaming"] += 1
+            seen, generation = s.length(tag), s.generation
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        while True:
+            with s.changed:
+                s.changed.wait(timeout=s.heartbeat)
+            with s.lock:
+                dropped = s.generation != generation
+                length, added = s.length(tag), s.added[tag]
+            # oldest first, as the posts were published
+            events = [f"event: update\ndata: {json.dumps(self.status(tag, p - added))}\n\n"
+                      for p in range(length - seen - 1, -1, -1)]
+            seen = length
+            chunk = "".join(events or [":thump\n"]).encode("utf-8")
+            try:
+                if dropped:
+                    return self.wfile.write(b"0\r\n\r\n")
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+            except OSError:
+                return
+
+    def route(self, method: str):
+        parts, query = self.parse()
+        if parts == ["api", "v1", "streaming", "public"]:
+            return self.stream("public")
+        if parts == ["api", "v1", "streaming", "hashtag"]:
+            return self.stream(query["tag"])
+        if parts[:4] == ["api", "v1", "timelines", "tag"] and len(parts) == 5:
+            endpoint, tag = "timeline_hashtag", parts[4]
+        elif parts == ["api", "v1", "timelines", "public"]:
+            endpoint, tag = "timeline_public", "public"
+        else:
+            return self.send_json(404, {"error": "Record not found"})
+        if not self.server.take(endpoint):
+            return self.throttled()
+        s = self.server
+        limit = int(query.get("limit", 20))
+        start, end = 0, s.length(tag)
+        if "max_id" in query:
+            # first position whose id is not above max_id
+            start = self.newer(tag, query["max_id"])
+        if "since_id" in query:
+            # the newest posts above since_id
+            end = self.newer(tag, query["since_id"])
+        if "min_id" in query:
+            # the oldest posts above min_id, still newest first
+            end = self.newer(tag, query["min_id"])
+            start = max(start, end - limit)
+        end = min(end, start + limit)
+        self.send_json(200, [self.status(tag, s.seq(tag, p)) for p in range(start, end)])
+
+
+class MockMastodon(MockSocial):
+    def __init__(self, heartbeat: float = 1.0, **kwargs):
+        """
+        :param heartbeat: seconds between the heartbeats of a quiet stream
+        """
+        self.heartbeat = heartbeat
+        self.generation = 0
+        self.changed = threading.Condition()
+        super().__init__(MastodonHandler, **kwargs)
+
+    def grow(self, key: str, n: int):
+        super().grow(key, n)
+        with self.changed:
+            self.changed.notify_all()
+
+    def drop(self):
+        """
+        Close every open stream, as a restart of the streaming server does
+        """
+        with self.lock:
+            self.generation += 1
+        with self.changed:
+            self.changed.notify_all()
+
+
+def jwt(sub: str, lifetime: float, kind: str) -> str:
+    """
+    Unsigned token with the claims the harvester reads
+    """
+    def part(obj) -> str:
+        return base64.urlsafe_b64encode(json.dumps(obj).encode()).rstrip(b"=").decode()
+
+    now = time.time()
+    claims = {"scope": kind, "sub": sub, "iat": int(now), "exp": int(now + lifetime), "jti": f"{now:.6f}"}
+    return f"{part({'alg': 'HS256', 'typ': 'JWT'})}.{part(claims)}.c2lnbmF0dXJl"
+
+
+class BlueskyHandler(MockSocialHandler):
+    def ratelimit_headers(self) -> dict:
+        s = self.server
+        return {
+            "RateLimit-Limit": str(s.ratelimit),
+            "RateLimit-Remaining": str(max(s.remaining, 0)),
+            "RateLimit-Reset": str(int(s.reset)),
+            "RateLimit-Policy": f"{s.ratelimit};w={s.window}",
+        }
+
+    def post(self, term: str, seq: int) -> dict:
+        s = self.server
+        rkey = s.rkey(term, seq)
+        did = f"did:plc:user{seq % 50}"
+        created = iso(s.created(seq))
+        return {
+            "uri": f"at://{did}/app.bsky.feed.post/{rkey}",
+            "cid": f"bafyrei{rkey}",
+            "author": {"did": did, "handle": f"user{seq % 50}.bsky.social"},
+            "record": {
+                "$type": "app.bsky.feed.post",
+                "text": f"Recorded post {seq} about {term} and the cost of living in Melbourne",
+                "createdAt": created,
+                "langs": ["en"],
+            },
+            "indexedAt": created,
+            "likeCount": seq % 7,
+            "replyCount": seq % 3,
+        }
+
+    def authorized(self, kind: str) -> bool:
+        token = self.headers.get("Authorization", "").replace("Bearer ", "")
+        try:
+            claims = json.loads(base64.urlsafe_b64decode(token.split(".")[1] + "=="))
+        except (IndexError, ValueError):
+            return False
+        return claims.get("scope") == kind and claims["exp"] > time.time()
+
+    def route(self, method: str):
+        parts, query = self.parse()
+        s = self.server
+        name = parts[-1] if parts else ""
+        if method == "POST" and name == "com.atproto.server.createSession":
+            self.read_body()
+            if not s.take("createSession"):
+                return self.throttled()
+            return self.send_json(200, self.session())
+        if method == "POST" and name == "com.atproto.server.refreshSession":
+            self.read_body()
+            if not s.take("refreshSession"):
+                return self.throttled()
+            if not self.authorized("com.atproto.refresh"):
+                return self.send_json(400, {"error": "ExpiredToken", "message": "Token has expired"})
+            return self.send_json(200, self.session())
+        if method == "GET" and name == "app.bsky.feed.searchPosts":
+            if not s.take("searchPosts"):
+                return self.throttled()
+            if not self.authorized("com.atproto.access"):
+                return self.send_json(400, {"error": "ExpiredToken", "message": "Token has expired"})
+            term = query.get("q", "")
+            limit = int(query.get("limit", 25))
+            start = int(query.get("cursor", 0))
+            end = min(start + limit, s.length(term))
+            body = {"posts": [self.post(term, s.seq(term, p)) for p in range(start, end)]}
+            if end < s.length(term):
+                body["cursor"] = str(end)
+            return self.send_json(200, body)
+        self.send_json(404, {"error": "MethodNotImplemented"})
+
+    def session(self) -> dict:
+        s = self.server
+        return {
+            "did": "did:plc:benchmark",
+            "handle": "benchmark.bsky.social",
+            "accessJwt": jwt("did:plc:benchmark", s.access_lifetime, "com.atproto.access"),
+            "refreshJwt": jwt("did:plc:benchmark", s.refresh_lifetime, "com.atproto.refresh"),
+        }
+
+
+class MockBluesky(MockSocial):
+    def __init__(self, access_lifetime: float = 7200, refresh_lifetime: float = 90 * 86400, **kwargs):
+        """
+        :param access_lifetime: seconds until an access token expires
+        :param refresh_lifetime: seconds until a refresh token expires
+        """
+        super().__init__(BlueskyHandler, **kwargs)
+        self.access_lifetime = access_lifetime
+        self.refresh_lifetime = refresh_lifetime
+
+    def rkey(self, term: str, seq: int) -> str:
+        """
+        Record key of a post, the last part of its uri and the id the harvester sends
+        """
+        return base36(self.number(term, seq) * 7919)
+
+
+class RedditHandler(MockSocialHandler):
+    def ratelimit_headers(self) -> dict:
+        s = self.server
+        return {
+            "X-Ratelimit-Remaining": str(float(max(s.remaining, 0))),
+            "X-Ratelimit-Used": str(s.ratelimit - max(s.remaining, 0)),
+            "X-Ratelimit-Reset": str(max(0, math.ceil(s.reset - time.time()))),
+        }
+
+    def author(self, seq: int) -> Tuple[str, str]:
+        n = seq % self.server.authors
+        return f"author{n}", f"t2_{base36(1000 + n)}"
+
+    def submission(self, sub: str, seq: int) -> dict:
+        s = self.server
+        post_id = base36(s.number(sub, seq))
+        name, fullname = self.author(seq)
+        return {
+            "id": post_id,
+            "name": f"t3_{post_id}",
+            "title": f"Recorded post {seq} about the cost of living",
+            "selftext": f"Body of post {seq} in r/{sub}",
+            "is_self": True,
+            "created_utc": s.created(seq),
+            "author": name,
+            "author_fullname": fullname,
+            "over_18": False,
+            "link_flair_text": "Discussion" if seq % 2 else None,
+            "score": seq % 50,
+            "num_comments": s.comments,
+            "permalink": f"/r/{sub}/comments/{post_id}/post_{seq}/",
+            "subreddit": sub,
+        }
+
+    def comment(self, post: dict, i: int, parent: Optional[dict] = None, depth: int = 1) -> dict:
+        """
+        Comment i of a post, or of a parent comment, with its replies down to depth levels
+        """
+        prefix = parent["id"] if parent else post["id"]
+        name, fullname = self.author(int(post["id"], 36) + i + (7 if parent else 0))
+        comment = {
+            "id": f"{prefix}c{i}",
+            "name": f"t1_{prefix}c{i}",
+            "body": f"Comment {i} on {post['title']}, " + "with a few more words of discussion " * 8,
+            "created_utc": post["created_utc"] + 60 * (i + 1),
+            "author": name,
+            "author_fullname": fullname,
+            "score": i % 5,
+            "replies": "",
+            "depth": parent["depth"] + 1 if parent else 0,
+            "link_id": post["name"],
+            "parent_id": parent["name"] if parent else post["name"],
+            "subreddit": post["subreddit"],
+        }
+        if depth > 1 and self.server.replies:
+            replies = [self.comment(post, j, comment, depth - 1) for j in range(self.server.replies)]
+            comment["replies"] = self.listing(replies, "t1")
+        return comment
+
+    def user(self, n: int) -> dict:
+        return {"name": f"author{n}", "created_utc": 1500000000.0 + n * 86400,
+                "link_karma": n * 10, "comment_karma": n * 20}
+
+    def listing(self, children: list, kind: str, after: Optional[str] = None) -> dict:
+        return {"kind": "Listing", "data": {
+            "after": after, "before": None, "dist": len(children),
+            "children": [{"kind": kind, "data": c} for c in children]}}
+
+    def find(self, sub: str, fullname: str) -> int:
+        """
+        Position of a post of the subreddit from its fullname
+        """
+        number = int(fullname.split("_", 1)[1], 36)
+        return self.server.length(sub) - (number - zlib.crc32(sub.encode()) % 100) // 100
+
+    def route(self, method: str):
+        parts, query = self.parse()
+        s = self.server
+        if method == "POST" and parts == ["api", "v1", "access_token"]:
+            self.read_body()
+            s.take("access_token")
+            return self.send_json(200, {"access_token": "benchmark", "expires_in": 86400,
+                                        "scope": "*", "token_type": "bearer"})
+
+        if parts[0] == "r" and parts[2:3] == ["new"]:
+            if not s.take("new"):
+                return self.throttled()
+            sub = parts[1]
+            s.subreddits.add(sub)
+            limit = min(int(query.get("limit", 25)), 100)
+            if "after" in query:
+                start = self.find(sub, query["after"]) + 1
+            elif "before" in query:
+                start = max(0, self.find(sub, query["before"]) - limit)
+            else:
+                start = 0
+            end = min(start + limit, s.length(sub))
+            posts = [self.submission(sub, s.seq(sub, p)) for p in range(start, end)]
+            after = posts[-1]["name"] if posts and end < s.length(sub) else None
+            return self.send_json(200, self.listing(posts, "t3", after))
+
+        if parts[0] == "comments":
+            if not s.take("comments"):
+                return self.throttled()
+            sub = s.subreddit_of(parts[1])
+            post = self.submission(sub, s.seq(sub, self.find(sub, f"t3_{parts[1]}")))
+            # Reddit answers up to 200 comments and 10 levels by default
+            limit = min(int(query.get("limit", 200)), s.comments)
+            depth = min(int(query.get("depth", 10)), 3)  # the generated threads are three levels deep
+            comments = [self.comment(post, i, depth=depth) for i in range(limit)]
+            return self.send_json(200, [self.listing([post], "t3"), self.listing(comments, "t1")])
+
+        if parts[0] == "user" and parts[2:3] == ["about"]:
+            if not s.take("user_about"):
+                return self.throttled()
+            n = int(parts[1].replace("author", ""))
+            return self.send_json(200, {"kind": "t2", "data": dict(self.user(n), id=base36(1000 + n))})
+
+        if parts == ["api", "user_data_by_account_ids"]:
+            if not s.take("user_data"):
+                return self.throttled()
+            numbers = {f: int(f.split("_", 1)[1], 36) - 1000 for f in query.get("ids", "").split(",")[:100] if "_" in f}
+            users = {f: self.user(n) for f, n in numbers.items() if 0 <= n < s.authors}
+            if not users:
+                return self.send_json(404, {"message": "Not Found", "error": 404})
+            return self.send_json(200, users)
+
+        self.send_json(404, {"message": "Not Found", "error": 404})
+
+
+class MockReddit(MockSocial):
+    def __init__(self, comments: int = 5, authors: int = 200, replies: int = 0, **kwargs):
+        """
+        :param comments: top-level comments of every post
+        :param authors: distinct authors of the posts and comments
+        :param replies: replies of every comment, on every level of the tree
+        """
+        super().__init__(RedditHandler, **kwargs)
+        self.comments = comments
+        self.replies = replies
+        self.authors = authors
+        self.subreddits = set()
+
+    def subreddit_of(self, post_id: str) -> str:
+        number = int(post_id, 36)
+        return next((k for k in self.subreddits if zlib.crc32(k.encode()) % 100 == number % 100), "")
+
+    def praw(self):
+        """
+        praw client pointed at the stand-in
+        """
+        import praw
+
+        return praw.Reddit(client_id="benchmark", client_secret="benchmark", user_agent="benchmark",
+                           oauth_url=self.url, reddit_url=self.url, short_url=self.url,
+                           check_for_updates=False)
@@ -0,0 +1,215 @@
+"""
+Micro-benchmark for the post_processor enrichment stages.
+
+A fixed corpus of Mastodon (HTML), Reddit (title + selftext) and Bluesky (plain text)
+style posts, including some non-english ones, is run through each batch stage and
+through enrich_batch with and without a process pool for the keyword stage.
+
+--language compares the accuracy and throughput of langdetect alone against the tiered
+language identification of is_legal_context on a small labelled sample.
+
+--dedup replays overlapping timeline polls (each poll re-fetches most of the previous one)
+through post_processor.main with and without the dedup stage, against a Redis stand-in.
+
+Usage:
+    python postProcessorBenchmark.py --records 2000 --batch 100 --workers 4
+    python postProcessorBenchmark.py --language --records 2000
+    python postProcessorBenchmark.py --dedup --records 2000 --batch 40
+"""
+
+import argparse
+import copy
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import Flask
+
+BACKEND = os.path.join(os.path.dirname(__file__), "..", "backend", "fission")
+sys.path.insert(0, os.path.join(BACKEND, "functions", "post_processor"))
+sys.path.insert(0, os.path.join(BACKEND, "common"))
+import post_processor  # noqa: E402
+
+SENTENCES = [
+    "Rent in Melbourne went up again this month and the landlord wants another increase",
+    "What a game at the MCG tonight, the Pies were brilliant in the last quarter",
+    "Groceries at Coles cost twice what they did two years ago, this is getting ridiculous",
+    "The election debate was a mess, neither leader answered the question on housing",
+    "Public transport in Sydney is finally getting better with the new metro line",
+    "I love the coffee scene in Adelaide, the best flat white I have had all year",
+    "Power bills are through the roof and the government keeps saying relief is coming",
+    "Great turnout at the community garden today, thanks to everyone who helped out",
+]
+FOREIGN = [
+    "Die Mieten in Berlin steigen weiter und niemand weiß, wie es weitergehen soll",
+    "今日はとても良い天気ですね。公園で散歩しました。",
+    "Le prix de l'essence a encore augmenté cette semaine, c'est insupportable",
+]
+
+
+# (text, is english, language declared by the harvester)
+LABELLED = [
+    ("Rent in Melbourne went up again and the landlord wants more", True, "en"),
+    ("What a game at the MCG tonight, the Pies were brilliant", True, "en"),
+    ("Groceries cost twice what they did, this is ridiculous", True, None),
+    ("Housing crisis: 3 bed units now $750/wk in Brunswick #auspol", True, None),
+    ("Absolute scenes at Optus Stadium!!! Eagles win by a kick", True, "en"),
+    ("Petrol prices up 20c overnight, servo in Carlton at $2.15", True, None),
+    ("Voting early today, queues were short and the sausage sizzle was great", True, "en"),
+    ("Anyone know a decent mechanic near Footscray? Brakes squealing", True, None),
+    ("Interest rates on hold again, mortgage holders breathe a sigh of relief", True, "en"),
+    ("New tram timetable is a joke. 25 minutes between services on route 96", True, None),
+    ("Big win for the Swans tonight", True, "en"),
+    ("Energy bill relief payments explained", True, None),
+    ("Die Mieten in Berlin steigen weiter und niemand weiß, wie es weitergehen soll", False, "de"),
+    ("Heute war ein schöner Tag im Park mit der ganzen Familie", False, "en"),
+    ("Le prix de l'essence a encore augmenté cette semaine, c'est insupportable", False, "fr"),
+    ("Je ne sais pas quoi faire ce week-end, des idées ?", False, None),
+    ("El precio de la vivienda sigue subiendo en Madrid y Barcelona", False, "es"),
+    ("Hoy hace mucho calor en la ciudad, vamos a la playa", False, None),
+    ("Il governo ha annunciato nuove misure contro il caro energia", False, "it"),
+    ("Harga beras naik lagi minggu ini di Jakarta", False, None),
+    ("De huurprijzen in Amsterdam blijven maar stijgen", False, "nl"),
+    ("Het is een mooie dag in de stad en ik was blij", False, None),
+    ("Ich bin so müde, es war ein langer Tag in der Stadt", False, "en"),
+    ("今日はとても良い天気ですね。公園で散歩しました。", False, "ja"),
+    ("房价又涨了，年轻人根本买不起房子", False, None),
+    ("오늘 날씨가 정말 좋네요. 산책하러 가야겠어요", False, "ko"),
+    ("Цены на продукты снова выросли в этом месяце", False, None),
+    ("Os preços dos alimentos continuam subindo no Brasil", False, "pt"),
+]
+
+
+def labelled_sample(n: int) -> list:
+    """
+    n labelled texts drawn from LABELLED with a fixed seed, so duplicates (cross-posts) appear
+    """
+    rng = random.Random(90024)
+    return [rng.choice(LABELLED) for _ in range(n)]
+
+
+def language_benchmark(app: Flask, n: int):
+    duplicated = labelled_sample(n)
+    # numbered copies never hit the cache, as if every post was different
+    unique = [(f"{text} {i}", label, hint) for i, (text, label, hint) in enumerate(duplicated)]
+    variants = {
+        "langdetect only": lambda text, hint: post_processor.detect(text) == "en",
+        "tiered, no hints": lambda text, hint: post_processor.is_legal_context(text),
+        "tiered + hints": post_processor.is_legal_context,
+    }
+    print(f"labelled sample: {n} texts, {len(LABELLED)} distinct")
+    with app.app_context():
+        for sample_name, sample in (("duplicated", duplicated), ("unique", unique)):
+            for name, fn in variants.items():
+                post_processor._language_cache.clear()
+                for k in post_processor.language_stats:
+                    post_processor.language_stats[k] = 0
+                start = time.perf_counter()
+                correct = sum(fn(text, hint) == label for text, label, hint in sample)
+                elapsed = time.perf_counter() - start
+                print(f"{sample_name:>10} {name:>17}: accuracy {correct / n:6.1%}  {n / elapsed:10.0f} texts/s")
+            print(f"{sample_name:>10} tiers used by tiered + hints: {post_processor.language_stats}")
+
+
+def dedup_benchmark(app: Flask, n: int, batch: int):
+    from urllib.parse import urlparse
+    from enqueueBenchmark import start_redis_stand_in, redis_pool
+
+    url = urlparse(start_redis_stand_in())
+    redis_pool.DEFAULTS.update(REDIS_HOST=url.hostname, REDIS_PORT=url.port)
+    records = corpus(n)
+    # every poll returns `batch` posts, the newest quarter of them not seen by the previous poll
+    step = max(1, batch // 4)
+    polls = [records[i:i + batch] for i in range(0, n - batch + 1, step)]
+    print(f"{len(polls)} polls of {batch} posts, {n} distinct posts")
+
+    for enabled in (False, True):
+        post_processor.DEDUP_ENABLED = enabled
+        redis_pool.get_redis().flushall()
+        for k in post_processor.dedup_stats:
+            post_processor.dedup_stats[k] = 0
+        start = time.perf_counter()
+        for poll in polls:
+            with app.test_request_context("/", method="POST", json=poll):
+                post_processor.main()
+        elapsed = time.perf_counter() - start
+        print(f"dedup {'on ' if enabled else 'off'}: {elapsed:8.3f}s  {len(polls) * batch / elapsed:8.0f} records/s  "
+              f"{redis_pool.get_redis().llen(post_processor.OUTPUT_LIST)} records sent")
+        if enabled:
+            with app.app_context():
+                print(f"counters: {post_processor.dedup_stats}, filter: {post_processor.dedup_memory()}")
+
+
+def corpus(n: int) -> list:
+    """
+    Deterministic corpus of n records in the unified structure
+    """
+    records = []
+    for i in range(n):
+        text = SENTENCES[i % len(SENTENCES)] + ". " + SENTENCES[(i * 3 + 1) % len(SENTENCES)]
+        if i % 17 == 0:
+            text = FOREIGN[i % len(FOREIGN)]
+        platform = ("Mastodon", "Reddit", "Bluesky")[i % 3]
+        if platform == "Mastodon":
+            content = (f'<p>{text} <a href="https://mastodon.au/tags/auspol" class="mention hashtag" '
+                       f'rel="tag">#<span>auspol</span></a></p><p>post {i}</p>')
+        elif platform == "Reddit":
+            content = f"{text}\n\n{SENTENCES[(i + 5) % len(SENTENCES)]}"
+        else:
+            content = text
+        records.append({"platform": platform, "data": {"id": str(i), "content": content}})
+    return records
+
+
+def timed(label: str, n: int, fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    elapsed = time.perf_counter() - start
+    print(f"{label:>22}: {elapsed:8.3f}s  {n / elapsed:10.0f} records/s")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records", type=int, default=2000, help="Number of records in the corpus")
+    parser.add_argument("--batch", type=int, default=100, help="Records per invocation (KEDA listLength)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Processes for the keyword stage")
+    parser.add_argument("--language", action="store_true", help="Only run the language identification comparison")
+    parser.add_argument("--dedup", action="store_true", help="Only run the dedup stage comparison")
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.logger.disabled = True
+    if args.language:
+        return language_benchmark(app, args.records)
+    if args.dedup:
+        return dedup_benchmark(app, args.records, args.batch)
+
+    records = corpus(args.records)
+    n = len(records)
+    print(f"records: {n}, batch: {args.batch}, keyword workers: {args.workers}")
+
+    with app.app_context():
+        texts = timed("clean (BeautifulSoup)", n, post_processor.clean_contents, records)
+        english = timed("language (langdetect)", n, post_processor.detect_english, texts)
+        texts = [t for t, legal in zip(texts, english) if legal]
+        timed("sentiment (VADER)", len(texts), post_processor.sentiment_batch, texts)
+        timed("keywords (YAKE)", len(texts), post_processor.keywords_batch, texts)
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            post_processor.KEYWORD_WORKERS = args.workers
+            timed(f"keywords x{args.workers} procs", len(texts), post_processor.keywords_batch, texts, pool)
+
+            def run_batches(executor):
+                for i in range(0, n, args.batch):
+                    post_processor.enrich_batch(copy.deepcopy(records[i:i + args.batch]), executor)
+
+            post_processor.KEYWORD_WORKERS = 0
+            timed("enrich_batch", n, run_batches, None)
+            post_processor.KEYWORD_WORKERS = args.workers
+            timed(f"enrich_batch x{args.workers} procs", n, run_batches, pool)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+End-to-end latency per batch of the post_processor output sinks, from the enriched
+batch to the records being in the elastic list of a local Redis stand-in.
+
+- http per record: one POST per record to a local enqueue server (the previous behaviour)
+- http: one POST of the whole batch to the local enqueue server
+- redis: pipelined LPUSH of the whole batch
+- inprocess: hand-off to a Python callable
+
+Usage:
+    python postProcessorSinkBenchmark.py --batches 20 --batch 100
+"""
+
+import argparse
+import logging
+import os
+import statistics
+import sys
+import threading
+import time
+from urllib.parse import urlparse
+
+import redis
+from flask import Flask
+from werkzeug.serving import make_server
+
+from enqueueBenchmark import start_redis_stand_in, make_post, enqueue, redis_pool
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend", "fission", "functions", "post_processor"))
+import post_processor  # noqa: E402
+
+
+def start_enqueue_server() -> str:
+    """
+    Serve enqueue.main on /enqueue/<topic> the way the Fission router does
+    :return: base url of the server
+    """
+    app = Flask(__name__)
+    app.logger.disabled = True
+    app.add_url_rule("/enqueue/<topic>", "enqueue", lambda topic: enqueue.main(), methods=["POST"])
+    wsgi_app = app.wsgi_app
+
+    def with_topic(environ, start_response):
+        # the router passes the topic of the route as a header
+        environ["HTTP_X_FISSION_PARAMS_TOPIC"] = environ["PATH_INFO"].rsplit("/", 1)[-1]
+        return wsgi_app(environ, start_response)
+
+    app.wsgi_app = with_topic
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def send_http_per_record(records: list):
+    for record in records:
+        post_processor.requests.post(url=post_processor.QUEUE_ENDPOINT, json=record, timeout=5).raise_for_status()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batches", type=int, default=20, help="Number of batches per sink")
+    parser.add_argument("--batch", type=int, default=100, help="Records per batch (KEDA listLength)")
+    parser.add_argument("--redis-url", type=str, help="Use an existing Redis instead of the stand-in")
+    args = parser.parse_args()
+
+    url = args.redis_url or start_redis_stand_in()
+    parsed = urlparse(url)
+    redis_pool.DEFAULTS.update(REDIS_HOST=parsed.hostname, REDIS_PORT=parsed.port or 6379)
+    client = redis.Redis.from_url(url)
+
+    post_processor.QUEUE_ENDPOINT = f"{start_enqueue_server()}/enqueue/{post_processor.OUTPUT_LIST}"
+    handed_off = []
+    post_processor.handoff_handler = handed_off.extend
+
+    records = [make_post(i) for i in range(args.batch)]
+    for record in records:
+        record.update(sentiment=0.5, sentimentLabel="positive", keywords=["melbourne"])
+
+    app = Flask(__name__)
+    app.logger.disabled = True
+    sinks = {
+        "http per record": send_http_per_record,
+        "http": post_processor.send_http,
+        "redis": post_processor.send_redis,
+        "inprocess": post_processor.send_inprocess,
+    }
+    print(f"batches: {args.batches}, batch size: {args.batch}, redis: {url}")
+    with app.app_context():
+        for name, sink in sinks.items():
+            client.delete(post_processor.OUTPUT_LIST)
+            handed_off.clear()
+            latencies = []
+            for _ in range(args.batches):
+                start = time.perf_counter()
+                sink(records)
+                latencies.append((time.perf_counter() - start) * 1000)
+            delivered = len(handed_off) if name == "inprocess" else client.llen(post_processor.OUTPUT_LIST)
+            assert delivered == args.batches * args.batch, f"{name}: {delivered} records delivered"
+            print(f"{name:>16}: mean {statistics.mean(latencies):8.2f}ms  "
+                  f"p50 {statistics.median(latencies):8.2f}ms  max {max(latencies):8.2f}ms per batch")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""
+Unit tests of post_processor: the tiers of the language identification, the keyword process
+pool sized by the config map, and the dedup filter against a fakeredis server (day buckets,
+posts only marked as seen once the sink took them).
+
+Usage:
+    python postProcessorTest.py
+"""
+
+import json
+import logging
+import os
+import sys
+import time
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+from urllib.parse import urlparse
+
+from flask import Flask
+
+BACKEND = os.path.join(os.path.dirname(__file__), "..", "backend", "fission")
+sys.path.insert(0, os.path.join(BACKEND, "functions", "post_processor"))
+sys.path.insert(0, os.path.join(BACKEND, "common"))
+import post_processor  # noqa: E402
+import redis_pool  # noqa: E402
+from standIns import start_redis_stand_in, config_map  # noqa: E402
+
+ENGLISH = [
+    "The cost of living in Melbourne is getting worse and rents are up again",
+    "I think this is what they should have done about the housing crisis",
+    "Groceries cost twice what they did, this is ridiculous",
+]
+# latin script texts sharing stop words with english (in, is, was, also, so, we, of, at, de...)
+SHARED_STOP_WORDS = [
+    "Het is een mooie dag in de stad en ik was blij",
+    "We gaan morgen naar de markt, het is ook open op zondag",
+    "Ich bin so müde, es war ein langer Tag in der Stadt",
+    "Was ist also los in Berlin, die Mieten sind so hoch",
+    "Vi har det bra och solen skiner i dag",
+    "Jeg har også været i byen i dag, det var så fint",
+    "Je suis allé au marché et il était fermé",
+]
+
+
+class LanguageTest(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.context = self.app.app_context()
+        self.context.push()
+        for k in post_processor.language_stats:
+            post_processor.language_stats[k] = 0
+        post_processor._language_cache.clear()
+
+    def tearDown(self):
+        self.context.pop()
+
+    def test_english_accepted(self):
+        for text in ENGLISH:
+            self.assertTrue(post_processor.is_legal_context(text), text)
+            self.assertTrue(post_processor.is_legal_context(text, "en"), text)
+
+    def test_shared_stop_words_not_accepted_as_english(self):
+        for text in SHARED_STOP_WORDS:
+            self.assertFalse(post_processor.is_legal_context(text), text)
+            # a wrong english hint is double checked as well
+            self.assertFalse(post_processor.is_legal_context(text, "en"), text)
+
+    def test_shared_stop_words_left_to_langdetect(self):
+        for text in SHARED_STOP_WORDS:
+            post_processor.is_legal_context(text)
+        self.assertEqual(post_processor.language_stats["stopwords"], 0)
+        self.assertEqual(post_processor.language_stats["langdetect"], len(SHARED_STOP_WORDS))
+
+    def test_foreign_hint_dropped_without_langdetect(self):
+        self.assertFalse(post_processor.is_legal_context("De huurprijzen in Amsterdam blijven maar stijgen", "nl"))
+        self.assertEqual(post_processor.language_stats["hint"], 1)
+        self.assertEqual(post_processor.language_stats["langdetect"], 0)
+
+    def test_non_latin_dropped(self):
+        self.assertFalse(post_processor.is_legal_context("今日はとても良い天気ですね。公園で散歩しました。"))
+        self.assertEqual(post_processor.language_stats["ascii"], 1)
+
+
+class KeywordPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.settings = {}
+        patch = mock.patch.object(post_processor, "config", lambda k: config_map(self.settings, k))
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.addCleanup(self.set_workers, 0)
+
+    def set_workers(self, workers: int):
+        self.settings["KEYWORD_WORKERS"] = str(workers)
+        return post_processor.keyword_pool()
+
+    def test_no_pool_by_default(self):
+        self.assertIsNone(post_processor.keyword_pool())
+
+    def test_pool_follows_the_config_map(self):
+        pool = self.set_workers(2)
+        self.assertIsNotNone(pool)
+        # kept while the setting does not change
+        self.assertIs(self.set_workers(2), pool)
+        self.assertEqual(post_processor.keywords_batch(ENGLISH * 10, pool),
+                         post_processor.keywords_batch(ENGLISH * 10))
+        self.assertIsNot(self.set_workers(3), pool)
+        self.assertIsNone(self.set_workers(0))
+
+
+def record(post_id: str, content: str = "The cost of living in Melbourne is getting worse and rents are up again"):
+    return {"platform": "Mastodon", "version": 1.1, "fetchedAt": "2025-05-01T00:00:00Z", "sentiment": None,
+            "sentimentLabel": None, "keywords": [],
+            "data": {"id": post_id, "content": f"<p>{content}</p>", "language": None}}
+
+
+class DedupTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        logging.basicConfig(level=logging.CRITICAL)
+        url = urlparse(start_redis_stand_in())
+        redis_pool.DEFAULTS.update(REDIS_HOST=url.hostname, REDIS_PORT=url.port)
+        cls.app = Flask(__name__)
+        cls.app.logger.setLevel(logging.CRITICAL)
+
+    def setUp(self):
+        self.r = redis_pool.get_redis(decode_responses=True)
+        self.r.flushall()
+        self.received = []
+        self.failing = False
+        self.clock = [time.time()]
+        patches = [
+            mock.patch.object(post_processor, "handoff_handler", self.handoff),
+            mock.patch.object(post_processor, "config", lambda k: config_map({"POST_PROCESSOR_SINK": "inprocess"}, k)),
+            mock.patch.object(post_processor, "time", SimpleNamespace(time=lambda: self.clock[0],
+                                                                      monotonic=time.monotonic)),
+            mock.patch.object(post_processor, "DEDUP_ENABLED", True),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def handoff(self, records):
+        if self.failing:
+            raise ConnectionError("sink down")
+        self.received += [r["data"]["id"] for r in records]
+
+    def invoke(self, records) -> str:
+        with self.app.test_request_context("/", method="POST", data=json.dumps(records)):
+            return post_processor.main()
+
+    def test_duplicates_dropped_in_batch_and_across_batches(self):
+        self.invoke([record("1"), record("2"), record("1")])
+        self.assertEqual(self.received, ["1", "2"])
+        self.invoke([record("2"), record("3")])
+        self.assertEqual(self.received, ["1", "2", "3"])
+
+    def test_non_english_posts_remembered(self):
+        self.invoke([record("1", "Het is een mooie dag in de stad en ik was blij")])
+        self.assertEqual(self.received, [])
+        with self.app.app_context():
+            self.assertEqual(post_processor.drop_duplicates([record("1")]), [])
+
+    def test_failed_sink_does_not_mark_seen(self):
+        self.failing = True
+        # the error reaches the trigger, which delivers the batch again
+        with self.assertRaises(ConnectionError):
+            self.invoke([record("1"), record("2")])
+        self.assertEqual(self.r.keys(f"{post_processor.DEDUP_KEY_PREFIX}:*"), [])
+        # the batch delivered again is processed again
+        self.failing = False
+        self.invoke([record("1"), record("2")])
+        self.assertEqual(self.received, ["1", "2"])
+
+    def test_day_buckets(self):
+        day = post_processor.DEDUP_BUCKET
+        self.invoke([record("1")])
+        key = f"{post_processor.DEDUP_KEY_PREFIX}:{int(self.clock[0] // day)}"
+        self.assertEqual(self.r.smembers(key), {"mastodon_1"})
+        # the bucket is kept until its last possible id is DEDUP_TTL old
+        self.assertLessEqual(self.r.ttl(key), post_processor.DEDUP_TTL + day)
+        self.assertGreater(self.r.ttl(key), post_processor.DEDUP_TTL)
+
+        # a copy within DEDUP_TTL is dropped, whatever bucket it falls in
+        self.clock[0] += post_processor.DEDUP_TTL - 60
+        self.invoke([record("1"), record("2")])
+        self.assertEqual(self.received, ["1", "2"])
+        # ids of a new day go into a new bucket
+        self.assertEqual(len(self.r.keys(f"{post_processor.DEDUP_KEY_PREFIX}:*")), 2)
+
+        # past the buckets the ids are forgotten, even if the SET has not expired yet
+        self.clock[0] += post_processor.DEDUP_TTL + 2 * day
+        self.invoke([record("1")])
+        self.assertEqual(self.received, ["1", "2", "1"])
+
+    def test_buckets_cover_the_ttl(self):
+        day = post_processor.DEDUP_BUCKET
+        now = 1000 * day + 5
+        buckets = post_processor.dedup_buckets(now)
+        self.assertEqual(buckets[0], f"{post_processor.DEDUP_KEY_PREFIX}:1000")
+        oldest = int(buckets[-1].rsplit(":", 1)[1])
+        # the oldest bucket starts before now - DEDUP_TTL
+        self.assertLessEqual(oldest * day, now - post_processor.DEDUP_TTL)
+
+
+if __name__ == "__main__":
+    unittest.main()
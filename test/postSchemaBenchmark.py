@@ -0,0 +1,236 @@
+"""
+Benchmark of the post normalisation of the harvesters: the dict converters they used before
+post_schema (fetch_post_data of the Mastodon harvesters after parsing the dates of the JSON
+status, convert_bluesky_post_to_target_format of bluesky_harvester_tag, a fetchedAt taken
+per post and the body serialised by requests.post(json=...)) against post_schema (Post
+records, one fetchedAt per batch, post_schema.dumps).
+
+For every platform and mode it reports:
+- conversions per second of a page, and of a page converted and serialised to the bytes sent
+- bytes allocated per 1k posts (tracemalloc peak while the page is converted, the records
+  held, then serialised), and the size of the serialised bodies
+The raw statuses are parsed from JSON before every round, outside the measure, since the
+old Mastodon path changed them in place.
+
+Usage:
+    python postSchemaBenchmark.py --posts 1000 --rounds 20
+    python postSchemaBenchmark.py --json
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+from dateutil.parser import isoparse
+
+BACKEND = os.path.join(os.path.dirname(__file__), "..", "backend", "fission")
+sys.path.insert(0, os.path.join(BACKEND, "functions", "bluesky_harvester_tag"))
+sys.path.insert(0, os.path.join(BACKEND, "common"))
+import bluesky_harvester_tag  # noqa: E402
+import post_schema  # noqa: E402
+
+TERM = "cost of living"
+
+
+def mastodon_status(i: int) -> dict:
+    return {
+        "id": str(110000000000000000 + i),
+        "created_at": "2025-05-01T00:00:00.000Z",
+        "content": f"<p>Recorded status {i} about #melbourne and the cost of living in Melbourne</p>",
+        "language": "en",
+        "sensitive": False,
+        "favourites_count": i % 7,
+        "replies_count": i % 3,
+        "tags": [{"name": "melbourne", "url": "https://mastodon.au/tags/melbourne"},
+                 {"name": "costofliving", "url": "https://mastodon.au/tags/costofliving"}],
+        "url": f"https://mastodon.au/@bench/{i}",
+        "account": {
+            "id": str(1000 + i % 50),
+            "username": f"user{i % 50}",
+            "created_at": "2023-01-01T00:00:00.000Z",
+            "followers_count": 10,
+            "following_count": 20,
+        },
+    }
+
+
+def bluesky_post(i: int) -> dict:
+    did = f"did:plc:user{i % 50}"
+    return {
+        "uri": f"at://{did}/app.bsky.feed.post/3l{i:011d}",
+        "cid": f"bafyrei{i:011d}",
+        "author": {"did": did, "handle": f"user{i % 50}.bsky.social"},
+        "record": {
+            "$type": "app.bsky.feed.post",
+            "text": f"Recorded post {i} about {TERM} and the cost of living in Melbourne",
+            "createdAt": "2025-05-01T00:00:00.000Z",
+            "langs": ["en"],
+        },
+        "indexedAt": "2025-05-01T00:00:00.000Z",
+        "likeCount": i % 7,
+        "replyCount": i % 3,
+    }
+
+
+def old_from_json(status: dict) -> dict:
+    """
+    The Mastodon harvesters before post_schema: the dates of the JSON status parsed as Mastodon.py does
+    """
+    if status.get("created_at"):
+        status["created_at"] = isoparse(status["created_at"])
+    if status["account"].get("created_at"):
+        status["account"]["created_at"] = isoparse(status["account"]["created_at"])
+    return status
+
+
+def old_fetch_post_data(post: dict) -> dict:
+    """
+    fetch_post_data of the Mastodon harvesters before post_schema
+    """
+    data = {
+        "id": post.get("id"),
+        "createdAt": post.get("created_at").isoformat() + "Z" if post.get("created_at") else None,
+        "content": post.get("content"),
+        "language": post.get("language"),
+        "sensitive": post.get("sensitive", False),
+        "favouritesCount": post.get("favourites_count", 0),
+        "repliesCount": post.get("replies_count", 0),
+        "tags": [t["name"] for t in post.get("tags", [])],
+        "url": post.get("url"),
+
+        "account": {
+            "id": post["account"].get("id"),
+            "username": post["account"].get("username"),
+            "createdAt": post["account"]["created_at"].isoformat() + "Z"
+            if post["account"].get("created_at") else None,
+            "followersCount/linkKarma": post["account"].get("followers_count", 0),
+            "followingCount/commentKarma": post["account"].get("following_count", 0)
+        }
+    }
+
+    return {
+        "platform": "Mastodon",
+        "version": 1.1,
+        "fetchedAt": datetime.utcnow().isoformat() + "Z",
+        "sentiment": None,
+        "sentimentLabel": None,
+        "keywords": [],
+        "data": data
+    }
+
+
+def old_bluesky(post: dict, search_term: str) -> dict:
+    """
+    convert_bluesky_post_to_target_format before post_schema
+    """
+    record = post.get("record", {})
+    uri = post.get("uri", "")
+    langs = record.get("langs") or []
+    language = next((lang for lang in langs if lang.startswith("en")), langs[0] if langs else None)
+    return {
+        "platform": "Bluesky",
+        "version": 1.1,
+        "fetchedAt": datetime.now(timezone.utc).isoformat(timespec="seconds") + "Z",
+        "sentiment": None,
+        "sentimentLabel": None,
+        "keywords": [],
+        "data": {
+            "id": uri.split("/")[-1],
+            "createdAt": record.get("createdAt", ""),
+            "content": record.get("text", ""),
+            "language": language,
+            "sensitive": False,
+            "favouritesCount": post.get("likeCount", 0),
+            "repliesCount": post.get("replyCount", 0),
+            "tags": [search_term],
+            "url": f"https://bsky.app/profile/{post.get('author', {}).get('handle', '')}/post/{uri.split('/')[-1]}",
+            "account": {
+                "id": post.get("author", {}).get("did", ""),
+                "username": post.get("author", {}).get("handle", ""),
+                "createdAt": "1970-01-01T00:00:00Z",
+                "followersCount/linkKarma": 0,
+                "followingCount/commentKarma": 0
+            }
+        }
+    }
+
+
+def old_dumps(doc: dict) -> bytes:
+    # the body requests.post(json=...) builds
+    return json.dumps(doc, allow_nan=False).encode("utf-8")
+
+
+MODES = {
+    # (platform, mode): (convert a page, serialise a converted post)
+    ("Mastodon", "dict"): (lambda page: [old_fetch_post_data(old_from_json(s)) for s in page], old_dumps),
+    ("Mastodon", "post_schema"): (
+        lambda page: [post_schema.from_mastodon(s, f) for f in [post_schema.fetched_at()] for s in page],
+        post_schema.dumps),
+    ("Bluesky", "dict"): (lambda page: [old_bluesky(p, TERM) for p in page], old_dumps),
+    ("Bluesky", "post_schema"): (
+        lambda page: [bluesky_harvester_tag.convert_bluesky_post_to_target_format(p, TERM, f)
+                      for f in [post_schema.fetched_at()] for p in page],
+        post_schema.dumps),
+}
+
+
+def measure(raw: bytes, convert, dumps, rounds: int) -> dict:
+    convert_s = total_s = 0.0
+    for _ in range(rounds):
+        page = json.loads(raw)
+        start = time.perf_counter()
+        posts = convert(page)
+        converted = time.perf_counter()
+        bodies = [dumps(post) for post in posts]
+        convert_s += converted - start
+        total_s += time.perf_counter() - start
+
+    page = json.loads(raw)
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    posts = convert(page)
+    held = tracemalloc.get_traced_memory()[0] - before
+    bodies = [dumps(post) for post in posts]
+    peak = tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+
+    n = len(page) * rounds
+    per_1k = 1000 / len(page)
+    return {
+        "convert": n / convert_s,
+        "total": n / total_s,
+        "held": held * per_1k,
+        "peak": peak * per_1k,
+        "body": sum(len(b) for b in bodies) * per_1k,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--posts", type=int, default=1000, help="posts per page")
+    parser.add_argument("--rounds", type=int, default=20, help="pages converted per mode")
+    parser.add_argument("--json", action="store_true", help="serialise with the json fallback even if orjson is installed")
+    args = parser.parse_args()
+    if args.json:
+        post_schema.orjson = None
+
+    pages = {
+        "Mastodon": json.dumps([mastodon_status(i) for i in range(args.posts)]).encode(),
+        "Bluesky": json.dumps([bluesky_post(i) for i in range(args.posts)]).encode(),
+    }
+    print(f"{args.posts} posts per page, {args.rounds} rounds, serialiser "
+          f"{'orjson' if post_schema.orjson is not None else 'json'}")
+    for (platform, mode), (convert, dumps) in MODES.items():
+        row = measure(pages[platform], convert, dumps, args.rounds)
+        print(f"{platform:<9} {mode:<12} convert={row['convert']:>9.0f} posts/s "
+              f"convert+serialise={row['total']:>8.0f} posts/s  per 1k posts: records held={row['held'] / 1024:>6.0f}KiB "
+              f"peak allocated={row['peak'] / 1024:>6.0f}KiB body={row['body'] / 1024:>5.0f}KiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""
+Benchmark of the harvester queue publisher: the sequential requests.post loop the
+harvesters used before (a new connection and a 5s timeout per post) against
+queue_publisher.publish sending one post per request at several concurrency levels, and
+the whole tick as JSON array batches.
+
+A local enqueue stand-in (threaded HTTP server) answers every request after an injected
+latency. A fraction of the calls is slow (a stalled router) and a fraction fails with a
+503, which the publisher retries and the sequential loop does not.
+
+Usage:
+    python queuePublisherBenchmark.py --ticks 10 --posts 40 --latency 20 --slow 0.05 --fail 0.02
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend", "fission", "common"))
+import queue_publisher  # noqa: E402
+
+
+class EnqueueStandIn(BaseHTTPRequestHandler):
+    """
+    Answers POST /enqueue/<topic> (one post or a JSON array of posts) after the injected
+    latency, the ids of the posts received are counted in ids and the requests in requests
+    """
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    latency = 0.02
+    slow = 0.0
+    slow_latency = 1.0
+    fail = 0.0
+    received = 0
+    requests = 0
+    ids = Counter()
+    lock = threading.Lock()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        posts = json.loads(body)
+        posts = posts if isinstance(posts, list) else [posts]
+        delay = self.slow_latency if random.random() < self.slow else self.latency
+        time.sleep(delay)
+        if random.random() < self.fail:
+            status, reply = 503, b'{"error": "unavailable"}'
+        else:
+            status, reply = 200, b'{"status": "ok"}'
+            with EnqueueStandIn.lock:
+                EnqueueStandIn.received += len(posts)
+                for post in posts:
+                    EnqueueStandIn.ids[post.get("data", {}).get("id")] += 1
+        with EnqueueStandIn.lock:
+            EnqueueStandIn.requests += 1
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stand_in() -> str:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), EnqueueStandIn)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address
+    return f"http://{host}:{port}/enqueue/benchmark"
+
+
+def make_post(i: int) -> dict:
+    return {
+        "platform": "Mastodon",
+        "version": 1.1,
+        "fetchedAt": "2025-05-01T00:00:00.000000Z",
+        "sentiment": None,
+        "sentimentLabel": None,
+        "keywords": [],
+        "data": {
+            "id": str(110000000000000000 + i),
+            "createdAt": "2025-05-01T00:00:00Z",
+            "content": f"<p>Benchmark post number {i} about the cost of living in Melbourne</p>",
+            "sensitive": False,
+            "favouritesCount": i % 7,
+            "repliesCount": i % 3,
+            "tags": ["melbourne", "costofliving"],
+            "url": f"https://mastodon.au/@bench/{i}",
+            "account": {
+                "id": str(1000 + i % 50),
+                "username": f"user{i % 50}",
+                "createdAt": "2023-01-01T00:00:00Z",
+                "followersCount/linkKarma": 10,
+                "followingCount/commentKarma": 20
+            }
+        }
+    }
+
+
+def sequential_tick(endpoint: str, posts: list) -> dict:
+    """
+    The loop of the harvesters before the publisher
+    """
+    failed = 0
+    for post in posts:
+        try:
+            resp = requests.post(endpoint, json=post, timeout=5)
+            failed += resp.status_code >= 400
+        except Exception:
+            failed += 1
+    return {"failed": failed, "retries": 0}
+
+
+def run(name: str, tick, endpoint: str, ticks: int, posts: int, seed: int) -> dict:
+    random.seed(seed)
+    EnqueueStandIn.received = EnqueueStandIn.requests = 0
+    walls, failed, retries = [], 0, 0
+    for t in range(ticks):
+        batch = [make_post(t * posts + i) for i in range(posts)]
+        start = time.perf_counter()
+        result = tick(endpoint, batch)
+        walls.append(time.perf_counter() - start)
+        failed += result["failed"]
+        retries += result["retries"]
+    total = sum(walls)
+    row = {
+        "mode": name,
+        "tick_mean_ms": round(statistics.mean(walls) * 1000, 1),
+        "tick_max_ms": round(max(walls) * 1000, 1),
+        "posts_per_s": round(ticks * posts / total, 1),
+        "delivered": EnqueueStandIn.received,
+        "failed": failed,
+        "retries": retries,
+        "requests": EnqueueStandIn.requests,
+    }
+    print(f"{row['mode']:<16} tick mean={row['tick_mean_ms']:>8}ms max={row['tick_max_ms']:>8}ms "
+          f"{row['posts_per_s']:>8} posts/s delivered={row['delivered']}/{ticks * posts} "
+          f"failed={row['failed']} retries={row['retries']} requests={row['requests']}")
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ticks", type=int, default=10, help="timer ticks per mode")
+    parser.add_argument("--posts", type=int, default=40, help="posts per tick")
+    parser.add_argument("--latency", type=float, default=20, help="latency of the stand-in in ms")
+    parser.add_argument("--slow", type=float, default=0.05, help="fraction of slow calls")
+    parser.add_argument("--slow-latency", type=float, default=1000, help="latency of a slow call in ms")
+    parser.add_argument("--fail", type=float, default=0.02, help="fraction of calls answered with a 503")
+    parser.add_argument("--concurrency", default="1,4,8,16", help="publisher concurrency levels, one post per request")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    EnqueueStandIn.latency = args.latency / 1000
+    EnqueueStandIn.slow = args.slow
+    EnqueueStandIn.slow_latency = args.slow_latency / 1000
+    EnqueueStandIn.fail = args.fail
+    endpoint = start_stand_in()
+    print(f"{args.ticks} ticks x {args.posts} posts, latency={args.latency}ms, "
+          f"slow={args.slow:.0%} at {args.slow_latency}ms, fail={args.fail:.0%}")
+
+    run("sequential", sequential_tick, endpoint, args.ticks, args.posts, args.seed)
+    queue_publisher.DEFAULTS["PUBLISH_BATCH_SIZE"] = 1
+    for c in [int(c) for c in args.concurrency.split(",")]:
+        run(f"per post c={c}", lambda e, b, c=c: queue_publisher.publish(e, b, concurrency=c),
+            endpoint, args.ticks, args.posts, args.seed)
+    queue_publisher.DEFAULTS["PUBLISH_BATCH_SIZE"] = 500
+    run("batch", queue_publisher.publish, endpoint, args.ticks, args.posts, args.seed)
+
+
+if __name__ == "__main__":
+    main()
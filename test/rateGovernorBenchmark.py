@@ -0,0 +1,110 @@
+"""
+Simulation of several harvester workers sharing one Mastodon account: successful calls, 429s
+and wasted ticks when every worker finds the rate limit by failure (as the harvesters did
+before rate_governor) against workers taking their calls from the shared token bucket.
+
+Every worker is fired by its own timer (staggered) and pages up to --pages pages per tick
+within --tick seconds, from a MockMastodon stand-in with a small fixed window rate limit.
+Without the governor a worker ends its tick at the first 429; with it a worker waits for a
+token as long as the tick allows and feeds the X-RateLimit headers back into the bucket.
+
+Usage:
+    python rateGovernorBenchmark.py --workers 6 --seconds 30 --ratelimit 60 --window 10
+"""
+
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from urllib.parse import urlparse
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend", "fission", "common"))
+import rate_governor  # noqa: E402
+from enqueueBenchmark import start_redis_stand_in, redis_pool  # noqa: E402
+from mockSocial import MockMastodon  # noqa: E402
+
+CREDENTIAL = "benchmark-token"
+
+
+def worker(n: int, url: str, governed: bool, args, totals: Counter, lock: threading.Lock):
+    """
+    Timer ticks of one harvester worker until the end of the run
+    """
+    session = requests.Session()
+    end = time.monotonic() + args.seconds
+    # staggered timers, as pods started at different times
+    next_tick = time.monotonic() + n * args.tick / args.workers
+    counts = Counter()
+    while next_tick < end:
+        time.sleep(max(0.0, next_tick - time.monotonic()))
+        deadline = next_tick + args.tick
+        counts["ticks"] += 1
+        for _ in range(args.pages):
+            if governed:
+                start = time.monotonic()
+                if not rate_governor.acquire("mastodon", CREDENTIAL, max_wait=max(0.0, deadline - time.monotonic())):
+                    break
+                counts["wait"] += time.monotonic() - start
+            resp = session.get(f"{url}/api/v1/timelines/tag/melbourne", params={"limit": 40})
+            if governed:
+                rate_governor.observe("mastodon", CREDENTIAL, resp.headers, resp.status_code)
+            if resp.status_code == 429:
+                counts["429"] += 1
+                counts["wasted"] += 1
+                break
+            counts["ok"] += 1
+        next_tick += args.tick
+    with lock:
+        totals.update(counts)
+
+
+def run(server: MockMastodon, governed: bool, args) -> Counter:
+    server.restart()
+    redis_pool.get_redis(decode_responses=True).flushall()
+    totals, lock = Counter(), threading.Lock()
+    threads = [threading.Thread(target=worker, args=(n, server.url, governed, args, totals, lock))
+               for n in range(args.workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=6, help="concurrent harvester workers")
+    parser.add_argument("--seconds", type=float, default=30, help="length of a run")
+    parser.add_argument("--tick", type=float, default=2, help="seconds between the ticks of a worker")
+    parser.add_argument("--pages", type=int, default=10, help="pages a worker wants per tick")
+    parser.add_argument("--ratelimit", type=int, default=60, help="requests per window of the stand-in")
+    parser.add_argument("--window", type=int, default=10, help="seconds of a rate limit window")
+    parser.add_argument("--latency", type=float, default=30, help="latency of the stand-in in ms")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    server = MockMastodon(size=5000, latency=args.latency / 1000, ratelimit=args.ratelimit,
+                          window=args.window).start()
+    rate_governor.LIMITS["mastodon"] = (args.ratelimit, args.window)
+    url = urlparse(start_redis_stand_in())
+    redis_pool.DEFAULTS.update(REDIS_HOST=url.hostname, REDIS_PORT=url.port)
+
+    print(f"{args.workers} workers x {args.pages} pages every {args.tick}s for {args.seconds}s, "
+          f"limit {args.ratelimit} per {args.window}s")
+    for governed in (False, True):
+        rate_governor.stats.update(acquired=0, waits=0, waited=0.0, throttled=0, timeouts=0)
+        row = run(server, governed, args)
+        calls = row["ok"] + row["429"]
+        print(f"{'governed' if governed else 'by failure':<11} ok={row['ok']:>4} 429={row['429']:>4} "
+              f"({row['429'] / max(calls, 1):>5.1%} of calls) wasted ticks={row['wasted']:>3}/{row['ticks']} "
+              f"wait per call={row['wait'] / max(row['ok'], 1) * 1000:>6.1f}ms "
+              f"governor timeouts={rate_governor.stats['timeouts']}")
+
+
+if __name__ == "__main__":
+    main()
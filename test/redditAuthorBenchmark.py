@@ -0,0 +1,109 @@
+"""
+Benchmark of the Reddit author metadata: Reddit API calls and wall time per page of 8 posts
+with 5 comments each, reading created_utc from the lazy PRAW Redditor of every post and
+comment (as the Reddit harvesters did before reddit_authors) against reddit_authors.lookup
+with a cold cache, a warm pod (LRU) and a new pod on a warm Redis hash.
+
+The pages are served by the MockReddit stand-in of mockSocial, the Redis hash by a fakeredis
+server. The same authors come back across pages, as the prolific users of a subreddit do.
+
+Usage:
+    python redditAuthorBenchmark.py --pages 5 --authors 60 --latency 20
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+from collections import Counter
+from urllib.parse import urlparse
+
+from flask import Flask
+
+BACKEND = os.path.join(os.path.dirname(__file__), "..", "backend", "fission")
+sys.path.insert(0, os.path.join(BACKEND, "functions", "reddit_harvester_tag"))
+sys.path.insert(0, os.path.join(BACKEND, "common"))
+import reddit_harvester_tag  # noqa: E402
+import reddit_authors  # noqa: E402
+from enqueueBenchmark import start_redis_stand_in, redis_pool  # noqa: E402
+from mockSocial import MockReddit  # noqa: E402
+
+SUBREDDIT = "melbourne"
+
+
+def lazy_account(item) -> str:
+    """
+    The author lookup of the harvesters before reddit_authors: created_utc of the lazy Redditor
+    """
+    if item.author is None:
+        return None
+    try:
+        return item.author.created_utc
+    except Exception:
+        return None
+
+
+def run(app: Flask, reddit_server: MockReddit, mode: str, pages: int) -> dict:
+    reddit_server.restart()
+    reddit = reddit_server.praw()
+    sub = reddit.subreddit(SUBREDDIT)
+    if mode == "lookup, cold":
+        redis_pool.get_redis(decode_responses=True).flushall()
+    if mode in ("lookup, cold", "lookup, new pod"):
+        reddit_authors._lru.clear()
+
+    per_page = []
+    after = None
+    with app.app_context():
+        for _ in range(pages):
+            before = Counter(reddit_server.calls)
+            start = time.perf_counter()
+            posts = list(sub.new(limit=reddit_harvester_tag.LIMIT, params={"after": after} if after else None))
+            if mode == "lazy author":
+                for post in posts:
+                    lazy_account(post)
+                    post.comment_sort = "best"
+                    post.comments.replace_more(limit=0)
+                    for comment in list(post.comments)[:5]:
+                        lazy_account(comment)
+            else:
+                reddit_harvester_tag.convert_page(
+                    reddit, posts, SUBREDDIT, reddit_harvester_tag.DEFAULTS["COMMENT_LIMIT"], reddit_harvester_tag.DEFAULTS)
+            calls = Counter(reddit_server.calls) - before
+            calls["wall"] = time.perf_counter() - start
+            per_page.append(calls)
+            after = posts[-1].fullname
+
+    total = sum(per_page, Counter())
+    return {k: total[k] / pages for k in ("new", "comments", "user_about", "user_data", "wall")}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=5, help="pages per mode")
+    parser.add_argument("--authors", type=int, default=60, help="distinct authors in the subreddit")
+    parser.add_argument("--latency", type=float, default=20, help="latency of the Reddit stand-in in ms")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    # a large rate limit window so prawcore does not pace the requests
+    reddit_server = MockReddit(size=2000, comments=5, authors=args.authors, latency=args.latency / 1000,
+                               ratelimit=100000, window=600).start()
+    url = urlparse(start_redis_stand_in())
+    redis_pool.DEFAULTS.update(REDIS_HOST=url.hostname, REDIS_PORT=url.port)
+    app = Flask(__name__)
+    app.logger.setLevel(logging.ERROR)
+
+    print(f"{args.pages} pages of {reddit_harvester_tag.LIMIT} posts x 5 comments, {args.authors} authors, "
+          f"latency={args.latency}ms, Reddit API calls per page:")
+    for mode in ("lazy author", "lookup, cold", "lookup, warm pod", "lookup, new pod"):
+        row = run(app, reddit_server, mode, args.pages)
+        users = row["user_about"] + row["user_data"]
+        print(f"{mode:<17} listing={row['new']:.1f} comments={row['comments']:.1f} "
+              f"user/about={row['user_about']:>5.1f} user_data_by_account_ids={row['user_data']:.1f} "
+              f"user requests={users:>5.1f} wall={row['wall'] * 1000:>7.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
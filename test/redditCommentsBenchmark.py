@@ -0,0 +1,94 @@
+"""
+Benchmark of the comment stage of reddit_harvester_tag: bytes downloaded and wall time per
+page of 8 posts, fetching the whole comment tree of every post one after the other (as the
+harvester did before fetch_page_comments) against limit/depth slices of the comment listing
+fetched concurrently.
+
+The comment trees are served by the MockReddit stand-in of mockSocial, with --comments
+top-level comments per post and --replies replies per comment on three levels.
+
+Usage:
+    python redditCommentsBenchmark.py --pages 3 --comments 30 --replies 2 --latency 100
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+import praw
+from flask import Flask
+
+BACKEND = os.path.join(os.path.dirname(__file__), "..", "backend", "fission")
+sys.path.insert(0, os.path.join(BACKEND, "functions", "reddit_harvester_tag"))
+sys.path.insert(0, os.path.join(BACKEND, "common"))
+import reddit_harvester_tag  # noqa: E402
+from mockSocial import MockReddit  # noqa: E402
+
+SUBREDDIT = "melbourne"
+
+
+def full_tree(reddit, posts: list, limit: int, s: dict) -> list:
+    """
+    The comment stage before fetch_page_comments: the whole tree of every post, one after the other
+    """
+    threads = []
+    for post in posts:
+        post.comment_sort = "best"
+        post.comments.replace_more(limit=0)
+        comments = [c for c in post.comments if isinstance(c, praw.models.Comment) and c.depth == 0][:limit]
+        threads.append((post, comments))
+    return threads
+
+
+def run(reddit_server: MockReddit, stage, pages: int, s: dict) -> dict:
+    reddit_server.restart()
+    reddit = reddit_server.praw()
+    sub = reddit.subreddit(SUBREDDIT)
+    after, wall, kept = None, 0.0, 0
+    for _ in range(pages):
+        posts = list(sub.new(limit=reddit_harvester_tag.LIMIT, params={"after": after} if after else None))
+        after = posts[-1].fullname
+        start = time.perf_counter()
+        threads = stage(reddit, posts, s["COMMENT_LIMIT"], s)
+        wall += time.perf_counter() - start
+        kept += sum(len(comments) for _, comments in threads)
+    return {
+        "kb": reddit_server.bytes["comments"] / pages / 1024,
+        "wall": wall / pages * 1000,
+        "kept": kept / pages,
+        "calls": reddit_server.calls["comments"] / pages,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=3, help="pages per mode")
+    parser.add_argument("--comments", type=int, default=30, help="top-level comments per post")
+    parser.add_argument("--replies", type=int, default=2, help="replies per comment on every level")
+    parser.add_argument("--latency", type=float, default=100, help="latency of the Reddit stand-in in ms")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    # a large rate limit window so prawcore does not pace the requests
+    reddit_server = MockReddit(size=2000, comments=args.comments, replies=args.replies,
+                               latency=args.latency / 1000, ratelimit=100000, window=600).start()
+    app = Flask(__name__)
+    app.logger.setLevel(logging.ERROR)
+    defaults = dict(reddit_harvester_tag.DEFAULTS)
+
+    print(f"{args.pages} pages of {reddit_harvester_tag.LIMIT} posts, {args.comments} top-level comments x "
+          f"{args.replies} replies on 3 levels, latency={args.latency}ms, comment stage per page:")
+    modes = [("full tree, serial", full_tree, {})]
+    modes += [(f"slices depth={d} c={c}", reddit_harvester_tag.fetch_page_comments,
+               {"COMMENT_DEPTH": d, "COMMENT_CONCURRENCY": c}) for d, c in ((1, 1), (1, 4), (1, 8), (2, 4))]
+    with app.app_context():
+        for name, stage, overrides in modes:
+            row = run(reddit_server, stage, args.pages, dict(defaults, **overrides))
+            print(f"{name:<20} {row['kb']:>8.1f} KiB {row['wall']:>7.1f}ms "
+                  f"{row['calls']:.1f} requests {row['kept']:.1f} comments kept")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+"""
+Stand-ins shared by the tests and the benchmarks.
+
+- start_redis_stand_in: a fakeredis TCP server, so every Redis command pays a real socket round-trip
+- config_map: a ConfigMap read from a dict, a missing key behaves like a missing file
+"""
+
+import threading
+
+
+def start_redis_stand_in() -> str:
+    """
+    Start a fakeredis TCP server in a background thread
+    :return: redis url of the server
+    """
+    from fakeredis import TcpFakeServer
+
+    server = TcpFakeServer(("127.0.0.1", 0), server_type="redis")
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address
+    return f"redis://{host}:{port}/0"
+
+
+def config_map(settings: dict, k: str) -> str:
+    """
+    ConfigMap of a test or a benchmark, a missing key behaves like a missing file
+    """
+    if k not in settings:
+        raise FileNotFoundError(k)
+    return settings[k]